@@ -0,0 +1,268 @@
+"""
+Módulo: admission.py
+--------------------
+Control de admisión y descarte de carga para `/chat` y `/chat/stream`.
+
+Propósito:
+----------
+Ante una ráfaga, las requests se acumulaban esperando conexiones de la DB y
+capacidad del LLM hasta que el cliente cortaba; para entonces ya se habían
+pagado completions que nadie iba a leer. El controlador mantiene el throughput
+útil (goodput) estable bajo sobrecarga:
+
+- Como máximo `ADMISSION_MAX_CONCURRENCY` requests se atienden a la vez; el
+  resto espera en una cola acotada (`ADMISSION_MAX_QUEUE`).
+- Se rechaza de entrada con 503 + `Retry-After` si la cola está llena o si la
+  espera estimada (cola / concurrencia × tiempo de servicio promedio) supera
+  `ADMISSION_QUEUE_TIMEOUT`. Una request que igual no consigue lugar dentro de
+  ese plazo también recibe 503.
+- Si el cliente se desconecta (en cola o en vuelo), la request se cancela:
+  la cancelación llega hasta la llamada al LLM en curso.
+
+Notas:
+------
+- Es un middleware ASGI puro (como `MetricsMiddleware`). Lee primero el body
+  (pequeño en estas rutas) y luego escucha `http.disconnect` en paralelo.
+- Los límites son por proceso (cada worker de uvicorn tiene los suyos).
+"""
+
+import asyncio
+import json
+import math
+import time
+from typing import Optional
+
+from app.config import (
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+)
+from app.metrics import ADMISSION_REJECTIONS, CLIENT_DISCONNECTS
+
+# Rutas protegidas por el control de admisión (método POST)
+ADMISSION_PATHS = {"/chat", "/chat/stream"}
+
+# Peso de la última muestra en el promedio móvil del tiempo de servicio
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """
+    La request no puede admitirse; `retry_after` sugiere cuándo reintentar (segundos).
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Límite de concurrencia con cola acotada y rechazo temprano por espera estimada.
+
+    Args:
+        max_concurrency (int): Requests atendidas a la vez.
+        max_queue (int): Requests que pueden esperar un lugar.
+        queue_timeout (float): Espera máxima en cola (segundos).
+        enabled (bool): Si es `False`, se admite todo.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        enabled: bool = ADMISSION_ENABLED,
+    ):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self.in_flight = 0
+        self.queued = 0
+        self.service_time = 1.0  # estimación inicial (segundos), se ajusta con el tráfico
+        self._observed = False
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Atado al loop en uso (en tests cambia entre casos)
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            self.in_flight = self.queued = 0
+        return self._semaphore
+
+    def estimated_wait(self) -> float:
+        """
+        Espera estimada (segundos) de una request que se encole ahora.
+        """
+        if self.in_flight < self.max_concurrency:
+            return 0.0
+        return (self.queued + 1) / self.max_concurrency * self.service_time
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.estimated_wait()))
+
+    def _reject(self, reason: str) -> Overloaded:
+        self.rejected += 1
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        return Overloaded(reason, self._retry_after())
+
+    async def acquire(self) -> None:
+        """
+        Espera un lugar o lanza `Overloaded` si no se consigue a tiempo.
+        """
+        semaphore = self._get_semaphore()
+        if self.in_flight >= self.max_concurrency:
+            if self.queued >= self.max_queue:
+                raise self._reject("queue_full")
+            if self.estimated_wait() > self.queue_timeout:
+                raise self._reject("deadline")
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise self._reject("queue_timeout")
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self, service_seconds: float) -> None:
+        """
+        Libera el lugar y actualiza el tiempo de servicio promedio.
+        """
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+        if self._observed:
+            self.service_time += _SERVICE_TIME_ALPHA * (service_seconds - self.service_time)
+        else:
+            self.service_time, self._observed = service_seconds, True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queue_timeouts": self.timed_out,
+            "client_disconnects": self.cancelled,
+            "avg_service_ms": round(1000 * self.service_time, 2),
+            "estimated_wait_ms": round(1000 * self.estimated_wait(), 2),
+        }
+
+
+# Instancia única por proceso
+admission = AdmissionController()
+
+
+async def _send_overloaded(send, error: Overloaded) -> None:
+    body = json.dumps({"detail": "Servicio saturado, reintenta más tarde."}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(error.retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI que aplica `admission` a las rutas de chat y cancela la
+    request si el cliente se desconecta.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if (
+            scope["type"] != "http"
+            or not controller.enabled
+            or scope["method"] != "POST"
+            or scope["path"] not in ADMISSION_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # Leer el body completo antes de escuchar desconexiones
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body", False):
+                break
+
+        disconnected = asyncio.Event()
+        response_sent = False
+
+        async def send_tracking(message):
+            nonlocal response_sent
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def handle():
+            await controller.acquire()
+            start = time.perf_counter()
+            try:
+                await self.app(scope, replay_receive, send_tracking)
+            finally:
+                controller.release(time.perf_counter() - start)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        task = asyncio.ensure_future(handle())
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not task.done() and not response_sent:
+                # El cliente se fue: cancelar la request (y la llamada al LLM en curso)
+                controller.cancelled += 1
+                CLIENT_DISCONNECTS.inc()
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Overloaded):
+                    pass
+                return
+            try:
+                await task
+            except Overloaded as error:
+                await _send_overloaded(send, error)
+        finally:
+            if not task.done():
+                task.cancel()
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
@@ -0,0 +1,213 @@
+"""
+Módulo: archive.py
+------------------
+Archivo comprimido de conversaciones inactivas (almacenamiento frío).
+
+Propósito:
+----------
+Un debate inactivo hace días rara vez se vuelve a leer, y si se lee es
+completo; aun así cada turno ocupaba su fila en `messages` y sus entradas de
+índice. El archivador (lo ejecuta `retention_job` con `ARCHIVE_IDLE_DAYS`):
+
+- Toma en lotes las conversaciones sin actividad y empaqueta todos sus
+  mensajes en un blob JSON comprimido con zlib, en `message_archives` (una fila
+  por conversación), y borra sus filas de `messages`. Cada lote es una
+  transacción; las conversaciones con un turno en curso se saltean
+  (`FOR UPDATE SKIP LOCKED`).
+- `rehydrate()` hace el camino inverso: lo llama `get_conversation()`, así que
+  `/chat`, `/chat/stream` y el historial restauran la conversación en el
+  próximo acceso, sin cambios en los endpoints. Los mensajes vuelven con su
+  `id`, `seq` y `created_at` originales.
+
+Notas:
+------
+- La restauración empieza con `DELETE ... RETURNING` sobre el archivo: dos
+  requests simultáneas no restauran dos veces (la segunda espera y ya no lo
+  encuentra).
+- Si un turno entra justo durante el archivado, sus mensajes quedan en
+  `messages` con `seq` posteriores; la restauración los completa sin choques.
+- El blob se guarda con `STORAGE MAIN`: ya está comprimido, así que queda en
+  la misma página de la fila (sin tabla TOAST aparte) mientras entre.
+- Con `messages` particionada, los mensajes restaurados vuelven a la partición
+  de su fecha o, si ya se retiró, a `messages_default`.
+"""
+
+import asyncio
+import json
+import zlib
+from datetime import datetime
+from typing import Dict, List
+from uuid import UUID
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.config import ARCHIVE_BATCH_SIZE, ARCHIVE_COMPRESSION_LEVEL, RETENTION_BATCH_PAUSE
+from app.models import Message, MessageArchive, MessageRole
+
+# Versión del formato del blob (por si cambia el esquema de los mensajes)
+ARCHIVE_FORMAT = 1
+
+# Un lote de conversaciones inactivas sin archivar (bloqueadas hasta el COMMIT)
+_IDLE_CONVERSATIONS = """
+SELECT c.id FROM conversations c
+WHERE c.created_at < :cutoff AND c.updated_at < :cutoff
+  AND NOT EXISTS (SELECT 1 FROM message_archives a WHERE a.conversation_id = c.id)
+ORDER BY c.created_at
+LIMIT :limit
+FOR UPDATE SKIP LOCKED
+"""
+
+
+def pack_messages(rows, level: int = ARCHIVE_COMPRESSION_LEVEL) -> tuple:
+    """
+    Empaqueta filas de `messages` (en orden de `seq`) en JSON comprimido.
+
+    Returns:
+        tuple: (blob comprimido, tamaño del JSON sin comprimir).
+    """
+    raw = json.dumps(
+        {
+            "v": ARCHIVE_FORMAT,
+            "messages": [
+                [row.id, row.seq, row.role.value, row.content, row.token_count, row.created_at.isoformat()]
+                for row in rows
+            ],
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+    return zlib.compress(raw, level), len(raw)
+
+
+def unpack_messages(conv_id: UUID, payload: bytes) -> List[dict]:
+    """
+    Filas de `messages` listas para insertar a partir de un blob de `pack_messages`.
+    """
+    data = json.loads(zlib.decompress(payload))
+    if data.get("v") != ARCHIVE_FORMAT:
+        raise ValueError(f"Formato de archivo desconocido: {data.get('v')}")
+    return [
+        {
+            "id": id_,
+            "conversation_id": conv_id,
+            "seq": seq,
+            "role": MessageRole(role),
+            "content": content,
+            "token_count": token_count,
+            "created_at": datetime.fromisoformat(created_at),
+        }
+        for id_, seq, role, content, token_count, created_at in data["messages"]
+    ]
+
+
+class ConversationArchiver:
+    """
+    Archivado y restauración de conversaciones (ver docstring del módulo).
+
+    Args:
+        batch_size (int): Conversaciones por lote (una transacción cada uno).
+        pause (float): Pausa en segundos entre lotes.
+    """
+
+    def __init__(self, batch_size: int = ARCHIVE_BATCH_SIZE, pause: float = RETENTION_BATCH_PAUSE):
+        self.batch_size = max(batch_size, 1)
+        self.pause = pause
+
+        self.archived = 0
+        self.archived_messages = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.rehydrated = 0
+        self.rehydrated_messages = 0
+
+    async def archive_idle(self, conn: AsyncConnection, cutoff: datetime) -> int:
+        """
+        Archiva en lotes las conversaciones creadas y actualizadas antes de
+        `cutoff`. Devuelve cuántas se archivaron.
+        """
+        total = 0
+        while True:
+            count = await self._archive_batch(conn, cutoff)
+            total += count
+            if count < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def _archive_batch(self, conn: AsyncConnection, cutoff: datetime) -> int:
+        try:
+            result = await conn.execute(text(_IDLE_CONVERSATIONS), {"cutoff": cutoff, "limit": self.batch_size})
+            ids = [row.id for row in result]
+            if not ids:
+                await conn.commit()
+                return 0
+
+            rows = await conn.execute(
+                select(
+                    Message.conversation_id, Message.id, Message.seq, Message.role,
+                    Message.content, Message.token_count, Message.created_at,
+                )
+                .where(Message.conversation_id.in_(ids))
+                .order_by(Message.conversation_id, Message.seq)
+            )
+            grouped: Dict[UUID, list] = {conv_id: [] for conv_id in ids}
+            for row in rows:
+                grouped[row.conversation_id].append(row)
+
+            # También las conversaciones sin mensajes: quedan marcadas y no se reintentan
+            archives = []
+            for conv_id, messages in grouped.items():
+                payload, raw_bytes = pack_messages(messages)
+                archives.append({
+                    "conversation_id": conv_id,
+                    "payload": payload,
+                    "message_count": len(messages),
+                    "raw_bytes": raw_bytes,
+                })
+            await conn.execute(insert(MessageArchive), archives)
+            await conn.execute(delete(Message).where(Message.conversation_id.in_(ids)))
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        self.archived += len(archives)
+        self.archived_messages += sum(a["message_count"] for a in archives)
+        self.raw_bytes += sum(a["raw_bytes"] for a in archives)
+        self.stored_bytes += sum(len(a["payload"]) for a in archives)
+        return len(archives)
+
+    async def rehydrate(self, db: AsyncSession, conv_id: UUID) -> int:
+        """
+        Restaura en `messages` los mensajes archivados de una conversación, dentro
+        de la transacción de `db` (la confirma quien llama). Devuelve cuántos
+        mensajes se restauraron (0 si no estaba archivada).
+        """
+        result = await db.execute(
+            delete(MessageArchive)
+            .where(MessageArchive.conversation_id == conv_id)
+            .returning(MessageArchive.payload)
+        )
+        payload = result.scalar_one_or_none()
+        if payload is None:
+            return 0
+
+        rows = unpack_messages(conv_id, payload)
+        if rows:
+            await db.execute(insert(Message), rows)
+        self.rehydrated += 1
+        self.rehydrated_messages += len(rows)
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "archived_conversations": self.archived,
+            "archived_messages": self.archived_messages,
+            "compression_ratio": round(self.raw_bytes / self.stored_bytes, 2) if self.stored_bytes else 0.0,
+            "rehydrated_conversations": self.rehydrated,
+            "rehydrated_messages": self.rehydrated_messages,
+        }
+
+
+# Instancia única por proceso
+archiver = ConversationArchiver()
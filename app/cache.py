@@ -0,0 +1,243 @@
+"""
+Módulo: cache.py
+----------------
+Caché en memoria (por proceso) de conversaciones activas.
+
+Propósito:
+----------
+Evitar que cada turno vuelva a consultar en Postgres la conversación
+(topic, stance, engine) y la ventana reciente del historial, cuando este
+mismo worker atendió el turno anterior hace unos segundos.
+
+Características:
+----------------
+- Clave: UUID de la conversación.
+- Valor: metadatos de la conversación + la ventana reciente del historial: los
+  últimos `per_role` turnos de cada rol (`trim_history`), la misma ventana que
+  devuelve `load_recent_history`, así un hit y un miss arman el mismo contexto
+  aunque haya rachas de un mismo rol (mensajes agrupados, fallbacks).
+- Eviction LRU (`OrderedDict`), expiración por TTL y tope aproximado de memoria.
+- Contadores de hits, misses, evictions y expiraciones.
+
+Notas:
+------
+- La caché es local a cada proceso. Con varios workers, un turno atendido por
+  otro worker no se refleja aquí. Cada entrada guarda el `message_seq` que
+  debería tener la conversación en la DB: con `CONVERSATION_LOCK_ADVISORY`
+  (varios workers) el hit se valida contra la DB con una lectura por primary
+  key y, si no coincide, se descarta (`stale`). Sin esa validación, el TTL
+  acota la ventana de desactualización.
+- Todo corre en el event loop (un solo hilo), por lo que no se requieren locks.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID
+
+from app.config import (
+    CONVERSATION_CACHE_MAX_ENTRIES,
+    CONVERSATION_CACHE_TTL,
+    CONVERSATION_CACHE_MAX_BYTES,
+    HISTORY_WINDOW_PER_ROLE,
+)
+from app.schemas import MessageTurn
+from app.utils.trimming import trim_history
+
+# Costo fijo estimado (bytes) por entrada y por turno, además del texto
+_ENTRY_OVERHEAD = 512
+_TURN_OVERHEAD = 128
+
+
+@dataclass
+class ConversationState:
+    """
+    Estado cacheado de una conversación.
+
+    Atributos:
+        topic (str): Tema del debate.
+        stance (str): Postura fija del bot.
+        engine (str): Modelo usado en la conversación.
+        turns (List[MessageTurn]): Ventana reciente en orden cronológico.
+        summary (Optional[str]): Resumen de los turnos fuera de la ventana.
+        message_seq (Optional[int]): `conversations.message_seq` tras el último
+            turno cacheado (`None` si no se conoce).
+        expires_at (float): Instante (monotónico) en que la entrada expira.
+        size (int): Tamaño aproximado en bytes de la entrada.
+    """
+    topic: str
+    stance: str
+    engine: str
+    turns: List[MessageTurn]
+    summary: Optional[str] = None
+    message_seq: Optional[int] = None
+    expires_at: float = 0.0
+    size: int = field(default=0, repr=False)
+
+
+class ConversationCache:
+    """
+    Caché LRU con TTL y tope de memoria para el estado de conversaciones.
+
+    Args:
+        max_entries (int): Máximo de conversaciones en caché (0 desactiva la caché).
+        ttl (float): Segundos de vida de una entrada desde su última escritura.
+        max_bytes (int): Tope aproximado de memoria ocupada por las entradas.
+        per_role (int): Turnos a conservar de cada rol.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: int, per_role: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.per_role = per_role
+
+        self._entries: "OrderedDict[UUID, ConversationState]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, conv_id: UUID) -> Optional[ConversationState]:
+        """
+        Devuelve el estado cacheado de la conversación o `None` (miss o expirada).
+        """
+        state = self._entries.get(conv_id)
+        if state is None:
+            self.misses += 1
+            return None
+
+        if state.expires_at <= time.monotonic():
+            self._remove(conv_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(conv_id)
+        self.hits += 1
+        return state
+
+    def contains(self, conv_id: UUID) -> bool:
+        """
+        Indica si la conversación está cacheada y vigente, sin contar hit/miss
+        ni alterar su posición LRU.
+        """
+        state = self._entries.get(conv_id)
+        return state is not None and state.expires_at > time.monotonic()
+
+    def store(
+        self,
+        conv_id: UUID,
+        topic: str,
+        stance: str,
+        engine: str,
+        turns: Iterable[MessageTurn],
+        summary: Optional[str] = None,
+        message_seq: Optional[int] = None,
+    ) -> None:
+        """
+        Guarda (o reemplaza) el estado de una conversación tras un turno persistido.
+
+        Args:
+            conv_id (UUID): Identificador de la conversación.
+            topic (str): Tema del debate.
+            stance (str): Postura del bot.
+            engine (str): Modelo usado.
+            turns (Iterable[MessageTurn]): Historial reciente en orden cronológico;
+                solo se conservan los últimos `per_role` turnos de cada rol.
+            summary (str, opcional): Resumen de los turnos fuera de la ventana.
+            message_seq (int, opcional): `conversations.message_seq` tras el turno.
+        """
+        if not self.enabled:
+            return
+
+        buffer = trim_history(list(turns), self.per_role, self.per_role)
+        size = _ENTRY_OVERHEAD + len(summary or "") + sum(len(t.message) + _TURN_OVERHEAD for t in buffer)
+
+        if conv_id in self._entries:
+            self._remove(conv_id)
+
+        self._entries[conv_id] = ConversationState(
+            topic=topic,
+            stance=stance,
+            engine=engine,
+            turns=buffer,
+            summary=summary,
+            message_seq=message_seq,
+            expires_at=time.monotonic() + self.ttl,
+            size=size,
+        )
+        self._bytes += size
+        self._evict()
+
+    def update_summary(self, conv_id: UUID, summary: str) -> None:
+        """
+        Actualiza el resumen de una conversación cacheada (si está en caché),
+        sin alterar su posición LRU ni su TTL.
+        """
+        state = self._entries.get(conv_id)
+        if state is None:
+            return
+        delta = len(summary) - len(state.summary or "")
+        state.summary = summary
+        state.size += delta
+        self._bytes += delta
+        self._evict()
+
+    def invalidate(self, conv_id: UUID, stale: bool = False) -> None:
+        """
+        Elimina la conversación de la caché (si estaba). Con `stale=True` se
+        cuenta como entrada desactualizada (otro worker atendió un turno).
+        """
+        if conv_id in self._entries:
+            self._remove(conv_id)
+            if stale:
+                self.stale += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Métricas de la caché para monitoreo.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale": self.stale,
+        }
+
+    def _remove(self, conv_id: UUID) -> None:
+        state = self._entries.pop(conv_id)
+        self._bytes -= state.size
+
+    def _evict(self) -> None:
+        # Desalojar las entradas menos usadas hasta respetar ambos topes
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            conv_id, _ = next(iter(self._entries.items()))
+            self._remove(conv_id)
+            self.evictions += 1
+
+
+# Instancia compartida por el proceso
+conversation_cache = ConversationCache(
+    max_entries=CONVERSATION_CACHE_MAX_ENTRIES,
+    ttl=CONVERSATION_CACHE_TTL,
+    max_bytes=CONVERSATION_CACHE_MAX_BYTES,
+    per_role=HISTORY_WINDOW_PER_ROLE,
+)
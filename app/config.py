@@ -1,14 +1,28 @@
 # app/config.py
 import os
 
+# --- Motor de LLM ---
+# Motor activo: "openai" (API de OpenAI o compatible) o "local" (determinista, sin red)
+LLM_ENGINE = os.getenv("LLM_ENGINE", "openai")
+
+# Latencia simulada del motor local: segundos antes del primer token y tokens por segundo (0 = instantáneo)
+LOCAL_ENGINE_LATENCY = float(os.getenv("LOCAL_ENGINE_LATENCY", "0"))
+LOCAL_ENGINE_TOKENS_PER_SEC = float(os.getenv("LOCAL_ENGINE_TOKENS_PER_SEC", "0"))
+
+
 # --- OpenAI ---
+# Obligatoria solo si el motor activo es "openai"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+if not OPENAI_API_KEY and LLM_ENGINE == "openai":
     raise ValueError("Falta definir OPENAI_API_KEY en el .env")
 
 # Si no está definido, por defecto usa gpt-3.5-turbo
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 
+# URL base de la API compatible con OpenAI (vacía = API oficial).
+# Se usa para apuntar a un servidor falso local en benchmarks (scripts/fake_openai.py).
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
 
 # --- Postgres ---
 POSTGRES_USER = os.getenv("POSTGRES_USER", "kopi")
@@ -20,3 +34,214 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("Falta definir DATABASE_URL en el .env")
+
+
+# --- Historial ---
+# Turnos por rol que se leen de la DB en cada request (ventana del LLM, 10x10)
+HISTORY_WINDOW_PER_ROLE = int(os.getenv("HISTORY_WINDOW_PER_ROLE", "10"))
+
+# Paginación de GET /conversations/{id}/messages: tamaño de página por defecto y máximo
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "500"))
+
+
+# --- Caché de conversaciones (en memoria, por proceso) ---
+# Máximo de conversaciones cacheadas (0 = caché desactivada)
+CONVERSATION_CACHE_MAX_ENTRIES = int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", "10000"))
+
+# Segundos de vida de una entrada desde el último turno
+CONVERSATION_CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL", "300"))
+
+# Tope aproximado de memoria (bytes) para toda la caché
+CONVERSATION_CACHE_MAX_BYTES = int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+# --- Resúmenes de debates largos (compactación en segundo plano) ---
+# Activar/desactivar la compactación
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "1") == "1"
+
+# Turnos de usuario a partir de los cuales se resume lo que sale de la ventana
+SUMMARY_MIN_TURNS = int(os.getenv("SUMMARY_MIN_TURNS", "15"))
+
+# Cada cuántos turnos (pasado el umbral) se vuelve a compactar
+SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", "5"))
+
+# Máximo de mensajes que se incorporan al resumen por corrida
+SUMMARY_MAX_BATCH = int(os.getenv("SUMMARY_MAX_BATCH", "40"))
+
+# Longitud máxima del resumen (palabras)
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "200"))
+
+
+# --- LLM (cliente asíncrono) ---
+# Tiempo máximo permitido para respuestas del modelo (segundos)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+# Máximo de llamadas al LLM en vuelo por proceso (semáforo)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "200"))
+
+# Tokens máximos de la respuesta del modelo
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "300"))
+
+# Presupuesto total de contexto por request (system prompt + historial + respuesta)
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "3000"))
+
+# Tamaño del pool HTTP compartido hacia OpenAI
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+
+
+# --- Resiliencia del LLM (app/resilience.py) ---
+# Timeout adaptativo: p99 observado × multiplicador, acotado entre el mínimo y LLM_TIMEOUT
+LLM_ADAPTIVE_TIMEOUT = os.getenv("LLM_ADAPTIVE_TIMEOUT", "1") == "1"
+LLM_TIMEOUT_MIN = float(os.getenv("LLM_TIMEOUT_MIN", "2"))
+LLM_TIMEOUT_MULTIPLIER = float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "3"))
+
+# Latencias recientes que se conservan por tipo de llamada, y mínimo para estimar percentiles
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_LATENCY_MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", "20"))
+
+# Hedging: segunda llamada si la primera supera el p95 (duplica el costo de las llamadas lentas)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+
+# Circuit breaker: se abre si la tasa de error de las últimas llamadas supera el umbral
+LLM_BREAKER_ENABLED = os.getenv("LLM_BREAKER_ENABLED", "1") == "1"
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "15"))
+
+# Reintentos ante errores transitorios (backoff exponencial con jitter completo)
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.2"))
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "2"))
+
+
+# --- Control de admisión de /chat (app/admission.py) ---
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+
+# Requests de chat atendidas a la vez por proceso, y cuántas pueden esperar en cola
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+
+# Espera máxima en cola (segundos): si la espera estimada la supera se responde 503 + Retry-After
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+
+# --- Orden de turnos por conversación (app/conversation_lock.py) ---
+# Advisory lock de Postgres por conversación (necesario con varios workers/réplicas).
+# Retiene una conexión del pool durante cada turno de una conversación existente.
+CONVERSATION_LOCK_ADVISORY = os.getenv("CONVERSATION_LOCK_ADVISORY", "0") == "1"
+
+# Agrupar en un solo turno (una llamada al LLM) los mensajes que llegan mientras otro está en curso
+CONVERSATION_COALESCE = os.getenv("CONVERSATION_COALESCE", "0") == "1"
+CONVERSATION_COALESCE_MAX = int(os.getenv("CONVERSATION_COALESCE_MAX", "5"))
+
+
+# --- Escritura diferida de mensajes (app/write_behind.py) ---
+# Responder sin esperar el INSERT: los turnos se acumulan en memoria y se escriben en lotes.
+# Un turno puede perderse si el proceso muere sin apagarse (hasta WRITE_BEHIND_MAX_DELAY segundos de turnos).
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+
+# Durabilidad: espera máxima (segundos) de un turno en memoria y turnos por lote
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("WRITE_BEHIND_MAX_DELAY", "0.2"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+
+# Turnos pendientes como máximo; al llenarse, los nuevos turnos esperan lugar (backpressure)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "5000"))
+
+
+# --- Lotes de turnos (POST /chat/batch) ---
+# Mensajes como máximo por lote (413 si se supera)
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "1000"))
+
+# Turnos de un lote en curso a la vez (los de una misma conversación siempre van de a uno y en orden)
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+
+# --- Particionado y retención de mensajes (app/retention.py) ---
+# Convertir `messages` en tabla particionada por día al arrancar (toma un lock
+# exclusivo mientras dura: en bases grandes conviene hacerlo en una ventana de mantenimiento)
+MESSAGES_PARTITIONING = os.getenv("MESSAGES_PARTITIONING", "0") == "1"
+
+# Días adelante con partición ya creada
+MESSAGES_PARTITION_PREMAKE_DAYS = int(os.getenv("MESSAGES_PARTITION_PREMAKE_DAYS", "3"))
+
+# Días de mensajes que se conservan (0 = todos); las particiones más viejas se separan
+MESSAGES_RETENTION_DAYS = int(os.getenv("MESSAGES_RETENTION_DAYS", "0"))
+
+# Dejar las particiones separadas como tablas sueltas (para archivarlas) en vez de borrarlas
+MESSAGES_RETENTION_KEEP_DETACHED = os.getenv("MESSAGES_RETENTION_KEEP_DETACHED", "0") == "1"
+
+# Días sin actividad tras los que se borra una conversación (0 = nunca)
+CONVERSATION_TTL_DAYS = int(os.getenv("CONVERSATION_TTL_DAYS", "0"))
+
+# Días sin actividad tras los que los mensajes de una conversación se archivan
+# comprimidos en `message_archives` (0 = nunca); se restauran en el próximo acceso
+ARCHIVE_IDLE_DAYS = int(os.getenv("ARCHIVE_IDLE_DAYS", "0"))
+
+# Conversaciones por lote de archivado y nivel de compresión zlib (1-9)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+# Tarea de retención: activación, segundos entre corridas y conversaciones por lote de borrado
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "1") == "1"
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+
+# Pausa (segundos) entre lotes y espera máxima por un lock antes de reintentar en la próxima corrida
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+RETENTION_LOCK_TIMEOUT = float(os.getenv("RETENTION_LOCK_TIMEOUT", "2"))
+
+# --- Índice de aperturas (reutilización de tema/postura) ---
+# Activar/desactivar el índice
+TOPIC_INDEX_ENABLED = os.getenv("TOPIC_INDEX_ENABLED", "1") == "1"
+
+# Similitud coseno mínima para reutilizar tema y postura de una apertura previa
+TOPIC_INDEX_THRESHOLD = float(os.getenv("TOPIC_INDEX_THRESHOLD", "0.85"))
+
+# Máximo de aperturas indexadas por proceso
+TOPIC_INDEX_MAX_ENTRIES = int(os.getenv("TOPIC_INDEX_MAX_ENTRIES", "5000"))
+
+# Dimensión de los vectores (buckets de hashing de n-gramas)
+TOPIC_INDEX_DIM = int(os.getenv("TOPIC_INDEX_DIM", "512"))
+
+
+# --- Caché de respuestas del LLM (coincidencia exacta de prompt) ---
+# Activar/desactivar la caché
+REPLY_CACHE_ENABLED = os.getenv("REPLY_CACHE_ENABLED", "1") == "1"
+
+# Máximo de respuestas en el nivel en memoria (LRU, por proceso)
+REPLY_CACHE_MAX_ENTRIES = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", "2000"))
+
+# Segundos de vida de una respuesta cacheada (memoria y Postgres)
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "86400"))
+
+# Usar el nivel persistente (tabla `llm_reply_cache` en Postgres).
+# Desactivado por defecto: cada miss en memoria suma una consulta a la DB
+REPLY_CACHE_DB_ENABLED = os.getenv("REPLY_CACHE_DB_ENABLED", "0") == "1"
+
+
+# --- Engine de base de datos (pool de conexiones) ---
+# Log de todas las queries (solo para depuración: cuesta CPU en producción)
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+
+# Conexiones persistentes por proceso y conexiones extra permitidas en picos.
+# Máximo por worker = DB_POOL_SIZE + DB_MAX_OVERFLOW (multiplicar por la cantidad
+# de workers de uvicorn para dimensionar contra el límite de Postgres).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Segundos máximos esperando una conexión libre antes de fallar
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Segundos tras los cuales una conexión se recicla (-1 = nunca)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Verificar la conexión (ping) al sacarla del pool
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Tamaño de la caché de prepared statements de asyncpg por conexión
+# (0 si se usa PgBouncer en modo transaction)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
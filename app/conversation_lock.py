@@ -0,0 +1,222 @@
+"""
+Módulo: conversation_lock.py
+----------------------------
+Serialización de turnos por conversación y agrupación (coalescing) de mensajes.
+
+Propósito:
+----------
+Dos `/chat` concurrentes sobre el mismo `conversation_id` cargaban cada uno el
+historial y llamaban cada uno al LLM: ninguno veía el turno del otro y los
+mensajes quedaban intercalados por `created_at`. Aquí se ordenan:
+
+- Lock por conversación dentro del proceso (`asyncio.Lock` por clave, FIFO).
+  Las entradas se eliminan cuando nadie las usa.
+- Opcionalmente (`CONVERSATION_LOCK_ADVISORY`), un advisory lock de Postgres
+  por conversación para ordenar también entre workers/réplicas.
+- Opcionalmente (`CONVERSATION_COALESCE`), los mensajes que llegan mientras un
+  turno está en curso se agrupan: el siguiente turno los procesa todos juntos
+  con una sola llamada al LLM y todas esas requests reciben la misma respuesta.
+
+Notas:
+------
+- El advisory lock es de sesión y se toma en una conexión propia (autocommit)
+  que queda retenida mientras dura el turno, incluida la llamada al LLM: con
+  varios workers conviene dimensionar `DB_POOL_SIZE`/`DB_MAX_OVERFLOW` según
+  los turnos concurrentes esperados. Si la conexión se corta, Postgres libera
+  el lock.
+- Con la escritura diferida activa, antes de liberar el advisory lock se
+  esperan los turnos de la conversación que siguen en el buffer del proceso
+  (`TurnWriter.drain`): si no, el próximo worker leería un historial sin ellos.
+- Las conversaciones nuevas no necesitan lock: nadie más conoce su id.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import func, select
+
+from app.config import CONVERSATION_LOCK_ADVISORY, CONVERSATION_COALESCE, CONVERSATION_COALESCE_MAX
+from app.db import engine
+from app.write_behind import TurnWriter, turn_writer
+
+
+def advisory_key(conv_id: UUID) -> int:
+    """
+    Clave `bigint` del advisory lock de una conversación (primeros 8 bytes del UUID).
+    """
+    return int.from_bytes(conv_id.bytes[:8], "big", signed=True)
+
+
+@dataclass(eq=False)
+class _Pending:
+    message: str
+    result: asyncio.Future
+
+
+@dataclass
+class _KeyState:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    waiting: List[_Pending] = field(default_factory=list)
+    refs: int = 0
+
+
+@dataclass
+class Turn:
+    """
+    Turno autorizado a ejecutarse (o ya resuelto por otra request).
+
+    Atributos:
+        messages (List[str]): Mensajes de usuario a procesar, en orden de llegada.
+        result: Respuesta ya calculada si esta request se agrupó en el turno de otra
+            (`coalesced=True`); en ese caso no hay que procesar nada.
+    """
+    messages: List[str]
+    coalesced: bool = False
+    result: Any = None
+    _followers: List[_Pending] = field(default_factory=list, repr=False)
+    _resolved: bool = field(default=False, repr=False)
+
+    def resolve(self, result: Any) -> None:
+        """
+        Entrega la respuesta del turno a las requests agrupadas en él.
+        """
+        for pending in self._followers:
+            if not pending.result.done():
+                pending.result.set_result(result)
+        self._resolved = True
+
+
+class ConversationTurns:
+    """
+    Ordena los turnos de cada conversación (ver docstring del módulo).
+
+    Args:
+        advisory (bool): Tomar además el advisory lock de Postgres.
+        coalesce (bool): Agrupar los mensajes que esperan en un solo turno.
+        coalesce_max (int): Máximo de mensajes por turno agrupado.
+        writer (TurnWriter, opcional): Escritor cuyos turnos pendientes se escriben
+            antes de liberar el advisory lock (por defecto, `turn_writer`).
+    """
+
+    def __init__(
+        self,
+        advisory: bool = CONVERSATION_LOCK_ADVISORY,
+        coalesce: bool = CONVERSATION_COALESCE,
+        coalesce_max: int = CONVERSATION_COALESCE_MAX,
+        writer: Optional[TurnWriter] = None,
+    ):
+        self.advisory = advisory
+        self.coalesce = coalesce
+        self.coalesce_max = max(coalesce_max, 1)
+        self.writer = writer or turn_writer
+        self._keys: Dict[UUID, _KeyState] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.turns = 0
+        self.waited = 0
+        self.coalesced_messages = 0
+
+    def _state(self, conv_id: UUID) -> _KeyState:
+        # Los locks quedan atados al loop en uso (en tests cambia entre casos)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._keys.clear()
+            self._loop = loop
+        state = self._keys.get(conv_id)
+        if state is None:
+            state = self._keys[conv_id] = _KeyState()
+        return state
+
+    @asynccontextmanager
+    async def turn(self, conv_id: UUID, message: str, coalesce: Optional[bool] = None) -> AsyncIterator[Turn]:
+        """
+        Espera el turno de `message` en la conversación `conv_id`.
+
+        Uso:
+            async with conversation_turns.turn(conv_id, message) as turn:
+                if turn.coalesced:
+                    return turn.result
+                response = ...  # procesar turn.messages
+                turn.resolve(response)
+
+        Args:
+            conv_id (UUID): Conversación.
+            message (str): Mensaje del usuario de esta request.
+            coalesce (bool, opcional): Permitir agrupar este mensaje (default: `self.coalesce`).
+                `/chat/stream` no agrupa.
+        """
+        coalesce = self.coalesce if coalesce is None else coalesce
+        state = self._state(conv_id)
+        state.refs += 1
+        pending = _Pending(message, asyncio.get_running_loop().create_future())
+        if coalesce:
+            state.waiting.append(pending)
+
+        try:
+            if state.lock.locked():
+                self.waited += 1
+            await state.lock.acquire()
+            try:
+                if pending.result.done():
+                    # Otro turno ya procesó este mensaje
+                    yield Turn(messages=[message], coalesced=True, result=pending.result.result())
+                    return
+
+                if coalesce:
+                    batch = state.waiting[:self.coalesce_max]
+                    del state.waiting[:self.coalesce_max]
+                else:
+                    batch = [pending]
+                turn = Turn(messages=[p.message for p in batch], _followers=[p for p in batch if p is not pending])
+                self.turns += 1
+                self.coalesced_messages += len(turn._followers)
+
+                try:
+                    async with self._advisory_lock(conv_id):
+                        yield turn
+                finally:
+                    if not turn._resolved:
+                        # El turno falló: los mensajes agrupados vuelven a la cola
+                        # y los procesa la próxima request que tome el lock
+                        state.waiting[:0] = turn._followers
+            finally:
+                state.lock.release()
+        finally:
+            if pending in state.waiting:
+                state.waiting.remove(pending)
+            state.refs -= 1
+            if state.refs == 0 and self._keys.get(conv_id) is state:
+                del self._keys[conv_id]
+
+    @asynccontextmanager
+    async def _advisory_lock(self, conv_id: UUID) -> AsyncIterator[None]:
+        if not self.advisory:
+            yield
+            return
+
+        key = advisory_key(conv_id)
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(select(func.pg_advisory_lock(key)))
+            try:
+                yield
+                # Turno escrito en la DB antes de que otro worker tome el lock
+                await self.writer.drain(conv_id)
+            finally:
+                await conn.execute(select(func.pg_advisory_unlock(key)))
+
+    def stats(self) -> dict:
+        return {
+            "active_conversations": len(self._keys),
+            "turns": self.turns,
+            "waited": self.waited,
+            "coalesced_messages": self.coalesced_messages,
+            "advisory": self.advisory,
+            "coalesce": self.coalesce,
+        }
+
+
+# Instancia única por proceso
+conversation_turns = ConversationTurns()
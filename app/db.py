@@ -4,22 +4,104 @@
 # usando SQLAlchemy en modo asíncrono.
 # --------------------------------------------
 
-import os
+import time
 
-from app.config import DATABASE_URL
+from app.config import (
+    DATABASE_URL,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_CACHE_SIZE,
+)
+
+from app.metrics import POOL_CHECKOUT_SECONDS
 
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # Base declarativa para que los modelos la usen si no la importan aparte
 Base = declarative_base()
 
-# Crea el engine asíncrono
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,        # True = log de todas las queries 
-    future=True
-)
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """
+    Pool de conexiones que mide la espera al pedir una conexión (checkout).
+
+    Una espera alta indica que el pool está subdimensionado para la carga
+    (todas las conexiones en uso): ver `pool_stats()`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds += elapsed
+            self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+            POOL_CHECKOUT_SECONDS.observe(elapsed)
+
+
+def engine_options(url: str) -> dict:
+    """
+    Opciones del engine a partir de la configuración (`DB_*`).
+
+    La caché de prepared statements solo aplica al driver asyncpg.
+    """
+    options = {
+        "echo": DB_ECHO,
+        "future": True,
+        "poolclass": MeteredPool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+# Crea el engine asíncrono (pool y logging configurables con DB_*)
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+
+def pool_stats() -> dict:
+    """
+    Métricas del pool de conexiones del proceso: conexiones en uso, libres,
+    overflow y tiempo de espera al pedir una conexión.
+    """
+    pool: MeteredPool = engine.sync_engine.pool
+    checkouts = pool.checkouts
+    return {
+        "size": pool.size(),
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "checkouts": checkouts,
+        "timeouts": pool.timeouts,
+        "avg_wait_ms": round(1000 * pool.wait_seconds / checkouts, 4) if checkouts else 0.0,
+        "max_wait_ms": round(1000 * pool.max_wait_seconds, 4),
+    }
+
 
 # Sessionmaker que genera sesiones asíncronas
 AsyncSessionLocal = sessionmaker(
@@ -30,6 +112,66 @@ AsyncSessionLocal = sessionmaker(
     autocommit=False
 )
 
+# Cambios de esquema idempotentes para bases ya existentes.
+# `create_all` solo crea tablas faltantes: no agrega columnas a tablas previas.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS token_count INTEGER",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary_message_id BIGINT",
+    # Número de secuencia por conversación (`messages.seq`, contador en `conversations.message_seq`)
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_seq BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT",
+    # Numerar una sola vez los mensajes previos (por created_at, id) y fijar NOT NULL;
+    # una vez aplicado, el chequeo sobre el catálogo hace que no se repita
+    """
+    DO $$
+    BEGIN
+      IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'messages' AND column_name = 'seq' AND is_nullable = 'YES'
+      ) THEN
+        UPDATE messages m SET seq = numbered.seq
+        FROM (
+          SELECT id, row_number() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq
+          FROM messages
+        ) AS numbered
+        WHERE m.id = numbered.id AND m.seq IS NULL;
+
+        UPDATE conversations c SET message_seq = last.seq
+        FROM (SELECT conversation_id, max(seq) AS seq FROM messages GROUP BY conversation_id) AS last
+        WHERE c.id = last.conversation_id;
+
+        ALTER TABLE messages ALTER COLUMN seq SET NOT NULL;
+      END IF;
+    END$$
+    """,
+    # Con `messages` particionada el índice ya existe (no único, ver app/retention.py)
+    """
+    DO $$
+    BEGIN
+      IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass) THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_conversation_seq
+          ON messages (conversation_id, seq) INCLUDE (role);
+      END IF;
+    END$$
+    """,
+    # Reemplazado por idx_messages_conversation_seq: sin uso, solo encarecía cada INSERT
+    "DROP INDEX IF EXISTS idx_messages_conversation_created_at",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations (created_at)",
+    # El archivo de mensajes ya viene comprimido (zlib): guardarlo en línea, sin tabla TOAST aparte
+    "ALTER TABLE message_archives ALTER COLUMN payload SET STORAGE MAIN",
+]
+
+
+async def apply_schema_upgrades(conn) -> None:
+    """
+    Aplica los cambios de `SCHEMA_UPGRADES` sobre una conexión abierta.
+    Todos son idempotentes, por lo que se ejecutan en cada arranque.
+    """
+    for statement in SCHEMA_UPGRADES:
+        await conn.execute(text(statement))
+
+
 # Dependency que inyecta la sesión en los endpoints de FastAPI
 async def get_db():
     """
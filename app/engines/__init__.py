@@ -0,0 +1,82 @@
+"""
+Paquete: engines
+----------------
+Motores de LLM intercambiables y su registro.
+
+- `openai` (default): API de OpenAI o compatible (`app/engines/openai_engine.py`).
+- `local`: motor determinista sin red (`app/engines/local.py`).
+
+El motor activo se elige con `LLM_ENGINE`. Cada motor se instancia una sola
+vez por proceso; `close_engines()` libera sus recursos en el shutdown.
+
+Para agregar un motor:
+    register_engine("mi_motor", MiMotor)   # MiMotor hereda de LLMEngine
+"""
+
+from typing import Callable, Dict, List, Optional
+
+from app.config import LLM_ENGINE
+from app.engines.base import LLMEngine, parse_json_object
+
+_factories: Dict[str, Callable[[], LLMEngine]] = {}
+_instances: Dict[str, LLMEngine] = {}
+
+
+def register_engine(name: str, factory: Callable[[], LLMEngine]) -> None:
+    """
+    Registra (o reemplaza) la fábrica de un motor bajo `name`.
+    """
+    _factories[name] = factory
+    _instances.pop(name, None)
+
+
+def available_engines() -> List[str]:
+    return sorted(_factories)
+
+
+def get_engine(name: Optional[str] = None) -> LLMEngine:
+    """
+    Devuelve la instancia del motor `name` (por defecto, `LLM_ENGINE`).
+
+    Raises:
+        ValueError: Si el motor no está registrado.
+    """
+    name = name or LLM_ENGINE
+    engine = _instances.get(name)
+    if engine is None:
+        factory = _factories.get(name)
+        if factory is None:
+            raise ValueError(f"Motor de LLM desconocido: '{name}' (disponibles: {', '.join(available_engines())})")
+        engine = _instances[name] = factory()
+    return engine
+
+
+async def close_engines() -> None:
+    """
+    Cierra los motores instanciados. Se invoca en el shutdown de la app.
+    """
+    for engine in list(_instances.values()):
+        await engine.aclose()
+
+
+def _openai_engine() -> LLMEngine:
+    from app.engines.openai_engine import OpenAIEngine
+    return OpenAIEngine()
+
+
+def _local_engine() -> LLMEngine:
+    from app.engines.local import LocalEngine
+    return LocalEngine()
+
+
+register_engine("openai", _openai_engine)
+register_engine("local", _local_engine)
+
+__all__ = [
+    "LLMEngine",
+    "parse_json_object",
+    "register_engine",
+    "available_engines",
+    "get_engine",
+    "close_engines",
+]
@@ -0,0 +1,124 @@
+"""
+Módulo: engines/base.py
+-----------------------
+Interfaz común de los motores de LLM.
+
+Un motor sabe hacer tres cosas con una lista de mensajes en formato chat
+(`[{"role": ..., "content": ...}]`):
+
+- `complete()`      → respuesta completa como texto.
+- `stream()`        → la misma respuesta, fragmento a fragmento.
+- `complete_json()` → salida estructurada (objeto JSON) para el primer turno
+                      y la detección de tema/postura.
+
+Trimming, presupuesto de tokens, caché de respuestas, semáforo de concurrencia,
+métricas y fallbacks viven en `app/llm.py` y aplican a cualquier motor.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List, Optional
+
+
+def parse_json_object(text: Optional[str]) -> Optional[dict]:
+    """
+    Extrae un objeto JSON de la salida del modelo de forma tolerante.
+
+    Acepta el JSON puro, envuelto en bloques de código (```json ... ```) o
+    rodeado de texto: se toma desde la primera `{` hasta la última `}`.
+
+    Args:
+        text (str): Texto devuelto por el modelo.
+
+    Returns:
+        Optional[dict]: El objeto decodificado, o `None` si no hay JSON válido.
+    """
+    if not text:
+        return None
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class LLMEngine(ABC):
+    """
+    Motor de LLM intercambiable (ver el registro en `app/engines/__init__.py`).
+
+    Atributos:
+        name (str): Clave del motor en el registro (`LLM_ENGINE`).
+    """
+
+    name: str = ""
+
+    @property
+    def label(self) -> str:
+        """
+        Identificador que se guarda en `conversations.engine` y se devuelve en la API.
+        """
+        return self.name
+
+    @abstractmethod
+    async def complete(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+        json_mode: bool = False,
+    ) -> str:
+        """
+        Genera la respuesta completa a `messages`.
+
+        Args:
+            messages (List[dict]): Mensajes en formato chat (system + historial).
+            temperature (float): Temperatura de muestreo.
+            max_tokens (int): Tokens máximos de la respuesta.
+            timeout (float): Tiempo máximo de la llamada (segundos).
+            json_mode (bool): Pedir al motor que responda un objeto JSON.
+
+        Returns:
+            str: Texto generado.
+        """
+
+    @abstractmethod
+    def stream(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        """
+        Genera la respuesta a `messages` como fragmentos de texto (async generator).
+        """
+
+    async def complete_json(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+    ) -> Optional[dict]:
+        """
+        Salida estructurada: pide un objeto JSON y lo decodifica.
+
+        Returns:
+            Optional[dict]: El objeto, o `None` si la salida no es JSON válido.
+        """
+        text = await self.complete(
+            messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout, json_mode=True,
+        )
+        return parse_json_object(text)
+
+    async def aclose(self) -> None:
+        """
+        Libera recursos del motor (conexiones). Se invoca en el shutdown de la app.
+        """
@@ -0,0 +1,144 @@
+"""
+Módulo: engines/local.py
+------------------------
+Motor de LLM local y determinista (sin red ni API key).
+
+Sirve para desarrollo, tests y benchmarks reproducibles: la misma lista de
+mensajes produce siempre la misma respuesta.
+
+Cómo responde:
+--------------
+- Respuestas normales: una plantilla elegida con un hash (crc32) del último
+  mensaje del usuario, completada con el tema y la postura que se leen del
+  system prompt del debate (`build_system_prompt` en `app/main.py`).
+- Salida estructurada (`json_mode`): un JSON con `topic`, `stance` y `reply`
+  derivados del enunciado del usuario (compatible con `open_debate` y
+  `detect_topic_and_stance`).
+- Streaming: la misma respuesta, palabra por palabra.
+
+Latencia simulada (ver `app/config.py`):
+- LOCAL_ENGINE_LATENCY        → segundos antes del primer token (default 0).
+- LOCAL_ENGINE_TOKENS_PER_SEC → velocidad de generación (0 = instantánea).
+"""
+
+import asyncio
+import json
+import re
+import zlib
+from typing import AsyncIterator, List, Tuple
+
+from app.config import LOCAL_ENGINE_LATENCY, LOCAL_ENGINE_TOKENS_PER_SEC
+from app.engines.base import LLMEngine
+
+_TOPIC_RE = re.compile(r"tema permitido en esta conversación es: '(.+?)'")
+_STANCE_RE = re.compile(r"postura fija e inmutable es: '(.+?)'")
+_STATEMENT_RE = re.compile(r'Enunciado: "(.*)"', re.DOTALL)
+
+_TEMPLATES = (
+    "Entiendo tu punto, pero sobre {topic} sostengo que {stance}. Los datos y la experiencia respaldan esta posición.",
+    "No estoy de acuerdo. En {topic} la evidencia es clara: {stance}. Piensa en las consecuencias prácticas.",
+    "Tu argumento no se sostiene. Respecto de {topic}, mantengo que {stance}, y la historia lo demuestra.",
+    "Es una idea interesante, pero insisto: {stance}. Cualquier análisis serio de {topic} llega a esa conclusión.",
+)
+
+
+def _last_user_message(messages: List[dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return (messages[-1].get("content") or "") if messages else ""
+
+
+def _debate_context(messages: List[dict]) -> Tuple[str, str]:
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    topic = _TOPIC_RE.search(system)
+    stance = _STANCE_RE.search(system)
+    return (
+        topic.group(1) if topic else "este tema",
+        stance.group(1) if stance else "la postura contraria es la correcta",
+    )
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    words = text.split()
+    return " ".join(words[:max(1, max_tokens)])
+
+
+class LocalEngine(LLMEngine):
+    """
+    Motor determinista basado en plantillas.
+
+    Args:
+        latency (float): Segundos de espera antes de responder.
+        tokens_per_sec (float): Velocidad simulada de generación (0 = sin espera).
+    """
+
+    name = "local"
+
+    def __init__(self, latency: float = LOCAL_ENGINE_LATENCY, tokens_per_sec: float = LOCAL_ENGINE_TOKENS_PER_SEC):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+
+    def reply_for(self, messages: List[dict], max_tokens: int) -> str:
+        """
+        Respuesta en texto para `messages` (sin latencia simulada).
+        """
+        topic, stance = _debate_context(messages)
+        seed = zlib.crc32(_last_user_message(messages).encode("utf-8"))
+        template = _TEMPLATES[seed % len(_TEMPLATES)]
+        return _truncate(template.format(topic=topic, stance=stance), max_tokens)
+
+    def json_for(self, messages: List[dict], max_tokens: int) -> str:
+        """
+        Salida estructurada con `topic`, `stance` y `reply` para el primer turno.
+        """
+        prompt = " ".join(m.get("content") or "" for m in messages)
+        match = _STATEMENT_RE.search(prompt)
+        statement = (match.group(1) if match else _last_user_message(messages)).strip()
+        topic = " ".join(statement.split()[:8]) or "general"
+        stance = f"No es cierto que {topic[:1].lower()}{topic[1:]}"
+        debate = [
+            {"role": "system", "content": (
+                f"El ÚNICO tema permitido en esta conversación es: '{topic}'. "
+                f"Tu postura fija e inmutable es: '{stance}'."
+            )},
+            {"role": "user", "content": statement},
+        ]
+        return json.dumps(
+            {"topic": topic, "stance": stance, "reply": self.reply_for(debate, max_tokens)},
+            ensure_ascii=False,
+        )
+
+    async def _wait(self, tokens: int) -> None:
+        delay = self.latency + (tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def complete(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+        json_mode: bool = False,
+    ) -> str:
+        text = self.json_for(messages, max_tokens) if json_mode else self.reply_for(messages, max_tokens)
+        await asyncio.wait_for(self._wait(len(text.split())), timeout)
+        return text
+
+    async def stream(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        words = self.reply_for(messages, max_tokens).split()
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        for i, word in enumerate(words):
+            if self.tokens_per_sec > 0:
+                await asyncio.sleep(1 / self.tokens_per_sec)
+            yield word if i == 0 else f" {word}"
@@ -0,0 +1,110 @@
+"""
+Módulo: engines/openai_engine.py
+--------------------------------
+Motor de LLM sobre la API de OpenAI (o cualquier API compatible vía `OPENAI_BASE_URL`).
+
+Notas de diseño:
+- El cliente es asíncrono (`AsyncOpenAI`) sobre un pool HTTP compartido
+  (keep-alive), de modo que una llamada lenta no bloquea el event loop.
+- Se crea de forma perezosa: un pool HTTP asíncrono queda atado al loop en
+  el que se abrió, así que si cambia el loop (ej. tests) se recrea.
+"""
+
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.config import (
+    OPENAI_API_KEY,
+    OPENAI_MODEL,
+    OPENAI_BASE_URL,
+    LLM_TIMEOUT,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE,
+)
+from app.engines.base import LLMEngine
+
+
+class OpenAIEngine(LLMEngine):
+    """
+    Motor que llama a chat completions de OpenAI con el modelo `OPENAI_MODEL`.
+    """
+
+    name = "openai"
+
+    def __init__(self, model: str = OPENAI_MODEL):
+        self.model = model
+        self._client: Optional[AsyncOpenAI] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def label(self) -> str:
+        # Se guarda el nombre del modelo (compatible con las conversaciones existentes)
+        return self.model
+
+    def get_client(self) -> AsyncOpenAI:
+        """
+        Devuelve el cliente asíncrono compartido, listo para usarse en el loop actual.
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                ),
+                timeout=LLM_TIMEOUT,
+            )
+            self._client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client)
+            self._client_loop = loop
+        return self._client
+
+    async def complete(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+        json_mode: bool = False,
+    ) -> str:
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        response = await self.get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            **extra,
+        )
+        return response.choices[0].message.content or ""
+
+    async def stream(
+        self,
+        messages: List[dict],
+        *,
+        temperature: float,
+        max_tokens: int,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        stream = await self.get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True,
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+        self._client, self._client_loop = None, None
@@ -1,94 +1,349 @@
 """
 Módulo: llm.py
 ---------------
-Encargado de gestionar la comunicación con el modelo de lenguaje de OpenAI.
+Encargado de gestionar la comunicación con el modelo de lenguaje.
 
 Funciones principales:
-- Cargar la API Key desde el archivo .env.
-- Inicializar el cliente de OpenAI.
+- Cargar la configuración desde el archivo .env.
 - Enviar el historial de conversación al modelo (aplicando trimming para optimizar).
 - Devolver la respuesta generada por el LLM.
 
 Notas de diseño:
 - Se aplica trimming (últimos N mensajes de cada rol) antes de enviar el historial al modelo.
   Esto reduce el consumo de tokens y acelera las respuestas, ya que no se reenvía todo el historial.
+- Además, el historial se ajusta a un presupuesto de tokens (`LLM_CONTEXT_TOKENS`), para que
+  un mensaje muy largo no dispare el tamaño del prompt.
 - El trimming aquí es interno (optimización de costo/performance). En paralelo,
   el trimming de la respuesta de la API se maneja en `main.py` para cumplir con el contrato del challenge.
 - De esta forma, el sistema mantiene un historial completo en memoria, pero lo usa de manera
-  eficiente al interactuar con OpenAI y al exponer la respuesta al cliente.
-- Se agrega timeout de 30s en la llamada al LLM.
+  eficiente al interactuar con el modelo y al exponer la respuesta al cliente.
+- Se agrega un timeout máximo de 30s en la llamada al LLM (configurable con `LLM_TIMEOUT`).
 - Se incluye un fallback en caso de error o timeout para no romper el flujo de la API.
+- Las llamadas se delegan en el motor activo (`LLM_ENGINE`, ver `app/engines/`):
+  OpenAI por defecto o un motor local determinista para desarrollo y benchmarks.
+- Un semáforo (`LLM_MAX_CONCURRENCY`) acota las llamadas en vuelo por proceso.
+- `stream_llm` expone la misma llamada en modo streaming (usada por `/chat/stream`).
+- `open_debate` resuelve el primer turno (tema, postura y réplica) en una sola llamada JSON.
+- Cada llamada registra su etapa (`trim`, `reply_cache`, `llm`) y los fallbacks/timeouts
+  en `app/metrics.py` (expuestos en `/metrics`).
+- Todas las llamadas pasan por la capa de resiliencia (`app/resilience.py`): timeout
+  adaptativo, hedging opcional, circuit breaker y reintentos con jitter. Con el
+  circuito abierto se responde el fallback al instante en lugar de esperar `LLM_TIMEOUT`.
+- `ask_llm` consulta la caché de respuestas (`app/reply_cache.py`) antes de llamar al
+  modelo: un prompt idéntico a uno ya respondido no vuelve a pagar una completion.
 """
 
-import os
-import json
-from typing import List, Optional
+import asyncio
+from typing import Any, AsyncIterator, List, NamedTuple, Optional
+
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI, APIConnectionError, APITimeoutError
+from openai import APIConnectionError, APITimeoutError
 
-from app.config import OPENAI_API_KEY, OPENAI_MODEL
+from app.config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_TOKENS,
+    LLM_CONTEXT_TOKENS,
+    HISTORY_WINDOW_PER_ROLE,
+    SUMMARY_MAX_WORDS,
+)
+from app.engines import LLMEngine, get_engine, parse_json_object  # noqa: F401 (re-exportado)
+from app.resilience import get_guard
 from app.schemas import MessageTurn
+from app.reply_cache import reply_cache, make_key
+from app.metrics import stage, LLM_FALLBACKS, LLM_TIMEOUTS
 from app.utils.trimming import trim_history
+from app.utils.tokens import context_budget, fit_to_budget
 
 # Cargar variables de entorno desde archivo .env
 load_dotenv()
 
-# Inicializar cliente de OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Semáforo y event loop al que pertenece.
+# Se crea de forma perezosa: un semáforo queda atado al loop en el que se
+# usó, así que si cambia el loop (ej. tests) se recrea.
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
 
-# Tiempo máximo permitido para respuestas del modelo (segundos)
-LLM_TIMEOUT = 30
+def _get_semaphore() -> asyncio.Semaphore:
+    """
+    Devuelve el semáforo que limita las llamadas concurrentes al LLM (cualquier motor).
+    """
+    global _semaphore, _semaphore_loop
 
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphore_loop = loop
+    return _semaphore
 
-def ask_llm(history: List[MessageTurn], system_prompt: Optional[str] = None) -> str:
+
+async def call_engine(
+    engine: LLMEngine,
+    call: str,
+    messages: List[dict],
+    *,
+    temperature: float,
+    max_tokens: int,
+    json_mode: bool = False,
+) -> Any:
     """
-    Envía el historial de mensajes al modelo de OpenAI y devuelve la respuesta generada.
-    Si ocurre un error o timeout, devuelve un fallback genérico.
+    Llama al motor a través de su `LLMGuard` (timeout adaptativo, hedging,
+    circuit breaker y reintentos).
+
+    Cada intento (y cada llamada duplicada) ocupa un lugar del semáforo solo
+    mientras está en vuelo; las esperas de backoff no lo retienen.
+
+    Args:
+        engine (LLMEngine): Motor a usar.
+        call (str): Tipo de llamada (`reply`, `opening`, `stance`, `summary`).
+        messages (List[dict]): Mensajes en formato chat.
+        temperature (float): Temperatura de muestreo.
+        max_tokens (int): Tokens máximos de la respuesta.
+        json_mode (bool): Si es `True`, devuelve el objeto JSON (`complete_json`).
+
+    Returns:
+        str o Optional[dict]: Texto generado, u objeto JSON si `json_mode`.
+    """
+    async def attempt(timeout: float):
+        async with _get_semaphore():
+            if json_mode:
+                return await engine.complete_json(
+                    messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+                )
+            return await engine.complete(
+                messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+            )
+
+    return await get_guard(engine.label).run(call, attempt)
+
+
+# Respuesta genérica cuando el modelo falla o excede el timeout
+LLM_FALLBACK_REPLY = "Lo siento, ocurrió un problema al generar la respuesta. Por favor, inténtalo de nuevo."
+
+# Tema y postura por defecto si no se pudieron detectar
+DEFAULT_TOPIC = "general"
+DEFAULT_STANCE = "contraria"
+
+# Temperatura de muestreo de las respuestas del debate
+LLM_TEMPERATURE = 0.7
+
+# System prompt por defecto si el llamador no define uno
+DEFAULT_SYSTEM_PROMPT = (
+    "Eres un chatbot diseñado para debatir. "
+    "Siempre debes llevar la contraria al usuario y tratar de convencerlo "
+    "con argumentos claros, firmes y persuasivos."
+)
+
+
+def record_llm_error(call: str, error: Optional[Exception] = None) -> None:
+    """
+    Cuenta un fallback del LLM (y si fue por timeout) para `/metrics`.
+
+    Args:
+        call (str): Tipo de llamada (`reply`, `stream`, `opening`, `stance`, `summary`).
+        error (Exception, opcional): Error que causó el fallback.
+    """
+    if isinstance(error, (APITimeoutError, asyncio.TimeoutError, httpx.TimeoutException)):
+        LLM_TIMEOUTS.inc(call=call)
+    LLM_FALLBACKS.inc(call=call)
+
+
+def build_messages(history: List[MessageTurn], system_prompt: Optional[str] = None) -> List[dict]:
+    """
+    Construye la lista de mensajes que se envía al modelo: system prompt
+    seguido del historial recortado.
+
+    El recorte se hace en dos pasos:
+    1. Tope por turnos (`HISTORY_WINDOW_PER_ROLE` por rol, 10x10 por defecto).
+    2. Presupuesto de tokens (`LLM_CONTEXT_TOKENS`), reservando espacio para el
+       system prompt y la respuesta (`LLM_MAX_TOKENS`): se empaquetan los turnos
+       más recientes que quepan.
 
     Args:
         history (List[MessageTurn]): Lista de turnos de conversación con rol y mensaje.
         system_prompt (str, opcional): Instrucción inicial fija para guiar al modelo.
 
     Returns:
-        str: Respuesta generada por el modelo de lenguaje.
+        List[dict]: Mensajes en el formato de la API de chat completions.
     """
-    # Aplicar trimming para limitar el historial 10x10
-    trimmed_history = trim_history(history)
-
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    else:
-        messages.append({
-            "role": "system",
-            "content": (
-                "Eres un chatbot diseñado para debatir. "
-                "Siempre debes llevar la contraria al usuario y tratar de convencerlo "
-                "con argumentos claros, firmes y persuasivos."
-            )
-        })
+    system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+
+    # Aplicar trimming para limitar el historial (10x10) y luego el presupuesto de tokens
+    trimmed_history = trim_history(history, HISTORY_WINDOW_PER_ROLE, HISTORY_WINDOW_PER_ROLE)
+    budget = context_budget(system_prompt, LLM_CONTEXT_TOKENS, LLM_MAX_TOKENS)
+    trimmed_history = fit_to_budget(trimmed_history, budget)
+
+    messages = [{"role": "system", "content": system_prompt}]
 
     # Agregar historial
     messages += [{"role": turn.role, "content": turn.message} for turn in trimmed_history]
+    return messages
+
+
+async def ask_llm(
+    history: List[MessageTurn],
+    system_prompt: Optional[str] = None,
+    use_cache: bool = True,
+) -> str:
+    """
+    Envía el historial de mensajes al motor activo y devuelve la respuesta generada.
+    Si ocurre un error o timeout, devuelve un fallback genérico.
+
+    Antes de llamar al modelo se consulta la caché de respuestas con el hash de
+    los mensajes ya recortados; las respuestas nuevas se guardan en ella.
+
+    Args:
+        history (List[MessageTurn]): Lista de turnos de conversación con rol y mensaje.
+        system_prompt (str, opcional): Instrucción inicial fija para guiar al modelo.
+        use_cache (bool): Si es `False`, no se lee ni se escribe la caché de respuestas.
+
+    Returns:
+        str: Respuesta generada por el modelo de lenguaje.
+    """
+    with stage("trim"):
+        messages = build_messages(history, system_prompt)
+
+    engine = get_engine()
+    key = make_key(engine.label, messages, LLM_TEMPERATURE, LLM_MAX_TOKENS) if use_cache else None
+    if key is not None:
+        with stage("reply_cache"):
+            cached = await reply_cache.get(key)
+        if cached is not None:
+            return cached
 
     try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=300,
-            timeout=LLM_TIMEOUT
-        )
-        return response.choices[0].message.content.strip()
+        with stage("llm"):
+            reply = await call_engine(
+                engine, "reply", messages,
+                temperature=LLM_TEMPERATURE,
+                max_tokens=LLM_MAX_TOKENS
+            )
+        reply = reply.strip()
 
     except (APIConnectionError, APITimeoutError, Exception) as e:
         # Log del error para depuración
         print(f"[LLM Error] {str(e)}")
-        # Fallback genérico
-        return "Lo siento, ocurrió un problema al generar la respuesta. Por favor, inténtalo de nuevo."
+        record_llm_error("reply", e)
+        # Fallback genérico (nunca se cachea)
+        return LLM_FALLBACK_REPLY
+
+    if key is not None:
+        await reply_cache.put(key, engine.label, reply)
+    return reply
 
 
-def detect_topic_and_stance(message: str) -> tuple[str, str]:
+async def stream_llm(history: List[MessageTurn], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Variante en streaming de `ask_llm`: produce los fragmentos de texto (deltas)
+    a medida que el modelo los genera.
+
+    Si el modelo falla antes de emitir el primer fragmento, se produce el
+    fallback genérico como único fragmento. Si falla a mitad de la respuesta,
+    el stream simplemente termina con lo generado hasta ese momento.
+
+    Args:
+        history (List[MessageTurn]): Lista de turnos de conversación con rol y mensaje.
+        system_prompt (str, opcional): Instrucción inicial fija para guiar al modelo.
+
+    Yields:
+        str: Fragmentos de la respuesta en orden.
+    """
+    with stage("trim"):
+        messages = build_messages(history, system_prompt)
+    emitted = False
+
+    try:
+        engine = get_engine()
+        with stage("llm"):
+            async with _get_semaphore():
+                async for delta in get_guard(engine.label).stream("stream", lambda timeout: engine.stream(
+                    messages,
+                    temperature=LLM_TEMPERATURE,
+                    max_tokens=LLM_MAX_TOKENS,
+                    timeout=timeout
+                )):
+                    if delta:
+                        emitted = True
+                        yield delta
+
+    except (APIConnectionError, APITimeoutError, Exception) as e:
+        print(f"[LLM Stream Error] {str(e)}")
+        if not emitted:
+            record_llm_error("stream", e)
+            yield LLM_FALLBACK_REPLY
+
+
+class DebateOpening(NamedTuple):
+    """
+    Resultado del primer turno en una sola llamada: tema, postura y primera réplica.
+    `reply` es `None` cuando tema y postura se reutilizaron del índice de aperturas
+    (`app/topic_index.py`) y la réplica aún debe generarse.
+    """
+    topic: str
+    stance: str
+    reply: Optional[str]
+
+
+async def open_debate(message: str) -> Optional[DebateOpening]:
+    """
+    Primer turno en una sola llamada al LLM: detecta tema y postura contraria
+    y genera la primera réplica, todo en una respuesta JSON estructurada.
+
+    Reemplaza la secuencia `detect_topic_and_stance` + `ask_llm`, que duplicaba
+    la latencia del primer turno. Si la salida no se puede interpretar, devuelve
+    `None` y el llamador debe usar el flujo de dos llamadas.
+
+    Los errores de la llamada (timeout, conexión, circuito abierto) se propagan:
+    con el LLM caído, el flujo de dos llamadas solo sumaría dos esperas más.
+
+    Args:
+        message (str): Primer mensaje del usuario.
+
+    Returns:
+        Optional[DebateOpening]: (topic, stance, reply) o `None` si falló el parseo.
+
+    Raises:
+        Exception: Si falló la llamada al motor (ya registrada en `/metrics`).
+    """
+    prompt = f"""
+            Eres un chatbot de debate. El usuario abre un debate con el enunciado entre comillas.
+            Responde SOLO un JSON con tres claves:
+            - "topic": 3-8 palabras que resuman el tema.
+            - "stance": una postura CONTRARIA a la del usuario, breve (máx 12 palabras).
+            - "reply": tu primera respuesta al usuario, en su mismo idioma, defendiendo esa
+              postura con argumentos claros, firmes y persuasivos. No cambies de tema.
+            Enunciado: "{message}"
+            """
+
+    try:
+        data = await call_engine(
+            get_engine(), "opening", [{"role": "system", "content": prompt}],
+            temperature=0.7,
+            max_tokens=LLM_MAX_TOKENS + 150,
+            json_mode=True
+        )
+    except Exception as e:
+        print(f"[Opening Error] {str(e)}")
+        record_llm_error("opening", e)
+        raise
+
+    if data is None:
+        print("[Opening Error] respuesta sin JSON válido")
+        record_llm_error("opening")
+        return None
+
+    fields = [data.get(key) for key in ("topic", "stance", "reply")]
+    if not all(isinstance(value, str) and value.strip() for value in fields):
+        print("[Opening Error] JSON incompleto")
+        record_llm_error("opening")
+        return None
+
+    topic, stance, reply = (value.strip() for value in fields)
+    return DebateOpening(topic=topic, stance=stance, reply=reply)
+
+
+async def detect_topic_and_stance(message: str) -> tuple[str, str]:
     """
     Detecta el tema y una postura contraria a partir del primer mensaje del usuario.
 
@@ -107,19 +362,56 @@ def detect_topic_and_stance(message: str) -> tuple[str, str]:
             """
 
     try:
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "system", "content": prompt}],
+        data = await call_engine(
+            get_engine(), "stance", [{"role": "system", "content": prompt}],
             temperature=0.2,
             max_tokens=150,
-            timeout=LLM_TIMEOUT
+            json_mode=True
         )
-        text = resp.choices[0].message.content.strip()
-        data = json.loads(text)
-        topic = data.get("topic", "general")
-        stance = data.get("stance", "contraria")
+        if data is None:
+            raise ValueError("respuesta sin JSON válido")
+        topic = data.get("topic", DEFAULT_TOPIC)
+        stance = data.get("stance", DEFAULT_STANCE)
     except Exception as e:
         print(f"[Stance Detection Error] {str(e)}")
-        topic, stance = "general", "contraria"
+        record_llm_error("stance", e)
+        topic, stance = DEFAULT_TOPIC, DEFAULT_STANCE
 
     return topic, stance
+
+
+async def summarize_turns(previous_summary: Optional[str], turns: List[MessageTurn]) -> Optional[str]:
+    """
+    Genera un resumen acumulado del debate a partir del resumen previo y de
+    los turnos que acaban de salir de la ventana reciente.
+
+    Se usa desde la tarea de compactación en segundo plano (`app/summarizer.py`),
+    nunca en el camino de una request.
+
+    Args:
+        previous_summary (str, opcional): Resumen guardado hasta ahora.
+        turns (List[MessageTurn]): Turnos nuevos a incorporar, en orden cronológico.
+
+    Returns:
+        Optional[str]: Resumen actualizado, o `None` si el modelo falló.
+    """
+    transcript = "\n".join(f"{turn.role}: {turn.message}" for turn in turns)
+    prompt = (
+        "Eres un asistente que resume debates. "
+        f"Actualiza el resumen en un máximo de {SUMMARY_MAX_WORDS} palabras, conservando "
+        "los argumentos principales de cada parte y los puntos ya concedidos o rebatidos.\n"
+        f"Resumen previo: {previous_summary or '(vacío)'}\n"
+        f"Turnos nuevos:\n{transcript}"
+    )
+
+    try:
+        summary = await call_engine(
+            get_engine(), "summary", [{"role": "system", "content": prompt}],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_WORDS * 2
+        )
+        return summary.strip() or None
+    except Exception as e:
+        print(f"[Summary Error] {str(e)}")
+        record_llm_error("summary", e)
+        return None
@@ -10,16 +10,23 @@ Responsabilidades:
 - Exposición de endpoints principales de la API:
     • GET "/"       → Saludo simple para verificar que la API está corriendo.
     • GET "/health" → Healthcheck para monitoreo.
+    • GET "/stats"  → Estadísticas internas del proceso (cachés, índice de aperturas, pool de DB, LLM).
+    • GET "/metrics" → Métricas en formato Prometheus (latencia por etapa, fallbacks, cachés).
     • POST "/chat"  → Endpoint principal del chatbot con persistencia en Postgres.
+    • POST "/chat/stream" → Variante de /chat que emite la respuesta por SSE.
+    • POST "/chat/batch" → Lote de mensajes de /chat (respuestas en NDJSON a medida que terminan).
+    • GET "/conversations/{id}/messages" → Historial completo paginado (o exportación NDJSON).
 
 Flujo del endpoint /chat:
 -------------------------
-1. Si no se recibe `conversation_id`, se crea una nueva conversación en la DB.
-2. Se guarda el mensaje del usuario en la tabla `messages`.
-3. Se recupera el historial de la conversación desde la DB.
+1. Si no se recibe `conversation_id`, se prepara una nueva conversación
+   (tema y postura se reutilizan del índice de aperturas si el mensaje es casi idéntico
+   a uno ya visto).
+2. Se recupera la ventana reciente del historial (10x10) y se libera la conexión.
+3. Se agrega el mensaje del usuario al historial en memoria.
 4. Se genera la respuesta del bot con el LLM (función ask_llm).
-5. Se guarda la respuesta del bot en la DB.
-6. Se actualizan contadores en la tabla `conversations`.
+5. Se guardan el mensaje del usuario y la respuesta del bot en una sola transacción.
+6. En la misma transacción se crea la conversación o se actualizan sus contadores.
 7. Se devuelve el historial recortado (últimos 5 mensajes por rol).
 
 Dependencias clave:
@@ -32,27 +39,63 @@ Dependencias clave:
 """
 
 import asyncio
+import base64
+import json
 import sys
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import AsyncExitStack, asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from uuid import uuid4, UUID
-from typing import Dict, List
-
-from app.schemas import ChatRequest, ChatResponse, MessageTurn
-from app.llm import ask_llm, detect_topic_and_stance
+from typing import AsyncIterator, Dict, Hashable, List, Literal, Optional, Set, Tuple
+
+from app.schemas import ChatBatchItem, ChatRequest, ChatResponse, MessageTurn, MessagePage
+from app.responses import FastJSONResponse, chat_payload, dumps, stored_message_payload, turn_payload
+from app.llm import (
+    ask_llm,
+    stream_llm,
+    open_debate,
+    detect_topic_and_stance,
+    DebateOpening,
+    DEFAULT_STANCE,
+    DEFAULT_TOPIC,
+    LLM_FALLBACK_REPLY,
+)
 from app.utils.trimming import trim_for_response
+from app.utils.tokens import count_tokens
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from sqlalchemy.exc import NoResultFound
 
-from app.config import OPENAI_MODEL
-from app.db import get_db, engine, Base
-from app.models import Conversation, Message, MessageRole
+from app.engines import get_engine, close_engines
+from app.db import get_db, engine, Base, apply_schema_upgrades, AsyncSessionLocal, pool_stats
+from app.models import Conversation, MessageRole
+from app.repository import (
+    get_conversation,
+    get_message_seq,
+    load_recent_history,
+    load_opening_messages,
+    load_messages_page,
+)
+from app.cache import conversation_cache
+from app.topic_index import topic_index
+from app.reply_cache import reply_cache
+from app.metrics import MetricsMiddleware, render as render_metrics, stage
+from app.resilience import guards_stats
+from app.admission import AdmissionMiddleware, admission
+from app.conversation_lock import conversation_turns
+from app.write_behind import turn_writer
+from app.retention import partition_messages, retention_job
+from app.archive import archiver
+from app.config import (
+    CHAT_BATCH_CONCURRENCY,
+    CHAT_BATCH_MAX_ITEMS,
+    HISTORY_PAGE_SIZE,
+    HISTORY_PAGE_MAX,
+    MESSAGES_PARTITIONING,
+)
 
 from datetime import datetime, timezone
 
@@ -73,12 +116,21 @@ async def lifespan(app: FastAPI):
        - Crea/verifica todas las tablas definidas en los modelos de SQLAlchemy 
          (usando `Base.metadata.create_all`).
        - Es idempotente: si las tablas ya existen, no las recrea ni borra datos.
+       - Aplica cambios de esquema idempotentes (`SCHEMA_UPGRADES`, ej. columnas nuevas).
+       - Con `MESSAGES_PARTITIONING=1`, convierte `messages` en tabla particionada por día.
+       - Precarga el índice de aperturas (`topic_index`) con las conversaciones recientes.
+       - Purga las respuestas expiradas de la caché del LLM (`llm_reply_cache`).
+       - Arranca la tarea de retención (particiones nuevas, particiones viejas y
+         conversaciones vencidas: `retention_job`).
 
     2. **Yield**:
        - Mantiene corriendo la aplicación FastAPI mientras atiende requests.
 
     3. **Shutdown (apagado de la app)**:
-       - Se ejecuta cualquier lógica de limpieza (en este caso, solo imprime un log).
+       - Detiene la tarea de retención.
+       - Escribe los turnos pendientes de la escritura diferida (`turn_writer`).
+       - Espera las escrituras pendientes de la caché de respuestas en Postgres.
+       - Cierra el pool HTTP compartido del cliente asíncrono del LLM.
     """
 
     # --- Startup ---
@@ -89,14 +141,38 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         print("Creando/verificando tablas en la DB...")
         await conn.run_sync(Base.metadata.create_all)
+        await apply_schema_upgrades(conn)
+        if MESSAGES_PARTITIONING:
+            await partition_messages(conn)
         print("Tablas listas en la DB remota de Render")
 
+    # Precargar el índice de aperturas; si falla, se llena con el tráfico
+    if topic_index.enabled:
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = await load_opening_messages(db, topic_index.max_entries)
+            print(f"Índice de aperturas precargado: {topic_index.add_many(rows)} entradas")
+        except Exception as e:
+            print(f"[Topic Index Warmup Error] {str(e)}")
+
+    # Purgar respuestas expiradas del nivel persistente de la caché del LLM
+    try:
+        print(f"Respuestas expiradas purgadas: {await reply_cache.purge_expired()}")
+    except Exception as e:
+        print(f"[Reply Cache Purge Error] {str(e)}")
+
+    retention_job.start()
+
     # --- App corriendo ---
     yield  # Aquí la app se queda corriendo
 
     # --- Shutdown ---
-    # (Opcional) al cerrar la app se puede hacer cleanup
+    # Liberar conexiones abiertas hacia el LLM
     print("App apagándose...")
+    await retention_job.stop()
+    await turn_writer.close()
+    await reply_cache.flush()
+    await close_engines()
 
 
 # Inicializamos la aplicación FastAPI
@@ -104,12 +180,21 @@ async def lifespan(app: FastAPI):
 app = FastAPI(
     title="Kopi Debate API",
     version="1.1.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # Serialización con orjson (ver app/responses.py)
+    default_response_class=FastJSONResponse,
 )
 
-# Almacenamiento temporal en memoria RAM
-# conversations = { conversation_id (str): [lista de turnos MessageTurn] }
-conversations: Dict[str, List[MessageTurn]] = {}
+# Control de admisión de /chat: cola acotada, 503 + Retry-After y cancelación
+# si el cliente se desconecta (ver app/admission.py)
+app.add_middleware(AdmissionMiddleware)
+
+# Latencia por request/etapa y header `Server-Timing` (ver app/metrics.py).
+# Se agrega último para envolver a los demás y medir también los 503.
+app.add_middleware(MetricsMiddleware)
+
+# El estado en memoria de conversaciones activas vive en `conversation_cache`
+# (LRU + TTL por proceso, ver app/cache.py).
 
 
 @app.get("/")
@@ -130,20 +215,315 @@ def health():
     return {"status": "healthy"}
 
 
+@app.get("/stats")
+def stats():
+    """
+    Endpoint de estadísticas internas del proceso (cachés, índice de aperturas,
+    pool de conexiones a la DB, resiliencia del LLM por motor y control de admisión).
+    """
+    return {
+        "conversation_cache": conversation_cache.stats(),
+        "topic_index": topic_index.stats(),
+        "reply_cache": reply_cache.stats(),
+        "db_pool": pool_stats(),
+        "llm": guards_stats(),
+        "admission": admission.stats(),
+        "conversation_turns": conversation_turns.stats(),
+        "write_behind": turn_writer.stats(),
+        "retention": retention_job.stats(),
+        "archive": archiver.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """
+    Métricas del proceso en formato de texto de Prometheus.
+
+    Incluye los histogramas de latencia por etapa y por request, los contadores
+    de fallbacks/timeouts del LLM, y (leídos al momento del scrape) los hits y
+    misses de las cachés, el estado del pool de conexiones y el del circuit
+    breaker del LLM.
+    """
+    conversation = conversation_cache.stats()
+    replies = reply_cache.stats()
+    openings = topic_index.stats()
+    pool = pool_stats()
+
+    hits_help = "Hits de las cachés del proceso."
+    misses_help = "Misses de las cachés del proceso."
+    pool_help = "Conexiones del pool de la DB por estado."
+    extra = [
+        ("kopi_cache_hits_total", "counter", hits_help, {"cache": "conversation"}, conversation["hits"]),
+        ("kopi_cache_hits_total", "counter", hits_help, {"cache": "reply_memory"}, replies["memory_hits"]),
+        ("kopi_cache_hits_total", "counter", hits_help, {"cache": "reply_db"}, replies["db_hits"]),
+        ("kopi_cache_hits_total", "counter", hits_help, {"cache": "topic_index"}, openings["hits"]),
+        ("kopi_cache_misses_total", "counter", misses_help, {"cache": "conversation"}, conversation["misses"]),
+        ("kopi_cache_misses_total", "counter", misses_help, {"cache": "reply"}, replies["misses"]),
+        ("kopi_cache_misses_total", "counter", misses_help, {"cache": "topic_index"}, openings["lookups"] - openings["hits"]),
+        ("kopi_db_pool_connections", "gauge", pool_help, {"state": "in_use"}, pool["in_use"]),
+        ("kopi_db_pool_connections", "gauge", pool_help, {"state": "idle"}, pool["idle"]),
+        ("kopi_db_pool_connections", "gauge", pool_help, {"state": "overflow"}, max(pool["overflow"], 0)),
+    ]
+    queue = admission.stats()
+    admission_help = "Requests de chat en vuelo y en cola (control de admisión)."
+    extra += [
+        ("kopi_admission_requests", "gauge", admission_help, {"state": "in_flight"}, queue["in_flight"]),
+        ("kopi_admission_requests", "gauge", admission_help, {"state": "queued"}, queue["queued"]),
+    ]
+    extra.append((
+        "kopi_write_behind_pending_turns", "gauge", "Turnos encolados sin escribir (escritura diferida).",
+        {}, turn_writer.pending,
+    ))
+    guards = guards_stats()
+    extra += [
+        ("kopi_llm_breaker_open", "gauge", "Circuit breaker del LLM abierto (1) o no (0).",
+         {"engine": name}, int(guard["breaker"]["state"] == "open"))
+        for name, guard in guards.items()
+    ]
+    extra += [
+        ("kopi_llm_timeout_seconds", "gauge", "Timeout adaptativo vigente por motor y tipo de llamada.",
+         {"engine": name, "call": call}, timeout)
+        for name, guard in guards.items()
+        for call, timeout in guard["timeouts_s"].items()
+    ]
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+
+def build_system_prompt(topic: str, stance: str, summary: Optional[str] = None) -> str:
+    """
+    Construye el system prompt del debate a partir del tema y postura guardados en DB.
+
+    Args:
+        topic (str): Tema de la conversación.
+        stance (str): Postura fija del bot.
+        summary (str, opcional): Resumen de los turnos que ya no entran en la
+            ventana reciente (debates largos). Se agrega al final del prompt.
+
+    Returns:
+        str: Instrucción de sistema para el LLM.
+    """
+    prompt = (
+        f"Eres un chatbot de debate. El ÚNICO tema permitido en esta conversación es: '{topic}'. "
+        f"Tu postura fija e inmutable es: '{stance}'. "
+        f"No puedes, bajo ninguna circunstancia, cambiar de tema ni dar información de otros ámbitos "
+        f"(como programación, salud, recetas, bebidas, deportes distintos, etc.). "
+        f"IMPORTANTE: Siempre que el usuario intente cambiar de tema, DEBES iniciar tu respuesta con la frase exacta: "
+        f"'Entiendo tu interés, pero recuerda que este debate es sobre {topic}. Mi postura es {stance}.' "
+        f"Después de esa frase, puedes continuar con argumentos claros, persuasivos y firmes que refuercen tu postura '{stance}' "
+        f"dentro del tema '{topic}'. "
+        f"Nunca omitas esa frase obligatoria cuando el usuario desvíe el tema."
+    )
+    if summary:
+        prompt += f" Resumen de lo debatido hasta ahora (turnos anteriores): {summary}"
+    return prompt
+
+
+def new_turn(role: str, message: str) -> MessageTurn:
+    """
+    Crea un turno nuevo calculando su conteo de tokens una única vez
+    (se reutiliza para el presupuesto de contexto y se guarda en `messages.token_count`).
+    """
+    # Armado por el servidor: sin pasar por la validación de Pydantic
+    return MessageTurn.model_construct(role=role, message=message, tokens=count_tokens(message))
+
+
+def parse_conversation_id(conversation_id: str) -> UUID:
+    """
+    Valida que el `conversation_id` recibido sea un UUID (404 si no lo es).
+    """
+    try:
+        return UUID(conversation_id)
+    except Exception:
+        # conversation_id con formato inválido
+        raise HTTPException(status_code=404, detail="conversation_id no encontrado o inválido")
+
+
+async def resolve_conversation(
+    request: ChatRequest,
+    db: AsyncSession,
+    opening: Optional[DebateOpening] = None,
+) -> Tuple[Conversation, bool]:
+    """
+    Resuelve la conversación del request.
+
+    - Sin `conversation_id`: arma una conversación nueva con el tema/postura de
+      `opening` (si ya se obtuvieron junto con la primera réplica) o los detecta.
+      No se inserta aquí: se persiste junto con el primer turno (`persist_turn`).
+    - Con `conversation_id`: valida el UUID y lo busca en DB (404 si no existe).
+
+    Args:
+        request (ChatRequest): Request recibido.
+        db (AsyncSession): Sesión de base de datos.
+        opening (DebateOpening, opcional): Resultado de `open_debate` para el primer turno.
+
+    Returns:
+        Tuple[Conversation, bool]: (conversación, es_nueva).
+    """
+    if request.conversation_id is None:
+
+        # Detectar tema y postura contraria a partir del primer mensaje
+        if opening is not None:
+            topic, stance = opening.topic, opening.stance
+        else:
+            with stage("opening"):
+                topic, stance = await detect_topic_and_stance(request.message)
+
+        conv = Conversation(
+            id=uuid4(),
+            topic=topic,
+            stance=stance,
+            engine=get_engine().label
+        )
+        return conv, True
+
+    conv_uuid = parse_conversation_id(request.conversation_id)
+    with stage("lookup"):
+        conv = await get_conversation(db, conv_uuid)
+    if not conv:
+        # conversation_id válido en forma, pero no existe en DB
+        raise HTTPException(status_code=404, detail="conversation_id no encontrado o inválido")
+
+    return conv, False
+
+
+async def load_turn_context(
+    request: ChatRequest,
+    db: AsyncSession,
+    opening: Optional[DebateOpening] = None,
+    messages: Optional[List[str]] = None,
+) -> Tuple[Conversation, bool, List[MessageTurn]]:
+    """
+    Fase de lectura de un turno: resuelve la conversación y su historial,
+    agrega los mensajes entrantes del usuario y libera la conexión a la DB
+    antes de llamar al LLM.
+
+    Si la conversación está en la caché del proceso (o tiene turnos sin escribir
+    en `turn_writer`), no se consulta la DB. Con el advisory lock (varios
+    workers), el hit se valida antes con una lectura de `message_seq`: si otro
+    worker atendió un turno, la entrada se descarta y se lee la DB.
+
+    Args:
+        messages (List[str], opcional): Mensajes del usuario del turno (varios si
+            se agruparon); por defecto, `request.message`.
+
+    Returns:
+        Tuple[Conversation, bool, List[MessageTurn]]: (conversación, es_nueva, historial).
+    """
+    messages = messages or [request.message]
+    if request.conversation_id is not None:
+        conv_uuid = parse_conversation_id(request.conversation_id)
+        with stage("conversation_cache"):
+            cached = conversation_cache.get(conv_uuid)
+        if cached is not None and conversation_turns.advisory:
+            # Con el lock tomado: ¿otro worker escribió turnos desde que se cacheó?
+            with stage("lookup"):
+                current = await get_message_seq(db, conv_uuid)
+                await db.commit()
+            if cached.message_seq is None or current != cached.message_seq:
+                conversation_cache.invalidate(conv_uuid, stale=True)
+                cached = None
+        if cached is not None:
+            conv = Conversation(
+                id=conv_uuid,
+                topic=cached.topic,
+                stance=cached.stance,
+                engine=cached.engine,
+                summary=cached.summary,
+                message_seq=cached.message_seq,
+            )
+            history = list(cached.turns)
+            history += [new_turn("user", message) for message in messages]
+            return conv, False, history
+
+        # Turnos aún sin escribir (escritura diferida): el buffer está más al día que la DB
+        buffered = turn_writer.lookup(conv_uuid)
+        if buffered is not None:
+            conv, history = buffered
+            history += [new_turn("user", message) for message in messages]
+            return conv, False, history
+
+    conv, is_new = await resolve_conversation(request, db, opening)
+    with stage("history"):
+        history = [] if is_new else await load_recent_history(db, conv.id)
+
+        # Cerrar la transacción de lectura: no retener la conexión durante el LLM
+        await db.commit()
+
+    history += [new_turn("user", message) for message in messages]
+    return conv, is_new, history
+
+
+def indexed_opening(message: str) -> Optional[DebateOpening]:
+    """
+    Busca el mensaje de apertura en el índice local (`topic_index`).
+
+    Returns:
+        Optional[DebateOpening]: Tema y postura reutilizados (sin réplica),
+            o `None` si no hay una apertura suficientemente parecida.
+    """
+    with stage("topic_index"):
+        match = topic_index.lookup(message)
+    if match is None:
+        return None
+    topic, stance, _ = match
+    return DebateOpening(topic=topic, stance=stance, reply=None)
+
+
+def remember_turn(conv: Conversation, is_new: bool, history: List[MessageTurn], added: int) -> None:
+    """
+    Actualiza la caché del proceso con el historial ya persistido del turno
+    (`added` mensajes nuevos). El `message_seq` esperado queda sin conocer si la
+    conversación salió del buffer de la escritura diferida.
+    """
+    known = is_new or conv.message_seq is not None
+    message_seq = (conv.message_seq or 0) + added if known else None
+    conversation_cache.store(
+        conv.id, conv.topic, conv.stance, conv.engine, history,
+        summary=conv.summary, message_seq=message_seq,
+    )
+
+
+def sse_event(event: str, data: dict) -> str:
+    """
+    Serializa un evento en formato Server-Sent Events.
+
+    Args:
+        event (str): Nombre del evento (`meta`, `token`, `history`).
+        data (dict): Payload que se envía como JSON en el campo `data`.
+
+    Returns:
+        str: Bloque SSE terminado en línea vacía.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, db: AsyncSession = Depends(get_db)) -> ChatResponse:
+async def chat(request: ChatRequest, db: AsyncSession = Depends(get_db)) -> FastJSONResponse:
     """
     Endpoint principal del chatbot (persistencia con Postgres).
 
     Flujo:
-    1. Si no se envía `conversation_id`, se crea una nueva conversación en la DB.
-    2. Se guarda el mensaje del usuario en la tabla `messages`.
-    3. Se consulta el historial completo de la conversación desde la DB.
-    4. Se genera la respuesta del bot con el LLM (`ask_llm`).
-    5. Se guarda la respuesta del bot en la tabla `messages`.
-    6. Se actualizan los contadores de mensajes en `conversations`.
+    1. Si no se envía `conversation_id`, se prepara una nueva conversación.
+       Si el mensaje es casi idéntico a una apertura ya vista, se reutilizan su
+       tema y postura (`topic_index`). Si no, tema, postura y primera réplica se
+       piden en una sola llamada JSON (`open_debate`); si no se puede parsear,
+       se usa el flujo de dos llamadas. Si la llamada falla (LLM caído), se
+       responde el fallback con tema y postura por defecto, sin más llamadas.
+    2. Se consulta la ventana reciente del historial (últimos 10 por rol).
+    3. Se agrega el mensaje del usuario al historial en memoria.
+    4. Se genera la respuesta del bot con el LLM (`ask_llm`), salvo en el
+       primer turno si ya se obtuvo con `open_debate`.
+    5. Se guardan ambos mensajes con un INSERT multi-fila (`persist_turn`), o se
+       encolan para escribirse en lote si la escritura diferida está activa.
+    6. En el mismo statement se crea la conversación o se actualizan sus contadores.
     7. Se devuelve el historial recortado (últimos 5 mensajes por rol).
 
+    Los turnos de una misma conversación se ejecutan de a uno y en orden de
+    llegada (`conversation_turns`, ver app/conversation_lock.py). Con
+    `CONVERSATION_COALESCE`, los mensajes que esperan mientras otro turno está
+    en curso se responden juntos con una sola llamada al LLM.
+
     Args:
         request (ChatRequest): JSON con:
             - `conversation_id` (opcional): UUID de la conversación.
@@ -151,126 +531,407 @@ async def chat(request: ChatRequest, db: AsyncSession = Depends(get_db)) -> Chat
         db (AsyncSession): Sesión de base de datos inyectada con `Depends`.
 
     Returns:
-        ChatResponse: objeto con:
+        FastJSONResponse: cuerpo de `ChatResponse` (serializado sin volver a validar) con:
             - `conversation_id`: UUID de la conversación.
             - `message`: historial recortado (5x5 últimos mensajes).
     """
 
-    # 1. Crear conversación si no existe
+    # Conversación nueva: nadie más conoce su id, no hace falta ordenar turnos
     if request.conversation_id is None:
+        return FastJSONResponse(await run_chat_turn(request, db, [request.message]))
+
+    conv_uuid = parse_conversation_id(request.conversation_id)
+    async with conversation_turns.turn(conv_uuid, request.message) as turn:
+        if turn.coalesced:
+            # El mensaje se respondió en el turno de otra request
+            return FastJSONResponse(turn.result)
+        payload = await run_chat_turn(request, db, turn.messages)
+        turn.resolve(payload)
+    return FastJSONResponse(payload)
+
+
+async def run_chat_turn(
+    request: ChatRequest,
+    db: AsyncSession,
+    messages: List[str],
+    defer: bool = False,
+) -> dict:
+    """
+    Ejecuta un turno de `/chat` (pasos 1-7) con los mensajes del usuario `messages`.
+    Devuelve el cuerpo de `ChatResponse` (ver `chat_payload`).
 
-        # Detectar tema y postura contraria a partir del primer mensaje
-        topic, stance = detect_topic_and_stance(request.message)
+    Para conversaciones existentes se invoca con el turno de la conversación
+    tomado, así el historial leído ya incluye los turnos anteriores. Con
+    `defer=True` el turno se escribe en lote aunque la escritura diferida esté
+    desactivada (`/chat/batch`).
+    """
+    user_created_at = datetime.now(timezone.utc)
+
+    # Primer turno: tema y postura del índice de aperturas o, si no hay coincidencia,
+    # tema, postura y réplica en una sola llamada (si el JSON es válido)
+    indexed = indexed_opening(request.message) if request.conversation_id is None else None
+    opening = indexed
+    degraded = False
+    if request.conversation_id is None and opening is None:
+        with stage("opening"):
+            try:
+                opening = await open_debate(request.message)
+            except Exception:
+                # LLM caído: no insistir con el flujo de dos llamadas
+                opening = DebateOpening(topic=DEFAULT_TOPIC, stance=DEFAULT_STANCE, reply=LLM_FALLBACK_REPLY)
+                degraded = True
+
+    # 1-3. Resolver conversación (nueva o existente) e historial + mensaje del usuario
+    conv, is_new, history = await load_turn_context(request, db, opening, messages)
 
-        conv = Conversation(
-            id=uuid4(),
-            topic=topic,
-            stance=stance,
-            engine=OPENAI_MODEL
-        )
-        db.add(conv)
-        await db.commit()
-        await db.refresh(conv)
-        conv_id = str(conv.id)
-        conv_uuid = conv.id
-    
-    # Validar que el string sea un UUID válido
+    # 4. Generar respuesta del bot con el historial
+    if opening is not None and opening.reply is not None:
+        bot_reply = opening.reply
     else:
         try:
-            conv_uuid = UUID(request.conversation_id)
-        except Exception:
-            # conversation_id con formato inválido
-            raise HTTPException(status_code=404, detail="conversation_id no encontrado o inválido")
 
-        result = await db.execute(
-            select(Conversation).where(Conversation.id == conv_uuid)
+            # Construir siempre el prompt con el tema y postura guardados en DB
+            system_prompt = build_system_prompt(conv.topic, conv.stance, conv.summary)
+            bot_reply = await ask_llm(history, system_prompt=system_prompt)
+
+        except Exception as e:
+            # Fallback: no rompemos la API, devolvemos mensaje seguro
+            bot_reply = "Lo siento, ocurrió un error al procesar tu mensaje."
+
+    # 5 y 6. Guardar ambos mensajes y actualizar contadores en una transacción
+    history.append(new_turn("assistant", bot_reply))
+    with stage("persist"):
+        await turn_writer.save(
+            db, conv, is_new, history[-len(messages) - 1:-1], user_created_at, history[-1], history, defer=defer,
         )
-        conv = result.scalar_one_or_none()
-        if not conv:
-            # conversation_id válido en forma, pero no existe en DB
-            raise HTTPException(status_code=404, detail="conversation_id no encontrado o inválido")
-
-        conv_id = str(conv.id)
-
-    # 2. Guardar mensaje del usuario
-    user_msg = Message(
-        conversation_id=conv_uuid,
-        role=MessageRole.user,
-        content=request.message,
-        created_at=datetime.now(timezone.utc)
-    )
-    db.add(user_msg)
-    await db.commit()
-    await db.refresh(user_msg)
-
-    # 3. Recuperar historial de la conversación
-    result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conv_uuid)
-        .order_by(Message.created_at)
+    if is_new and indexed is None and not degraded:
+        topic_index.add(request.message, conv.topic, conv.stance)
+
+    # 7. Aplicar trimming 5x5 para la respuesta API (sin volver a consultar la DB)
+    remember_turn(conv, is_new, history, len(messages) + 1)
+    with stage("trim"):
+        trimmed = trim_for_response(history)
+
+    return chat_payload(str(conv.id), trimmed, conv.engine)
+
+
+@app.post("/chat/batch")
+async def chat_batch(items: List[ChatBatchItem]) -> StreamingResponse:
+    """
+    Lote de mensajes de `/chat` en una sola request (replays y evaluaciones offline).
+
+    - Cada mensaje es un turno de `/chat` (mismo flujo, mismas respuestas).
+    - Se ejecutan hasta `CHAT_BATCH_CONCURRENCY` turnos a la vez; los de una
+      misma conversación (mismo `conversation_id`, o misma `ref` para una
+      conversación nueva) van de a uno y en el orden del lote.
+    - Los turnos se escriben en lotes (`persist_turn_batch`) a través de
+      `turn_writer`, aunque la escritura diferida esté desactivada: el resto de
+      la app (caché, `/chat`, historial) ve esos turnos aunque aún no estén en
+      la DB. El stream termina después de escribirlos.
+    - La respuesta es NDJSON: una línea por mensaje a medida que termina, con
+      `index` (posición en el lote) y `status`. Con `status` 200 la línea trae
+      el cuerpo de `ChatResponse`; si no, `detail`. El error de un mensaje no
+      corta el lote (424 para los turnos de una `ref` cuya conversación no se
+      pudo crear).
+
+    Args:
+        items (List[ChatBatchItem]): Mensajes del lote (máximo `CHAT_BATCH_MAX_ITEMS`).
+
+    Returns:
+        StreamingResponse: stream `application/x-ndjson`.
+    """
+    if len(items) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"el lote admite hasta {CHAT_BATCH_MAX_ITEMS} mensajes")
+
+    async def results_stream() -> AsyncIterator[bytes]:
+        results: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(max(CHAT_BATCH_CONCURRENCY, 1))
+        written: Set[UUID] = set()
+        tasks = [
+            asyncio.create_task(run_batch_chain(items, chain, slots, results, written))
+            for chain in batch_chains(items)
+        ]
+        try:
+            # Cada cadena emite exactamente un resultado por mensaje
+            for _ in range(len(items)):
+                yield dumps(await results.get()) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for conv_id in written:
+                await turn_writer.drain(conv_id)
+
+    return StreamingResponse(results_stream(), media_type="application/x-ndjson")
+
+
+def batch_chains(items: List[ChatBatchItem]) -> List[List[int]]:
+    """
+    Agrupa las posiciones del lote en cadenas que se ejecutan en orden: una por
+    `conversation_id`, una por `ref` de conversación nueva y una por cada
+    mensaje sin ninguno de los dos.
+    """
+    chains: Dict[Hashable, List[int]] = {}
+    for index, item in enumerate(items):
+        if item.conversation_id is not None:
+            key = ("conversation", item.conversation_id)
+        elif item.ref is not None:
+            key = ("ref", item.ref)
+        else:
+            key = ("item", index)
+        chains.setdefault(key, []).append(index)
+    return list(chains.values())
+
+
+async def run_batch_chain(
+    items: List[ChatBatchItem],
+    chain: List[int],
+    slots: asyncio.Semaphore,
+    results: asyncio.Queue,
+    written: Set[UUID],
+) -> None:
+    """
+    Ejecuta en orden los mensajes de una cadena de `/chat/batch` (cada turno
+    con un lugar de `slots`), deja una línea de resultado por mensaje en
+    `results` y agrega a `written` las conversaciones con turnos guardados.
+    """
+    conversation_id: Optional[str] = None
+    async with AsyncSessionLocal() as db:
+        for position, index in enumerate(chain):
+            item = items[index]
+            if position > 0 and item.conversation_id is None:
+                # Turnos siguientes de una `ref`: continúan la conversación creada por el primero
+                if conversation_id is None:
+                    await results.put({
+                        "index": index,
+                        "status": 424,
+                        "detail": "falló el turno que iniciaba la conversación",
+                    })
+                    continue
+                item = item.model_copy(update={"conversation_id": conversation_id})
+
+            async with slots:
+                try:
+                    payload = await run_batch_turn(item, db)
+                except HTTPException as e:
+                    await db.rollback()
+                    line = {"index": index, "status": e.status_code, "detail": e.detail}
+                except Exception as e:
+                    await db.rollback()
+                    print(f"[Chat Batch Error] {str(e)}")
+                    line = {"index": index, "status": 500, "detail": "error al procesar el mensaje"}
+                else:
+                    conversation_id = conversation_id or payload["conversation_id"]
+                    written.add(UUID(payload["conversation_id"]))
+                    line = {"index": index, "status": 200, **payload}
+            await results.put(line)
+
+
+async def run_batch_turn(item: ChatRequest, db: AsyncSession) -> dict:
+    """
+    Un turno de `/chat/batch`: igual que `/chat`, sin agrupar mensajes
+    (cada mensaje del lote tiene su propia respuesta).
+    """
+    if item.conversation_id is None:
+        return await run_chat_turn(item, db, [item.message], defer=True)
+
+    conv_uuid = parse_conversation_id(item.conversation_id)
+    async with conversation_turns.turn(conv_uuid, item.message, coalesce=False):
+        return await run_chat_turn(item, db, [item.message], defer=True)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, db: AsyncSession = Depends(get_db)) -> StreamingResponse:
+    """
+    Variante en streaming de `/chat` usando Server-Sent Events (SSE).
+
+    Mismo contrato de entrada que `/chat`, pero la respuesta del bot se envía
+    token a token a medida que la genera el modelo, reduciendo el tiempo hasta
+    el primer byte a la latencia del primer token del LLM.
+
+    Eventos emitidos (en orden):
+    - `meta`    → `{"conversation_id", "engine"}` (útil al iniciar conversación).
+    - `token`   → `{"delta": "..."}` por cada fragmento generado.
+    - `history` → mismo payload que `ChatResponse` (historial recortado 5x5).
+      Es siempre el último evento.
+
+    El turno (mensaje del usuario, respuesta del bot y contadores de
+    `conversations`) se persiste al terminar el stream. Si el cliente se
+    desconecta antes, el turno no se guarda.
+
+    Args:
+        request (ChatRequest): JSON con `conversation_id` (opcional) y `message`.
+        db (AsyncSession): Sesión de base de datos inyectada con `Depends`.
+
+    Returns:
+        StreamingResponse: stream `text/event-stream`.
+    """
+    # La validación (404) ocurre antes de abrir el stream,
+    # para poder devolver errores HTTP normales.
+    indexed = indexed_opening(request.message) if request.conversation_id is None else None
+    if request.conversation_id is None:
+        preloaded = await load_turn_context(request, db, indexed)
+        conv_uuid = preloaded[0].id
+    else:
+        preloaded = None
+        conv_uuid = parse_conversation_id(request.conversation_id)
+        if not conversation_cache.contains(conv_uuid) and not turn_writer.contains(conv_uuid):
+            with stage("lookup"):
+                found = await get_conversation(db, conv_uuid)
+                await db.commit()
+            if found is None:
+                raise HTTPException(status_code=404, detail="conversation_id no encontrado o inválido")
+
+    async def event_stream() -> AsyncIterator[str]:
+        # El turno de una conversación existente se toma dentro del stream (y el
+        # historial se lee ya con el turno tomado): si el stream nunca arranca,
+        # no queda ningún lock retenido.
+        async with AsyncExitStack() as stack:
+            if preloaded is not None:
+                conv, is_new, history = preloaded
+            else:
+                await stack.enter_async_context(conversation_turns.turn(conv_uuid, request.message, coalesce=False))
+                conv, is_new, history = await load_turn_context(request, db)
+            user_created_at = datetime.now(timezone.utc)
+            async for event in stream_turn(request, db, conv, is_new, history, user_created_at, indexed):
+                yield event
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    history = [
-        MessageTurn(role=m.role.value, message=m.content)
-        for m in result.scalars()
-    ]
 
-    # 4. Generar respuesta del bot con el historial
+
+async def stream_turn(
+    request: ChatRequest,
+    db: AsyncSession,
+    conv: Conversation,
+    is_new: bool,
+    history: List[MessageTurn],
+    user_created_at: datetime,
+    indexed: Optional[DebateOpening],
+) -> AsyncIterator[str]:
+    """
+    Emite los eventos SSE de un turno de `/chat/stream` y lo persiste al terminar.
+    """
+    conv_id = str(conv.id)
+    system_prompt = build_system_prompt(conv.topic, conv.stance, conv.summary)
+
     try:
+        yield sse_event("meta", {"conversation_id": conv_id, "engine": conv.engine})
 
-        # Construir siempre el prompt con el tema y postura guardados en DB
-        system_prompt = (
-            f"Eres un chatbot de debate. El ÚNICO tema permitido en esta conversación es: '{conv.topic}'. "
-            f"Tu postura fija e inmutable es: '{conv.stance}'. "
-            f"No puedes, bajo ninguna circunstancia, cambiar de tema ni dar información de otros ámbitos "
-            f"(como programación, salud, recetas, bebidas, deportes distintos, etc.). "
-            f"IMPORTANTE: Siempre que el usuario intente cambiar de tema, DEBES iniciar tu respuesta con la frase exacta: "
-            f"'Entiendo tu interés, pero recuerda que este debate es sobre {conv.topic}. Mi postura es {conv.stance}.' "
-            f"Después de esa frase, puedes continuar con argumentos claros, persuasivos y firmes que refuercen tu postura '{conv.stance}' "
-            f"dentro del tema '{conv.topic}'. "
-            f"Nunca omitas esa frase obligatoria cuando el usuario desvíe el tema."
-        )
-        bot_reply = ask_llm(history, system_prompt=system_prompt)
+        parts: List[str] = []
+        async for delta in stream_llm(history, system_prompt=system_prompt):
+            parts.append(delta)
+            yield sse_event("token", {"delta": delta})
 
-    except Exception as e:
-        # Fallback: no rompemos la API, devolvemos mensaje seguro
-        bot_reply = "Lo siento, ocurrió un error al procesar tu mensaje."
-
-    # 5. Guardar respuesta del bot
-    bot_msg = Message(
-        conversation_id=conv_uuid,
-        role=MessageRole.assistant,
-        content=bot_reply,
-         created_at=datetime.now(timezone.utc)
-    )
-    db.add(bot_msg)
-
-    # 6. Actualizar contadores en la conversación
-    await db.execute(
-        update(Conversation)
-        .where(Conversation.id == conv_uuid)
-        .values(
-            message_count_user=Conversation.message_count_user + 1,
-            message_count_bot=Conversation.message_count_bot + 1,
-            updated_at=datetime.now(timezone.utc),
-        )
-    )
-    await db.commit()
-    await db.refresh(bot_msg)
-
-    # 7. Recuperar historial final y aplicar trimming 5x5
-    result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conv_uuid)
-        .order_by(Message.created_at)
-    )
-    history = [
-        MessageTurn(role=m.role.value, message=m.content)
-        for m in result.scalars()
-    ]
+        bot_reply = "".join(parts).strip() or LLM_FALLBACK_REPLY
 
-    # Aplicar trimming 5x5 para la respuesta API
-    trimmed = trim_for_response(history)
+        # Persistir el turno completo al final del stream y emitir el historial recortado
+        history.append(new_turn("assistant", bot_reply))
+        with stage("persist"):
+            await turn_writer.save(db, conv, is_new, [history[-2]], user_created_at, history[-1], history)
+        if is_new and indexed is None:
+            topic_index.add(request.message, conv.topic, conv.stance)
+        remember_turn(conv, is_new, history, 2)
+        final_history = trim_for_response(history)
 
-    return ChatResponse(conversation_id=conv_id, 
-                        message=trimmed, 
-                        engine=conv.engine)
+        yield sse_event("history", {
+            "conversation_id": conv_id,
+            "message": [turn_payload(turn) for turn in final_history],
+            "engine": conv.engine,
+        })
+    finally:
+        # La sesión inyectada se reutiliza dentro del stream; se libera aquí
+        await db.close()
+
+
+# Filas por consulta al exportar el historial completo en NDJSON
+EXPORT_CHUNK_SIZE = 500
+
+
+def encode_cursor(seq: int) -> str:
+    """
+    Cursor opaco de paginación: `seq` de la última fila entregada.
+    """
+    raw = json.dumps({"seq": seq}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Decodifica un cursor de `encode_cursor` (400 si es inválido).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(raw)["seq"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+
+@app.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def conversation_messages(
+    conversation_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    role: Optional[Literal["user", "assistant"]] = None,
+    format: Literal["json", "ndjson"] = "json",
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Historial completo de una conversación, paginado por keyset.
+
+    - `cursor`: `next_cursor` de la página anterior (vacío = desde el inicio).
+    - `limit`: mensajes por página (máximo `HISTORY_PAGE_MAX`).
+    - `role`: solo mensajes de `user` o de `assistant`.
+    - `format=ndjson`: exporta todos los mensajes desde `cursor` hasta el final,
+      uno por línea (`application/x-ndjson`), leyendo de a `EXPORT_CHUNK_SIZE`
+      filas sin retener la conexión entre lecturas.
+
+    Cada página es un range scan sobre `(conversation_id, seq)` que arranca en el
+    cursor: el costo no crece con la profundidad (a diferencia de `OFFSET`).
+    """
+    conv_uuid = parse_conversation_id(conversation_id)
+    after = decode_cursor(cursor) if cursor else None
+    message_role = MessageRole(role) if role else None
+
+    # Turnos aún en el buffer de la escritura diferida: escribirlos antes de leer
+    if turn_writer.contains(conv_uuid):
+        await turn_writer.drain(conv_uuid)
+
+    with stage("lookup"):
+        conv = await get_conversation(db, conv_uuid)
+    if conv is None:
+        raise HTTPException(status_code=404, detail="conversation_id no encontrado o inválido")
+
+    if format == "ndjson":
+        await db.commit()
+
+        async def export() -> AsyncIterator[bytes]:
+            position = after
+            try:
+                while True:
+                    rows = await load_messages_page(db, conv_uuid, position, EXPORT_CHUNK_SIZE, message_role)
+                    await db.commit()
+                    for row in rows:
+                        yield dumps(stored_message_payload(row)) + b"\n"
+                    if len(rows) < EXPORT_CHUNK_SIZE:
+                        break
+                    position = rows[-1].seq
+            finally:
+                # La sesión inyectada se reutiliza dentro del stream; se libera aquí
+                await db.close()
+
+        return StreamingResponse(export(), media_type="application/x-ndjson")
+
+    with stage("history"):
+        # Una fila extra indica si hay página siguiente
+        rows = await load_messages_page(db, conv_uuid, after, limit + 1, message_role)
+        await db.commit()
+    page, more = rows[:limit], len(rows) > limit
+    return FastJSONResponse({
+        "conversation_id": str(conv_uuid),
+        "messages": [stored_message_payload(row) for row in page],
+        "next_cursor": encode_cursor(page[-1].seq) if more else None,
+    })
@@ -0,0 +1,233 @@
+"""
+Módulo: metrics.py
+------------------
+Instrumentación liviana de latencia por etapa y contadores del proceso.
+
+Propósito:
+----------
+Saber en qué se fue el tiempo de un `/chat` lento: búsqueda de la conversación,
+consulta del historial, trimming, llamada al LLM o escritura en la DB.
+
+Características:
+----------------
+- `stage(nombre)`: context manager que mide una etapa y la registra en un
+  histograma (`kopi_stage_duration_seconds{stage=...}`) y en los tiempos de la
+  request en curso.
+- `MetricsMiddleware`: middleware ASGI que mide la request completa
+  (`kopi_request_duration_seconds{route, status}`) y agrega el header
+  `Server-Timing` con las etapas medidas hasta el envío de los headers.
+- Contadores (`Counter`) para eventos puntuales (fallbacks, timeouts, reintentos,
+  hedging y rechazos del circuit breaker del LLM).
+- `render()`: exposición en formato de texto de Prometheus (endpoint `/metrics`).
+
+Notas:
+------
+- Sin dependencias externas: histogramas de buckets fijos (búsqueda binaria)
+  y un diccionario por request en un `ContextVar`. Cada observación cuesta un
+  `perf_counter()` y unas pocas operaciones de diccionario.
+- En `/chat/stream` los headers se envían antes de llamar al LLM, así que su
+  `Server-Timing` solo incluye las etapas de lectura.
+- Las métricas son por proceso (cada worker de uvicorn expone las suyas).
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Buckets (segundos) pensados para etapas de DB (ms) y del LLM (segundos)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Tiempos (segundos) de las etapas de la request en curso
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    Contador monotónico con etiquetas opcionales.
+    """
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(labels.items())
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(labels.items()), 0.0)
+
+    def lines(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(dict(key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histograma de buckets fijos con etiquetas opcionales.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # Por combinación de etiquetas: [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(labels.items()))
+        return series[2] if series else 0
+
+    def lines(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._series.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+# --- Métricas del proceso ---
+STAGE_SECONDS = Histogram("kopi_stage_duration_seconds", "Duración de cada etapa de una request.")
+REQUEST_SECONDS = Histogram("kopi_request_duration_seconds", "Duración total de las requests HTTP.")
+LLM_FALLBACKS = Counter("kopi_llm_fallbacks_total", "Respuestas de fallback por error del LLM.")
+LLM_TIMEOUTS = Counter("kopi_llm_timeouts_total", "Llamadas al LLM que excedieron el timeout.")
+LLM_RETRIES = Counter("kopi_llm_retries_total", "Reintentos de llamadas al LLM por errores transitorios.")
+LLM_HEDGES = Counter("kopi_llm_hedges_total", "Llamadas duplicadas (hedging) al LLM, lanzadas y ganadas.")
+LLM_BREAKER_REJECTIONS = Counter("kopi_llm_breaker_rejections_total", "Llamadas al LLM evitadas con el circuito abierto.")
+ADMISSION_REJECTIONS = Counter("kopi_admission_rejections_total", "Requests rechazadas con 503 por sobrecarga.")
+CLIENT_DISCONNECTS = Counter("kopi_client_disconnects_total", "Requests canceladas porque el cliente se desconectó.")
+POOL_CHECKOUT_SECONDS = Histogram("kopi_db_pool_checkout_seconds", "Espera al pedir una conexión al pool de la DB.")
+PARTITION_ERRORS = Counter("kopi_partition_errors_total", "Particiones de messages que no se pudieron crear o separar.")
+PARTITION_ROWS_MOVED = Counter("kopi_partition_default_rows_moved_total", "Filas movidas de messages_default a su partición diaria.")
+
+_REGISTRY = (
+    STAGE_SECONDS, REQUEST_SECONDS, LLM_FALLBACKS, LLM_TIMEOUTS,
+    LLM_RETRIES, LLM_HEDGES, LLM_BREAKER_REJECTIONS, ADMISSION_REJECTIONS, CLIENT_DISCONNECTS,
+    POOL_CHECKOUT_SECONDS, PARTITION_ERRORS, PARTITION_ROWS_MOVED,
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Mide una etapa de la request en curso (histograma + header `Server-Timing`).
+
+    Uso:
+        with stage("history"):
+            history = await load_recent_history(db, conv.id)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """
+    Arma el valor del header `Server-Timing` (duraciones en milisegundos).
+    """
+    parts = [f"{name};dur={1000 * seconds:.2f}" for name, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={1000 * total:.2f}")
+    return ", ".join(parts)
+
+
+def render(extra: Iterable[Tuple[str, str, str, Dict[str, str], float]] = ()) -> str:
+    """
+    Serializa las métricas en formato de texto de Prometheus.
+
+    Args:
+        extra: Muestras adicionales `(nombre, tipo, ayuda, etiquetas, valor)` que se
+            leen al momento del scrape (ej. hits de las cachés, estado del pool).
+            Las muestras de un mismo nombre deben venir contiguas.
+
+    Returns:
+        str: Cuerpo de la respuesta de `/metrics`.
+    """
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines += metric.lines()
+
+    current = None
+    for name, kind, help, labels, value in extra:
+        if name != current:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            current = name
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide cada request HTTP y agrega el header `Server-Timing`.
+
+    Es un middleware ASGI puro (no `BaseHTTPMiddleware`): no envuelve el body ni
+    agrega tareas, por lo que no interfiere con las respuestas en streaming.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, status=str(status))
@@ -8,7 +8,7 @@
 import uuid
 import enum
 from sqlalchemy import (
-    Column, Text, Integer, TIMESTAMP, ForeignKey, Enum, func
+    Column, Text, Integer, BigInteger, LargeBinary, TIMESTAMP, ForeignKey, Enum, Index, func
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -56,6 +56,15 @@ class Conversation(Base):
         Número de mensajes enviados por el usuario.
     message_count_bot : int
         Número de respuestas enviadas por el asistente.
+    summary : str
+        Resumen acumulado de los turnos que ya salieron de la ventana reciente
+        (lo genera una tarea en segundo plano en debates largos).
+    summary_message_id : int
+        ID del último mensaje incorporado al resumen.
+    message_seq : int
+        Último número de secuencia asignado a un mensaje de la conversación
+        (contador para `messages.seq`, se incrementa en el mismo statement que
+        inserta los mensajes del turno).
     messages : List[Message]
         Relación con los mensajes individuales de la conversación.
         Se elimina en cascada si la conversación es borrada.
@@ -73,8 +82,19 @@ class Conversation(Base):
     message_count_user = Column(Integer, default=0, nullable=False)
     message_count_bot = Column(Integer, default=0, nullable=False)
 
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(BigInteger, nullable=True)
+
+    message_seq = Column(BigInteger, default=0, nullable=False)
+
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
+    # Borrado por antigüedad (app/retention.py). `created_at` no cambia: el índice
+    # no impide los UPDATE HOT de los contadores en cada turno.
+    __table_args__ = (
+        Index("idx_conversations_created_at", "created_at"),
+    )
+
 
 class Message(Base):
     """
@@ -86,7 +106,8 @@ class Message(Base):
     Atributos:
     ----------
     id : int
-        Identificador autoincremental del mensaje (primary key).
+        Identificador autoincremental del mensaje (primary key; con la tabla
+        particionada la PK en la DB es `(id, created_at)`, ver app/retention.py).
     conversation_id : UUID
         Clave foránea hacia la conversación (`conversations.id`).
         Si la conversación se elimina, sus mensajes también (CASCADE).
@@ -94,6 +115,12 @@ class Message(Base):
         Rol del mensaje (`user` o `assistant`).
     content : str
         Texto del mensaje.
+    token_count : int
+        Tokens estimados del mensaje, calculados una sola vez al guardarlo
+        (opcional: filas antiguas pueden no tenerlo).
+    seq : int
+        Posición del mensaje dentro de su conversación (1, 2, 3...). Define el
+        orden del historial: no depende del reloj de cada worker.
     created_at : datetime
         Fecha y hora en que se creó el mensaje (por defecto `NOW()`).
     conversation : Conversation
@@ -105,6 +132,80 @@ class Message(Base):
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"))
     role = Column(Enum(MessageRole, name="message_role"), nullable=False)
     content = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=True)
+    seq = Column(BigInteger, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
 
     conversation = relationship("Conversation", back_populates="messages")
+
+    # Ventana reciente y paginación del historial: range scan por (conversation_id, seq).
+    # `role` va como columna incluida para filtrar por rol sin leer el heap.
+    __table_args__ = (
+        Index(
+            "idx_messages_conversation_seq",
+            "conversation_id", "seq",
+            unique=True,
+            postgresql_include=["role"],
+        ),
+    )
+
+
+class MessageArchive(Base):
+    """
+    Tabla `message_archives`.
+
+    Mensajes de una conversación inactiva empaquetados en un solo blob
+    comprimido (ver app/archive.py). Mientras existe la fila, la conversación
+    no tiene mensajes propios en `messages`: se restauran en el próximo acceso.
+
+    Atributos:
+    ----------
+    conversation_id : UUID
+        Conversación archivada (primary key; se elimina en cascada con ella).
+    payload : bytes
+        JSON comprimido con zlib con los mensajes (id, seq, rol, contenido,
+        tokens y fecha).
+    message_count : int
+        Cantidad de mensajes archivados.
+    raw_bytes : int
+        Tamaño del JSON sin comprimir (para medir la compresión).
+    archived_at : datetime
+        Momento en que se archivó.
+    """
+    __tablename__ = "message_archives"
+
+    conversation_id = Column(
+        UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    payload = Column(LargeBinary, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)
+    archived_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+
+class ReplyCacheEntry(Base):
+    """
+    Tabla `llm_reply_cache`.
+
+    Nivel persistente de la caché de respuestas del LLM (ver app/reply_cache.py).
+
+    Atributos:
+    ----------
+    key : str
+        SHA-256 de (modelo, mensajes, temperature, max_tokens) (primary key).
+    model : str
+        Modelo que generó la respuesta.
+    reply : str
+        Respuesta generada por el modelo.
+    created_at : datetime
+        Momento en que se guardó la respuesta.
+    expires_at : datetime
+        Momento a partir del cual la respuesta deja de servirse.
+    """
+    __tablename__ = "llm_reply_cache"
+
+    key = Column(Text, primary_key=True)
+    model = Column(Text, nullable=False)
+    reply = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
@@ -0,0 +1,261 @@
+"""
+Módulo: reply_cache.py
+----------------------
+Caché de respuestas del LLM direccionada por contenido (coincidencia exacta).
+
+Propósito:
+----------
+Prompts idénticos se repiten con frecuencia: clientes automatizados, reintentos
+y las redirecciones "Entiendo tu interés, pero recuerda que este debate es
+sobre...". Cada uno pagaba una completion completa en `ask_llm`. Con esta caché,
+un prompt repetido cuesta una búsqueda en memoria o en Postgres.
+
+Características:
+----------------
+- Clave: SHA-256 de (modelo, mensajes ya recortados, temperature, max_tokens).
+  Cualquier diferencia en el system prompt o en el historial cambia la clave.
+- Dos niveles:
+    1. LRU en memoria (por proceso), acotado por `REPLY_CACHE_MAX_ENTRIES`.
+    2. Tabla `llm_reply_cache` en Postgres con expiración (`REPLY_CACHE_TTL`),
+       compartida entre workers y reinicios. Opcional
+       (`REPLY_CACHE_DB_ENABLED=1`): cada miss en memoria suma una consulta.
+- Un hit del nivel Postgres se copia al nivel en memoria.
+- La escritura en Postgres corre en segundo plano: la respuesta no la espera
+  (`flush()` espera las pendientes, ej. al apagar la app).
+- Opt-out por llamada (`ask_llm(..., use_cache=False)`) y por clave
+  (`exclude()`); las claves excluidas se acotan al tamaño del nivel en memoria.
+- Contadores de hits (por nivel), misses, escrituras y evictions.
+
+Notas:
+------
+- Solo se guardan respuestas reales del modelo, nunca el fallback por error.
+- Los errores del nivel Postgres no rompen la request: se registran y se
+  continúa como si fuera un miss.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import (
+    REPLY_CACHE_ENABLED,
+    REPLY_CACHE_MAX_ENTRIES,
+    REPLY_CACHE_TTL,
+    REPLY_CACHE_DB_ENABLED,
+)
+from app.db import AsyncSessionLocal
+from app.models import ReplyCacheEntry
+
+
+def make_key(model: str, messages: List[dict], temperature: float, max_tokens: int) -> str:
+    """
+    Calcula la clave de caché de una llamada al modelo.
+
+    Args:
+        model (str): Modelo de OpenAI.
+        messages (List[dict]): Mensajes exactos que se envían (system + historial recortado).
+        temperature (float): Temperatura de muestreo.
+        max_tokens (int): Tokens máximos de la respuesta.
+
+    Returns:
+        str: Hash SHA-256 en hexadecimal.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """
+    Caché de respuestas en dos niveles: LRU en memoria y tabla en Postgres.
+
+    Args:
+        max_entries (int): Máximo de respuestas en memoria (0 desactiva la caché).
+        ttl (float): Segundos de vida de una respuesta en ambos niveles.
+        use_db (bool): Si se usa el nivel persistente en Postgres.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, use_db: bool):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_db = use_db
+
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # Claves excluidas como LRU acotado: un set crecería con cada prompt distinto
+        self._excluded: "OrderedDict[str, None]" = OrderedDict()
+        # Escrituras pendientes en Postgres (referencias para que el GC no las cancele)
+        self._writes: Set[asyncio.Task] = set()
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.db_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def exclude(self, key: str) -> None:
+        """
+        Opt-out por clave: la respuesta de ese prompt nunca se sirve ni se guarda.
+        """
+        self._excluded[key] = None
+        self._excluded.move_to_end(key)
+        while len(self._excluded) > max(self.max_entries, 1):
+            self._excluded.popitem(last=False)
+        self._entries.pop(key, None)
+
+    def is_cacheable(self, key: str) -> bool:
+        if not self.enabled:
+            return False
+        if key in self._excluded:
+            self._excluded.move_to_end(key)
+            return False
+        return True
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Busca una respuesta: primero en memoria, luego en Postgres.
+
+        Returns:
+            Optional[str]: La respuesta cacheada o `None` (miss, expirada o excluida).
+        """
+        if not self.is_cacheable(key):
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            reply, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return reply
+            del self._entries[key]
+
+        if self.use_db:
+            reply = await self._db_get(key)
+            if reply is not None:
+                self._remember(key, reply)
+                self.db_hits += 1
+                return reply
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, model: str, reply: str) -> None:
+        """
+        Guarda una respuesta del modelo en ambos niveles (en Postgres, en
+        segundo plano).
+        """
+        if not self.is_cacheable(key) or not reply:
+            return
+
+        self._remember(key, reply)
+        self.writes += 1
+        if self.use_db:
+            task = asyncio.create_task(self._db_put(key, model, reply))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def flush(self) -> None:
+        """
+        Espera a que terminen las escrituras pendientes en Postgres.
+        """
+        if self._writes:
+            await asyncio.gather(*self._writes)
+
+    async def purge_expired(self) -> int:
+        """
+        Elimina de Postgres las respuestas expiradas. Devuelve cuántas se borraron.
+        """
+        if not self.use_db:
+            return 0
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(ReplyCacheEntry).where(ReplyCacheEntry.expires_at <= datetime.now(timezone.utc))
+            )
+            await db.commit()
+        return result.rowcount or 0
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._excluded.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Métricas de la caché para monitoreo.
+        """
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "excluded_keys": len(self._excluded),
+            "db_errors": self.db_errors,
+        }
+
+    def _remember(self, key: str, reply: str) -> None:
+        self._entries[key] = (reply, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _db_get(self, key: str) -> Optional[str]:
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(ReplyCacheEntry.reply).where(
+                        ReplyCacheEntry.key == key,
+                        ReplyCacheEntry.expires_at > datetime.now(timezone.utc),
+                    )
+                )
+                return result.scalar_one_or_none()
+        except Exception as e:
+            self.db_errors += 1
+            print(f"[Reply Cache Error] {str(e)}")
+            return None
+
+    async def _db_put(self, key: str, model: str, reply: str) -> None:
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl)
+        stmt = insert(ReplyCacheEntry).values(
+            key=key, model=model, reply=reply, created_at=now, expires_at=expires_at,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ReplyCacheEntry.key],
+            set_={"reply": stmt.excluded.reply, "created_at": now, "expires_at": expires_at},
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            self.db_errors += 1
+            print(f"[Reply Cache Error] {str(e)}")
+
+
+# Instancia compartida por el proceso
+reply_cache = ReplyCache(
+    max_entries=REPLY_CACHE_MAX_ENTRIES if REPLY_CACHE_ENABLED else 0,
+    ttl=REPLY_CACHE_TTL,
+    use_db=REPLY_CACHE_DB_ENABLED,
+)
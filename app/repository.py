@@ -0,0 +1,393 @@
+"""
+Módulo: repository.py
+---------------------
+Acceso a datos de conversaciones y mensajes (capa de repositorio).
+
+Responsabilidades:
+------------------
+- Buscar conversaciones por UUID (restaurando las archivadas, ver app/archive.py).
+- Leer la ventana reciente del historial de una conversación.
+- Leer el historial completo por páginas (keyset sobre `seq`).
+- Persistir un turno completo (mensaje del usuario + respuesta del bot)
+  en una sola transacción.
+- Persistir un lote de turnos de varias conversaciones (escritura diferida).
+- Leer los mensajes de apertura recientes (precarga del índice de aperturas).
+
+Notas de diseño:
+----------------
+- La escritura de un turno se hace en **un único statement**: un INSERT
+  multi-fila con `RETURNING` para los dos mensajes, encadenado (CTE) con el
+  INSERT de la conversación nueva o el UPDATE de sus contadores. Así un turno
+  cuesta un round trip más el COMMIT, sin `refresh()` posteriores.
+- Ninguna función mantiene una transacción abierta durante la llamada al LLM:
+  el endpoint lee, libera la conexión, llama al modelo y luego escribe.
+- El orden del historial lo da `messages.seq` (posición dentro de la
+  conversación), no `created_at`: se asigna en el mismo statement que
+  incrementa el contador `conversations.message_seq`, así que es único y
+  monótono aunque los relojes de los workers difieran.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import Integer, column, insert, select, union_all, update, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.archive import archiver
+from app.config import HISTORY_WINDOW_PER_ROLE
+from app.models import Conversation, Message, MessageArchive, MessageRole
+from app.schemas import MessageTurn
+
+
+async def get_conversation(db: AsyncSession, conv_uuid: UUID) -> Optional[Conversation]:
+    """
+    Busca una conversación por su UUID.
+
+    Args:
+        db (AsyncSession): Sesión de base de datos.
+        conv_uuid (UUID): Identificador de la conversación.
+
+    Si la conversación estaba archivada (`message_archives`), sus mensajes se
+    restauran en la misma transacción antes de devolverla: las lecturas
+    siguientes del historial los ven sin saber del archivo. Saber si está
+    archivada no cuesta otra consulta (LEFT JOIN por la primary key).
+
+    Returns:
+        Optional[Conversation]: La conversación o `None` si no existe.
+    """
+    result = await db.execute(
+        select(Conversation, MessageArchive.conversation_id.label("archived"))
+        .outerjoin(MessageArchive, MessageArchive.conversation_id == Conversation.id)
+        .where(Conversation.id == conv_uuid)
+        # Contadores al día aunque la sesión ya tenga la conversación cargada
+        .execution_options(populate_existing=True)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    if row.archived is not None:
+        await archiver.rehydrate(db, conv_uuid)
+    return row.Conversation
+
+
+async def get_message_seq(db: AsyncSession, conv_uuid: UUID) -> Optional[int]:
+    """
+    `message_seq` actual de una conversación (lectura por primary key), o
+    `None` si no existe. Valida una entrada de `conversation_cache`.
+    """
+    result = await db.execute(select(Conversation.message_seq).where(Conversation.id == conv_uuid))
+    return result.scalar_one_or_none()
+
+
+async def load_recent_history(
+    db: AsyncSession,
+    conv_uuid: UUID,
+    per_role: int = HISTORY_WINDOW_PER_ROLE,
+) -> List[MessageTurn]:
+    """
+    Recupera solo los últimos `per_role` turnos de usuario y los últimos
+    `per_role` turnos del asistente, en orden de `seq`.
+
+    En lugar de traer toda la conversación y recortar en Python, cada rol se
+    resuelve con un `ORDER BY seq DESC LIMIT k` que recorre hacia atrás el
+    índice `(conversation_id, seq) INCLUDE (role)` y se detiene al completar su
+    cuota (index-only: el rol está en el índice); ambas ramas se unen con
+    `UNION ALL` y solo las filas elegidas se leen del heap para traer el
+    contenido. El costo queda acotado por la ventana y no por la longitud del
+    debate.
+
+    Con `per_role` = 10 la misma ventana sirve para el LLM (10x10) y, tras
+    agregar el turno nuevo, para la respuesta de la API (5x5).
+
+    Args:
+        db (AsyncSession): Sesión de base de datos.
+        conv_uuid (UUID): Identificador de la conversación.
+        per_role (int): Turnos a conservar por rol.
+
+    Returns:
+        List[MessageTurn]: Ventana reciente de la conversación.
+    """
+    def last_turns(role: MessageRole):
+        return (
+            select(Message.seq)
+            .where(Message.conversation_id == conv_uuid, Message.role == role)
+            .order_by(Message.seq.desc())
+            .limit(per_role)
+        )
+
+    window = union_all(
+        last_turns(MessageRole.user),
+        last_turns(MessageRole.assistant),
+    ).subquery("window")
+
+    result = await db.execute(
+        select(Message.role, Message.content, Message.token_count)
+        .join(window, Message.seq == window.c.seq)
+        .where(Message.conversation_id == conv_uuid)
+        .order_by(Message.seq)
+    )
+    # Filas tipadas por la DB: los turnos se arman sin validación de Pydantic
+    return [
+        MessageTurn.model_construct(role=role.value, message=content, tokens=token_count)
+        for role, content, token_count in result
+    ]
+
+
+async def load_messages_page(
+    db: AsyncSession,
+    conv_uuid: UUID,
+    after: Optional[int],
+    limit: int,
+    role: Optional[MessageRole] = None,
+) -> List[Row]:
+    """
+    Lee una página del historial de una conversación, en orden de `seq`.
+
+    Paginación por keyset: la página siguiente arranca después de la última
+    fila vista (`after`) con `seq > :after`, en lugar de un `OFFSET`. Postgres
+    recorre el índice `(conversation_id, seq)` desde esa posición, así el costo
+    de una página no depende de su profundidad.
+
+    Args:
+        db (AsyncSession): Sesión de base de datos.
+        conv_uuid (UUID): Identificador de la conversación.
+        after (Optional[int]): `seq` de la última fila de la página anterior
+            (`None` = primera página).
+        limit (int): Filas a leer.
+        role (MessageRole, opcional): Solo los mensajes de ese rol.
+
+    Returns:
+        List[Row]: Filas (`id`, `seq`, `role`, `content`, `created_at`).
+    """
+    query = (
+        select(Message.id, Message.seq, Message.role, Message.content, Message.created_at)
+        .where(Message.conversation_id == conv_uuid)
+        .order_by(Message.seq)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(Message.seq > after)
+    if role is not None:
+        query = query.where(Message.role == role)
+    result = await db.execute(query)
+    return result.all()
+
+
+async def load_opening_messages(db: AsyncSession, limit: int) -> List[Tuple[str, str, str]]:
+    """
+    Recupera el primer mensaje de usuario de las conversaciones más recientes
+    junto con el tema y la postura detectados (precarga de `topic_index`).
+
+    El primer mensaje se obtiene con una subconsulta correlacionada que usa el
+    índice `(conversation_id, seq)` y se detiene en la primera fila.
+    Se omiten las conversaciones con el tema de fallback (`general`).
+
+    Args:
+        db (AsyncSession): Sesión de base de datos.
+        limit (int): Máximo de conversaciones a leer.
+
+    Returns:
+        List[Tuple[str, str, str]]: Tuplas `(mensaje, topic, stance)`, de la más
+            antigua a la más reciente.
+    """
+    first_message = (
+        select(Message.content)
+        .where(Message.conversation_id == Conversation.id, Message.role == MessageRole.user)
+        .order_by(Message.seq)
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        select(first_message, Conversation.topic, Conversation.stance)
+        .where(Conversation.topic.is_not(None), Conversation.topic != "general")
+        .order_by(Conversation.created_at.desc())
+        .limit(limit)
+    )
+    rows = [tuple(row) for row in result if row[0]]
+    rows.reverse()
+    return rows
+
+
+async def persist_turn(
+    db: AsyncSession,
+    conv: Conversation,
+    is_new: bool,
+    user_turns: Sequence[MessageTurn],
+    user_created_at: datetime,
+    bot_turn: MessageTurn,
+) -> List[Row]:
+    """
+    Persiste un turno completo en una sola transacción.
+
+    Se emite un único statement:
+    - CTE con el INSERT de la conversación (si es nueva, con contadores en 1)
+      o el UPDATE de sus contadores (si ya existía), incluido `message_seq`.
+    - INSERT multi-fila de los mensajes de usuario y asistente con `RETURNING`;
+      cada fila toma su `seq` del `message_seq` que devuelve la CTE. El UPDATE
+      bloquea la fila de la conversación, así dos turnos concurrentes nunca
+      reciben la misma secuencia.
+
+    Un turno tiene normalmente un mensaje de usuario; si se agruparon varios
+    mensajes en una sola respuesta (`CONVERSATION_COALESCE`), se insertan todos
+    en orden, separados por un microsegundo en `created_at`.
+
+    Args:
+        db (AsyncSession): Sesión de base de datos.
+        conv (Conversation): Conversación del turno (transitoria si `is_new`).
+        is_new (bool): Si la conversación aún no existe en DB.
+        user_turns (Sequence[MessageTurn]): Mensajes del usuario del turno (con su conteo de tokens).
+        user_created_at (datetime): Momento en que comenzó el turno (primer mensaje del usuario).
+        bot_turn (MessageTurn): Respuesta generada por el bot (con su conteo de tokens).
+
+    Returns:
+        List[Row]: Filas insertadas (`id`, `seq`, `role`, `created_at`, `user_turns`) en orden;
+            `user_turns` es el total de turnos de usuario de la conversación tras el turno.
+    """
+    now = datetime.now(timezone.utc)
+    count = len(user_turns)
+    n_messages = count + 1
+
+    if is_new:
+        conv_stmt = insert(Conversation).values(
+            id=conv.id,
+            topic=conv.topic,
+            stance=conv.stance,
+            engine=conv.engine,
+            message_count_user=count,
+            message_count_bot=1,
+            message_seq=n_messages,
+        )
+    else:
+        conv_stmt = (
+            update(Conversation)
+            .where(Conversation.id == conv.id)
+            .values(
+                message_count_user=Conversation.message_count_user + count,
+                message_count_bot=Conversation.message_count_bot + 1,
+                message_seq=Conversation.message_seq + n_messages,
+                updated_at=now,
+            )
+        )
+    conv_cte = conv_stmt.returning(
+        Conversation.id, Conversation.message_count_user, Conversation.message_seq,
+    ).cte("turn_conversation")
+    total_user_turns = select(conv_cte.c.message_count_user).scalar_subquery().label("user_turns")
+    last_seq = select(conv_cte.c.message_seq).scalar_subquery()
+
+    stmt = (
+        insert(Message)
+        .values([
+            *(
+                {
+                    "conversation_id": conv.id,
+                    "role": MessageRole.user,
+                    "content": turn.message,
+                    "token_count": turn.tokens,
+                    "seq": last_seq - (n_messages - 1 - i),
+                    "created_at": user_created_at + timedelta(microseconds=i),
+                }
+                for i, turn in enumerate(user_turns)
+            ),
+            {
+                "conversation_id": conv.id,
+                "role": MessageRole.assistant,
+                "content": bot_turn.message,
+                "token_count": bot_turn.tokens,
+                "seq": last_seq,
+                "created_at": now,
+            },
+        ])
+        .returning(Message.id, Message.seq, Message.role, Message.created_at, total_user_turns)
+        .add_cte(conv_cte)
+    )
+
+    result = await db.execute(stmt)
+    rows = result.all()
+    await db.commit()
+    return rows
+
+
+async def persist_turn_batch(
+    db: AsyncSession,
+    new_conversations: Sequence[dict],
+    counter_deltas: Dict[UUID, Tuple[int, int]],
+    messages: Sequence[dict],
+) -> Dict[UUID, int]:
+    """
+    Persiste en una sola transacción los turnos acumulados de varias conversaciones
+    (ver app/write_behind.py).
+
+    - INSERT multi-fila de las conversaciones nuevas (con sus contadores finales).
+    - Un único UPDATE ... FROM (VALUES ...) con los incrementos de contadores de
+      las conversaciones existentes, en orden de id (mismo orden de locks entre workers).
+    - INSERT multi-fila de todos los mensajes del lote, con su `seq` calculado a
+      partir del `message_seq` que devuelven los dos statements anteriores (la
+      fila de la conversación queda bloqueada hasta el COMMIT).
+
+    Args:
+        db (AsyncSession): Sesión de base de datos.
+        new_conversations (Sequence[dict]): Valores de las conversaciones a crear
+            (con `message_seq` = mensajes del lote).
+        counter_deltas (Dict[UUID, Tuple[int, int]]): Turnos de usuario y del bot a
+            sumar por conversación existente.
+        messages (Sequence[dict]): Filas de `messages` (sin `seq`), en orden cronológico.
+
+    Los mensajes de una conversación que ya no existe (borrada por la retención
+    mientras sus turnos esperaban) se descartan: no aparecen en el resultado.
+
+    Returns:
+        Dict[UUID, int]: Total de turnos de usuario de cada conversación tras el lote.
+    """
+    totals: Dict[UUID, int] = {}
+    last_seqs: Dict[UUID, int] = {}
+
+    if new_conversations:
+        result = await db.execute(
+            insert(Conversation)
+            .values(list(new_conversations))
+            .returning(Conversation.id, Conversation.message_count_user, Conversation.message_seq)
+        )
+        for conv_id, user_turns, last_seq in result:
+            totals[conv_id], last_seqs[conv_id] = user_turns, last_seq
+
+    if counter_deltas:
+        deltas = values(
+            column("id", PG_UUID(as_uuid=True)),
+            column("user_turns", Integer),
+            column("bot_turns", Integer),
+            name="deltas",
+        ).data([(conv_id, *counter_deltas[conv_id]) for conv_id in sorted(counter_deltas)])
+        result = await db.execute(
+            update(Conversation)
+            .where(Conversation.id == deltas.c.id)
+            .values(
+                message_count_user=Conversation.message_count_user + deltas.c.user_turns,
+                message_count_bot=Conversation.message_count_bot + deltas.c.bot_turns,
+                message_seq=Conversation.message_seq + deltas.c.user_turns + deltas.c.bot_turns,
+                updated_at=datetime.now(timezone.utc),
+            )
+            .returning(Conversation.id, Conversation.message_count_user, Conversation.message_seq)
+        )
+        for conv_id, user_turns, last_seq in result:
+            totals[conv_id], last_seqs[conv_id] = user_turns, last_seq
+
+    # Sin fila que actualizar, la conversación se borró: sus mensajes no se insertan
+    messages = [message for message in messages if message["conversation_id"] in last_seqs]
+    if messages:
+        # Numerar los mensajes de cada conversación a continuación de su último seq
+        in_batch: Dict[UUID, int] = {}
+        for message in messages:
+            in_batch[message["conversation_id"]] = in_batch.get(message["conversation_id"], 0) + 1
+        next_seq = {conv_id: last_seqs[conv_id] - count + 1 for conv_id, count in in_batch.items()}
+        rows = []
+        for message in messages:
+            conv_id = message["conversation_id"]
+            rows.append({**message, "seq": next_seq[conv_id]})
+            next_seq[conv_id] += 1
+        await db.execute(insert(Message), rows)
+
+    await db.commit()
+    return totals
@@ -0,0 +1,451 @@
+"""
+Módulo: resilience.py
+---------------------
+Capa de resiliencia alrededor de las llamadas al LLM.
+
+Propósito:
+----------
+Cuando el proveedor se degrada, cada `/chat` esperaba el `LLM_TIMEOUT` completo
+(30s) antes de devolver el fallback, reteniendo conexiones a la DB y sockets del
+cliente. Esta capa acota esa espera:
+
+- Timeout adaptativo: `p99 observado × LLM_TIMEOUT_MULTIPLIER`, acotado entre
+  `LLM_TIMEOUT_MIN` y `LLM_TIMEOUT`. Sin muestras suficientes se usa `LLM_TIMEOUT`.
+  Un intento cortado por timeout cuenta como muestra del timeout usado: si la
+  latencia del proveedor sube por encima, el timeout crece en vez de quedar
+  fijo cortando todas las llamadas (y la prueba del circuito).
+- Hedging (opcional): si la llamada supera el p95 se lanza una segunda idéntica
+  y se usa la primera que responda; la otra se cancela.
+- Circuit breaker: con una tasa de error alta en las últimas llamadas, el
+  circuito se abre y las llamadas fallan al instante (el llamador responde el
+  fallback). Pasado el cooldown se deja pasar una llamada de prueba.
+- Reintentos acotados con backoff exponencial y jitter completo, solo ante
+  errores transitorios (timeouts, conexión, 429, 5xx) y dentro de `LLM_TIMEOUT`.
+
+Notas:
+------
+- Hay un `LLMGuard` por motor (`get_guard(engine.label)`), con latencias
+  separadas por tipo de llamada (`reply`, `opening`, `summary`, ...): un resumen
+  de 400 tokens no debe fijar el timeout de una réplica corta.
+- Los errores no transitorios (ej. 400/401) no abren el circuito ni se
+  reintentan: el proveedor respondió, el problema es del pedido.
+- En streaming solo aplican el circuito y el timeout hasta el primer fragmento.
+- El estado se expone en `/stats` (`llm`) y `/metrics`.
+"""
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from app.config import (
+    LLM_TIMEOUT,
+    LLM_ADAPTIVE_TIMEOUT,
+    LLM_TIMEOUT_MIN,
+    LLM_TIMEOUT_MULTIPLIER,
+    LLM_LATENCY_WINDOW,
+    LLM_LATENCY_MIN_SAMPLES,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_BREAKER_ENABLED,
+    LLM_BREAKER_WINDOW,
+    LLM_BREAKER_MIN_CALLS,
+    LLM_BREAKER_ERROR_RATE,
+    LLM_BREAKER_COOLDOWN,
+    LLM_RETRIES,
+    LLM_RETRY_BACKOFF,
+    LLM_RETRY_BACKOFF_MAX,
+)
+from app.metrics import LLM_RETRIES as RETRIES_TOTAL, LLM_HEDGES, LLM_BREAKER_REJECTIONS
+
+T = TypeVar("T")
+
+_TRANSIENT_ERRORS = (
+    APITimeoutError,
+    APIConnectionError,
+    RateLimitError,
+    InternalServerError,
+    asyncio.TimeoutError,
+    httpx.TimeoutException,
+    httpx.TransportError,
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    El circuito del motor está abierto: la llamada se rechaza sin ir al proveedor.
+    """
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Indica si un error es transitorio (reintentable y atribuible al proveedor).
+    """
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+
+def is_timeout(error: BaseException) -> bool:
+    """
+    Indica si un error es un timeout de la llamada (no una falla de conexión).
+    """
+    return isinstance(error, (APITimeoutError, asyncio.TimeoutError, httpx.TimeoutException))
+
+
+def _consume_result(task: asyncio.Future) -> None:
+    # Evita el warning "exception was never retrieved" de las tareas descartadas
+    if not task.cancelled():
+        task.exception()
+
+
+class LatencyTracker:
+    """
+    Ventana de latencias recientes (segundos) con percentiles por rango más cercano.
+    """
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW, min_samples: int = LLM_LATENCY_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Percentil `pct` de la ventana, o `None` si aún no hay muestras suficientes.
+        """
+        if len(self._samples) < max(self.min_samples, 1):
+            return None
+        ordered = sorted(self._samples)
+        rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+        return ordered[min(rank, len(ordered) - 1)]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por tasa de error sobre las últimas `window` llamadas.
+
+    Estados:
+        closed    → las llamadas pasan; se registra su resultado.
+        open      → se rechazan todas hasta que pase `cooldown`.
+        half_open → pasa una llamada de prueba por `cooldown`; si sale bien el
+                    circuito se cierra, si falla vuelve a abrirse.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        window: int = LLM_BREAKER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        error_rate: float = LLM_BREAKER_ERROR_RATE,
+        cooldown: float = LLM_BREAKER_COOLDOWN,
+        enabled: bool = LLM_BREAKER_ENABLED,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_at: Optional[float] = None
+        self.opened_count = 0
+
+    def allow(self) -> bool:
+        """
+        Indica si una llamada puede ir al proveedor (y reserva la prueba en half_open).
+        """
+        if not self.enabled or self.state == self.CLOSED:
+            return True
+        now = self._clock()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.cooldown:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_at = None
+        # half_open: una prueba a la vez; si la prueba nunca reporta (ej. se
+        # canceló), se admite otra pasado el cooldown
+        if self._probe_at is None or now - self._probe_at >= self.cooldown:
+            self._probe_at = now
+            return True
+        return False
+
+    def record(self, healthy: bool) -> None:
+        """
+        Registra el resultado de una llamada (`healthy=False` solo para errores transitorios).
+        """
+        if not self.enabled:
+            return
+        if self.state == self.HALF_OPEN:
+            if healthy:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        if self.state == self.OPEN:
+            return
+
+        self._outcomes.append(healthy)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = self._clock()
+        self._probe_at = None
+        self._outcomes.clear()
+        self.opened_count += 1
+
+    def stats(self) -> dict:
+        calls = len(self._outcomes)
+        return {
+            "state": self.state,
+            "error_rate": round(self._outcomes.count(False) / calls, 3) if calls else 0.0,
+            "window_calls": calls,
+            "opened": self.opened_count,
+            "retry_in_s": round(max(self.cooldown - (self._clock() - self._opened_at), 0.0), 1)
+            if self.state == self.OPEN else 0.0,
+        }
+
+
+class LLMGuard:
+    """
+    Aplica timeout adaptativo, hedging, circuit breaker y reintentos a las llamadas de un motor.
+
+    Args:
+        name (str): Motor protegido (para métricas y `/stats`).
+        max_timeout (float): Tope de cada llamada incluyendo reintentos (`LLM_TIMEOUT`).
+        breaker (CircuitBreaker, opcional): Circuit breaker a usar.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        max_timeout: float = LLM_TIMEOUT,
+        min_timeout: float = LLM_TIMEOUT_MIN,
+        multiplier: float = LLM_TIMEOUT_MULTIPLIER,
+        adaptive: bool = LLM_ADAPTIVE_TIMEOUT,
+        hedge: bool = LLM_HEDGE_ENABLED,
+        hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+        retries: int = LLM_RETRIES,
+        backoff: float = LLM_RETRY_BACKOFF,
+        backoff_max: float = LLM_RETRY_BACKOFF_MAX,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.multiplier = multiplier
+        self.adaptive = adaptive
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+
+    def _tracker(self, call: str) -> LatencyTracker:
+        tracker = self._latency.get(call)
+        if tracker is None:
+            tracker = self._latency[call] = LatencyTracker()
+        return tracker
+
+    def timeout_for(self, call: str) -> float:
+        """
+        Timeout de la próxima llamada de tipo `call` (segundos).
+        """
+        p99 = self._tracker(call).percentile(99) if self.adaptive else None
+        if p99 is None:
+            return self.max_timeout
+        return min(max(p99 * self.multiplier, self.min_timeout), self.max_timeout)
+
+    def hedge_delay(self, call: str) -> Optional[float]:
+        """
+        Espera antes de lanzar la llamada duplicada, o `None` si no corresponde hedging.
+        """
+        if not self.hedge:
+            return None
+        p95 = self._tracker(call).percentile(95)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def _reject(self, call: str) -> CircuitOpenError:
+        self.rejected += 1
+        LLM_BREAKER_REJECTIONS.inc(engine=self.name, call=call)
+        return CircuitOpenError(f"circuito abierto para el motor '{self.name}'")
+
+    async def run(self, call: str, attempt: Callable[[float], Awaitable[T]]) -> T:
+        """
+        Ejecuta una llamada protegida.
+
+        Args:
+            call (str): Tipo de llamada (`reply`, `opening`, `stance`, `summary`).
+            attempt: Función que recibe el timeout (segundos) y devuelve una
+                corrutina nueva con la llamada al motor. Se invoca una vez por
+                intento y por llamada duplicada.
+
+        Returns:
+            El resultado del primer intento exitoso.
+
+        Raises:
+            CircuitOpenError: Si el circuito está abierto.
+            Exception: El último error si se agotan reintentos o el tiempo.
+        """
+        if not self.breaker.allow():
+            raise self._reject(call)
+
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_timeout
+        tries = 0
+
+        while True:
+            timeout = min(self.timeout_for(call), deadline - loop.time())
+            start = time.perf_counter()
+            try:
+                result = await self._attempt(call, attempt, timeout)
+            except Exception as e:
+                if is_timeout(e):
+                    self._tracker(call).observe(timeout)
+                transient = is_transient(e)
+                self.breaker.record(healthy=not transient)
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** tries))
+                if (
+                    not transient
+                    or tries >= self.retries
+                    or self.breaker.state != CircuitBreaker.CLOSED
+                    or loop.time() + backoff >= deadline
+                ):
+                    self.failures += 1
+                    raise
+                tries += 1
+                self.retried += 1
+                RETRIES_TOTAL.inc(engine=self.name, call=call)
+                await asyncio.sleep(backoff)
+                continue
+
+            self._tracker(call).observe(time.perf_counter() - start)
+            self.breaker.record(healthy=True)
+            return result
+
+    async def _attempt(self, call: str, attempt: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        """
+        Un intento con timeout y, si corresponde, una llamada duplicada pasado el p95.
+        """
+        delay = self.hedge_delay(call)
+        if delay is None or delay >= timeout:
+            return await asyncio.wait_for(attempt(timeout), timeout)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        primary = asyncio.ensure_future(attempt(timeout))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedged += 1
+            LLM_HEDGES.inc(engine=self.name, call=call, outcome="fired")
+            pending.add(asyncio.ensure_future(attempt(deadline - loop.time())))
+
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                            LLM_HEDGES.inc(engine=self.name, call=call, outcome="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.add_done_callback(_consume_result)
+                task.cancel()
+
+    async def stream(self, call: str, open_stream: Callable[[float], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Variante para streaming: circuito + timeout hasta el primer fragmento.
+
+        Una vez emitido el primer fragmento no hay reintentos ni hedging (el
+        cliente ya recibió parte de la respuesta).
+        """
+        if not self.breaker.allow():
+            raise self._reject(call)
+
+        self.calls += 1
+        timeout = self.timeout_for(call)
+        chunks = open_stream(timeout).__aiter__()
+        try:
+            try:
+                first = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                self.breaker.record(healthy=True)
+                return
+            except Exception as e:
+                self.failures += 1
+                self.breaker.record(healthy=not is_transient(e))
+                raise
+            self.breaker.record(healthy=True)
+
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.stats(),
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+            "timeouts_s": {call: round(self.timeout_for(call), 3) for call in sorted(self._latency)},
+        }
+
+
+_guards: Dict[str, LLMGuard] = {}
+
+
+def get_guard(engine: str) -> LLMGuard:
+    """
+    Devuelve el `LLMGuard` del motor `engine` (uno por motor y proceso).
+    """
+    guard = _guards.get(engine)
+    if guard is None:
+        guard = _guards[engine] = LLMGuard(engine)
+    return guard
+
+
+def guards_stats() -> Dict[str, dict]:
+    return {name: guard.stats() for name, guard in _guards.items()}
@@ -0,0 +1,75 @@
+"""
+Módulo: responses.py
+--------------------
+Camino rápido de serialización de las respuestas JSON.
+
+Propósito:
+----------
+Con el LLM simulado, armar y serializar la respuesta pasaba a verse en los
+perfiles de CPU: cada fila se convertía en un modelo de Pydantic, la respuesta
+se envolvía en `ChatResponse`, FastAPI la volvía a validar contra
+`response_model` y el resultado se serializaba con el `json` de la stdlib.
+Aquí:
+
+- `FastJSONResponse` serializa con orjson (clase de respuesta por defecto de la app).
+- Los endpoints calientes (`/chat`, página del historial) arman diccionarios
+  directamente desde los turnos y las filas de la DB (`chat_payload`,
+  `stored_message_payload`) y devuelven la respuesta ya construida: FastAPI no
+  la valida otra vez. `ChatResponse`/`MessagePage` siguen describiendo el
+  contrato en el OpenAPI.
+
+Notas:
+------
+- El formato en el cable no cambia: mismas claves y orden, JSON compacto y
+  UTF-8 sin escapar; `OPT_UTC_Z` escribe las fechas UTC con `Z` igual que Pydantic.
+- Estas funciones confían en datos armados por el servidor: la validación de
+  entrada (`ChatRequest`) no cambia.
+"""
+
+from typing import Any, Iterable, Optional
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+from app.schemas import MessageTurn
+
+# Opciones de orjson compatibles con la salida de Pydantic
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    Respuesta JSON serializada con orjson (mismo formato que la de Pydantic).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def turn_payload(turn: MessageTurn) -> dict:
+    """
+    Turno en el formato de `MessageTurn` en la respuesta (sin `tokens`).
+    """
+    return {"role": turn.role, "message": turn.message}
+
+
+def chat_payload(conversation_id: str, turns: Iterable[MessageTurn], engine: Optional[str]) -> dict:
+    """
+    Cuerpo de `ChatResponse` armado sin validación.
+    """
+    return {
+        "conversation_id": conversation_id,
+        "message": [turn_payload(turn) for turn in turns],
+        "engine": engine,
+    }
+
+
+def stored_message_payload(row) -> dict:
+    """
+    `StoredMessage` directo desde una fila de `load_messages_page`.
+    """
+    return {"id": row.id, "role": row.role.value, "message": row.content, "created_at": row.created_at}
@@ -0,0 +1,410 @@
+"""
+Módulo: retention.py
+--------------------
+Particionado de `messages` por fecha y tarea de retención.
+
+Propósito:
+----------
+Las conversaciones son casi siempre de un solo turno y se enfrían en horas,
+pero sus mensajes quedaban para siempre en un único heap: VACUUM y los índices
+crecían con datos que nadie vuelve a leer. Aquí:
+
+- `messages` pasa a estar particionada por rango de `created_at`, una
+  partición por día (UTC) con nombre `messages_pYYYYMMDD`. Los índices de las
+  particiones recientes son chicos y quedan en `shared_buffers`; los de días
+  viejos no compiten por memoria.
+- La conversión es opcional (`MESSAGES_PARTITIONING=1`, la aplica la API al
+  arrancar; `scripts/ddl.sql` no la incluye) e idempotente
+  (`PARTITION_MESSAGES`): renombra la tabla previa a `messages_legacy` y la adjunta
+  como partición de todo lo anterior al momento de la conversión, sin copiar
+  filas. Una partición `messages_default` recibe cualquier fila fuera de rango
+  para que un INSERT nunca falle. Si la tarea se atrasó y la DEFAULT ya tiene
+  filas de un día, al crear su partición esas filas se mueven a ella (si no,
+  Postgres rechaza la partición y la DEFAULT crecería sin límite).
+- Una tarea en segundo plano (`retention_job`), cada `RETENTION_INTERVAL`
+  segundos:
+    • crea las particiones de los próximos `MESSAGES_PARTITION_PREMAKE_DAYS` días;
+    • archiva comprimidas las conversaciones sin actividad hace más de
+      `ARCHIVE_IDLE_DAYS` días (ver app/archive.py);
+    • separa (DETACH) las particiones con más de `MESSAGES_RETENTION_DAYS` días
+      y las borra, o las deja como tablas sueltas para archivarlas
+      (`MESSAGES_RETENTION_KEEP_DETACHED`);
+    • borra las conversaciones sin actividad hace más de `CONVERSATION_TTL_DAYS`
+      días en lotes de `RETENTION_BATCH_SIZE`, cada lote en su transacción.
+
+Notas:
+------
+- Cada paso es una transacción corta con `lock_timeout`: si un DETACH no
+  consigue el lock a tiempo se reintenta en la próxima corrida en vez de
+  bloquear los INSERT que esperan detrás. Los lotes de borrado usan
+  `FOR UPDATE SKIP LOCKED` y no esperan a los turnos en curso.
+- Con varios workers, un advisory lock hace que corra uno solo a la vez.
+- Las particiones que no se pudieron crear o separar se cuentan en `stats()`
+  y en `/metrics` (`kopi_partition_errors_total`).
+- En la tabla particionada la PK es `(id, created_at)` y el índice
+  `(conversation_id, seq)` deja de ser único (Postgres exige la columna de
+  partición en todo índice único); `seq` lo sigue asignando el contador de la
+  conversación.
+- Borrar particiones elimina mensajes aunque la conversación siga activa:
+  conviene `MESSAGES_RETENTION_DAYS` >= `CONVERSATION_TTL_DAYS`.
+"""
+
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.archive import archiver
+from app.config import (
+    ARCHIVE_IDLE_DAYS,
+    MESSAGES_PARTITION_PREMAKE_DAYS,
+    MESSAGES_RETENTION_DAYS,
+    MESSAGES_RETENTION_KEEP_DETACHED,
+    CONVERSATION_TTL_DAYS,
+    RETENTION_ENABLED,
+    RETENTION_INTERVAL,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE,
+    RETENTION_LOCK_TIMEOUT,
+)
+from app.db import engine
+from app.metrics import PARTITION_ERRORS, PARTITION_ROWS_MOVED
+
+# Clave del advisory lock de la tarea (una sola corrida a la vez entre workers)
+_LOCK_KEY = 0x6B6F7069_72657400
+
+# Conversión de `messages` a tabla particionada (no hace nada si ya lo está)
+PARTITION_MESSAGES = """
+DO $$
+DECLARE
+  cutover TIMESTAMPTZ;
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass) THEN
+    RETURN;
+  END IF;
+
+  LOCK TABLE messages IN ACCESS EXCLUSIVE MODE;
+  SELECT greatest(max(created_at) + interval '1 microsecond', now()) INTO cutover FROM messages;
+
+  -- La tabla previa queda como partición de todo lo anterior a `cutover`;
+  -- lo que resta del día va a su propia partición
+  ALTER TABLE messages RENAME TO messages_legacy;
+  ALTER TABLE messages_legacy DROP CONSTRAINT messages_pkey;
+  DROP INDEX IF EXISTS idx_messages_conversation_seq;
+  DROP INDEX IF EXISTS idx_messages_created_at;
+
+  CREATE TABLE messages (LIKE messages_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS)
+    PARTITION BY RANGE (created_at);
+  ALTER TABLE messages ADD PRIMARY KEY (id, created_at);
+  ALTER TABLE messages ADD FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE;
+  CREATE INDEX idx_messages_conversation_seq ON messages (conversation_id, seq) INCLUDE (role);
+  EXECUTE format('ALTER SEQUENCE %s OWNED BY messages.id', pg_get_serial_sequence('messages_legacy', 'id'));
+
+  EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)', cutover);
+  EXECUTE format('CREATE TABLE messages_p%s PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                 to_char(cutover AT TIME ZONE 'UTC', 'YYYYMMDD'), cutover,
+                 date_trunc('day', cutover, 'UTC') + interval '1 day');
+  CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+END$$
+"""
+
+# Particiones de `messages` con su límite superior (NULL para la DEFAULT)
+_LIST_PARTITIONS = """
+SELECT c.relname AS name,
+       (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz AS upper_bound
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'messages'::regclass
+ORDER BY upper_bound NULLS LAST
+"""
+
+# Un lote de conversaciones vencidas (el índice por created_at acota el recorrido)
+_DELETE_EXPIRED = """
+DELETE FROM conversations
+WHERE id IN (
+  SELECT id FROM conversations
+  WHERE created_at < :cutoff AND updated_at < :cutoff
+  ORDER BY created_at
+  LIMIT :limit
+  FOR UPDATE SKIP LOCKED
+)
+"""
+
+
+# ¿La DEFAULT tiene filas del rango de una partición por crear?
+_DEFAULT_HAS_ROWS = """
+SELECT EXISTS (SELECT 1 FROM messages_default WHERE created_at >= :start AND created_at < :end)
+"""
+
+# Mueve a la partición (aún suelta) las filas de su rango que cayeron en la DEFAULT
+_MOVE_FROM_DEFAULT = """
+WITH moved AS (
+  DELETE FROM messages_default WHERE created_at >= :start AND created_at < :end RETURNING *
+)
+INSERT INTO {name} SELECT * FROM moved
+"""
+
+
+def partition_name(day: date) -> str:
+    return f"messages_p{day:%Y%m%d}"
+
+
+async def _short_locks(conn: AsyncConnection) -> None:
+    await conn.execute(text(f"SET LOCAL lock_timeout = '{int(RETENTION_LOCK_TIMEOUT * 1000)}ms'"))
+
+
+async def partition_messages(conn: AsyncConnection) -> None:
+    """
+    Convierte `messages` en tabla particionada (idempotente).
+    """
+    await conn.execute(text(PARTITION_MESSAGES))
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))"
+    ))
+    return bool(result.scalar())
+
+
+async def list_partitions(conn: AsyncConnection) -> List[tuple]:
+    """
+    Particiones de `messages` como tuplas (`name`, `upper_bound`), de la más vieja
+    a la más nueva; la DEFAULT va al final con `upper_bound=None`.
+    """
+    return [tuple(row) for row in await conn.execute(text(_LIST_PARTITIONS))]
+
+
+async def ensure_partitions(conn: AsyncConnection, days_ahead: int, now: Optional[datetime] = None) -> List[str]:
+    """
+    Crea las particiones diarias desde hoy hasta `days_ahead` días adelante.
+    La primera arranca donde termina la última existente (ej. `messages_legacy`).
+    Devuelve los nombres creados.
+
+    Las filas del rango que ya estaban en `messages_default` pasan a la
+    partición nueva en la misma transacción (`_create_partition`).
+    """
+    now = now or datetime.now(timezone.utc)
+    bounds = [upper for _, upper in await list_partitions(conn) if upper is not None]
+    covered = max(bounds, default=None)
+    created = []
+    for offset in range(max(days_ahead, 0) + 1):
+        day = now.astimezone(timezone.utc).date() + timedelta(days=offset)
+        start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        if covered is not None and covered >= end:
+            continue
+        if covered is not None and covered > start:
+            start = covered
+        try:
+            await _short_locks(conn)
+            moved = await _create_partition(conn, partition_name(day), start, end)
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            PARTITION_ERRORS.inc(action="create")
+            print(f"[Retention Error] No se pudo crear {partition_name(day)}: {str(e)}")
+            continue
+        if moved:
+            PARTITION_ROWS_MOVED.inc(moved)
+        covered = end
+        created.append(partition_name(day))
+    return created
+
+
+async def _create_partition(conn: AsyncConnection, name: str, start: datetime, end: datetime) -> int:
+    """
+    Crea la partición `[start, end)` dentro de la transacción de `conn`.
+    Devuelve cuántas filas se movieron desde `messages_default`.
+    """
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    window = {"start": start, "end": end}
+    if not (await conn.execute(text(_DEFAULT_HAS_ROWS), window)).scalar():
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages {bounds}"))
+        return 0
+
+    # La DEFAULT queda bloqueada hasta el COMMIT: ningún INSERT del rango entra
+    # entre el movimiento y el ATTACH (que valida que la DEFAULT ya no tenga filas del rango)
+    await conn.execute(text("LOCK TABLE messages_default IN ACCESS EXCLUSIVE MODE"))
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    result = await conn.execute(text(_MOVE_FROM_DEFAULT.format(name=name)), window)
+    await conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} {bounds}"))
+    return result.rowcount or 0
+
+
+async def drop_expired_partitions(
+    conn: AsyncConnection,
+    cutoff: datetime,
+    keep_detached: bool = MESSAGES_RETENTION_KEEP_DETACHED,
+) -> List[str]:
+    """
+    Separa las particiones cuyo rango termina antes de `cutoff` y las borra
+    (o las deja como tablas sueltas con `keep_detached`). Devuelve sus nombres.
+    """
+    removed = []
+    for name, upper in await list_partitions(conn):
+        if upper is None or upper > cutoff:
+            continue
+        try:
+            await _short_locks(conn)
+            await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+            if not keep_detached:
+                await conn.execute(text(f"DROP TABLE {name}"))
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            PARTITION_ERRORS.inc(action="detach")
+            print(f"[Retention Error] No se pudo separar {name}: {str(e)}")
+            continue
+        removed.append(name)
+    return removed
+
+
+async def delete_expired_conversations(
+    conn: AsyncConnection,
+    cutoff: datetime,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    pause: float = RETENTION_BATCH_PAUSE,
+) -> int:
+    """
+    Borra en lotes las conversaciones creadas y actualizadas antes de `cutoff`
+    (sus mensajes caen en cascada). Devuelve cuántas se borraron.
+    """
+    batch_size = max(batch_size, 1)
+    deleted = 0
+    while True:
+        await _short_locks(conn)
+        result = await conn.execute(text(_DELETE_EXPIRED), {"cutoff": cutoff, "limit": batch_size})
+        await conn.commit()
+        count = result.rowcount or 0
+        deleted += count
+        if count < batch_size:
+            return deleted
+        await asyncio.sleep(pause)
+
+
+class RetentionJob:
+    """
+    Tarea periódica de mantenimiento de particiones y retención (ver docstring del módulo).
+
+    Args:
+        enabled (bool): Ejecutar la tarea en segundo plano.
+        interval (float): Segundos entre corridas.
+        premake_days (int): Días adelante con partición ya creada.
+        retention_days (int): Días de mensajes que se conservan (0 = todos).
+        ttl_days (int): Días sin actividad tras los que se borra una conversación (0 = nunca).
+        archive_days (int): Días sin actividad tras los que se archiva una conversación (0 = nunca).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = RETENTION_ENABLED,
+        interval: float = RETENTION_INTERVAL,
+        premake_days: int = MESSAGES_PARTITION_PREMAKE_DAYS,
+        retention_days: int = MESSAGES_RETENTION_DAYS,
+        ttl_days: int = CONVERSATION_TTL_DAYS,
+        archive_days: int = ARCHIVE_IDLE_DAYS,
+    ):
+        self.enabled = enabled
+        self.interval = max(interval, 1.0)
+        self.premake_days = premake_days
+        self.retention_days = retention_days
+        self.ttl_days = ttl_days
+        self.archive_days = archive_days
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.skipped_runs = 0
+        self.failures = 0
+        self.partitions_created = 0
+        self.partitions_removed = 0
+        self.conversations_archived = 0
+        self.conversations_deleted = 0
+        self.last_run_seconds = 0.0
+
+    def start(self) -> None:
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failures += 1
+                print(f"[Retention Error] {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        """
+        Una corrida completa. Si otro worker ya está corriendo, no hace nada.
+        """
+        now = now or datetime.now(timezone.utc)
+        start = time.perf_counter()
+        summary = {"created": [], "archived": 0, "removed": [], "deleted": 0}
+        async with engine.connect() as conn:
+            locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _LOCK_KEY})).scalar()
+            await conn.commit()
+            if not locked:
+                self.skipped_runs += 1
+                return summary
+            try:
+                partitioned = await is_partitioned(conn)
+                await conn.commit()
+                if partitioned:
+                    summary["created"] = await ensure_partitions(conn, self.premake_days, now)
+                # Archivar antes de retirar particiones: los mensajes pasan al archivo
+                if self.archive_days > 0:
+                    summary["archived"] = await archiver.archive_idle(conn, now - timedelta(days=self.archive_days))
+                if partitioned and self.retention_days > 0:
+                    cutoff = now - timedelta(days=self.retention_days)
+                    summary["removed"] = await drop_expired_partitions(conn, cutoff)
+                if self.ttl_days > 0:
+                    summary["deleted"] = await delete_expired_conversations(
+                        conn, now - timedelta(days=self.ttl_days)
+                    )
+            finally:
+                await conn.rollback()
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LOCK_KEY})
+                await conn.commit()
+
+        self.runs += 1
+        self.partitions_created += len(summary["created"])
+        self.partitions_removed += len(summary["removed"])
+        self.conversations_archived += summary["archived"]
+        self.conversations_deleted += summary["deleted"]
+        self.last_run_seconds = time.perf_counter() - start
+        return summary
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "runs": self.runs,
+            "skipped_runs": self.skipped_runs,
+            "failures": self.failures,
+            "partitions_created": self.partitions_created,
+            "partitions_removed": self.partitions_removed,
+            "partition_errors": int(PARTITION_ERRORS.value(action="create") + PARTITION_ERRORS.value(action="detach")),
+            "default_rows_moved": int(PARTITION_ROWS_MOVED.value()),
+            "conversations_archived": self.conversations_archived,
+            "conversations_deleted": self.conversations_deleted,
+            "last_run_ms": round(1000 * self.last_run_seconds, 2),
+        }
+
+
+# Instancia única por proceso
+retention_job = RetentionJob()
@@ -1,5 +1,6 @@
 """
-Este módulo define los modelos de datos (schemas) usados por el endpoint /chat.
+Este módulo define los modelos de datos (schemas) usados por el endpoint /chat
+y por la lectura paginada del historial (GET /conversations/{id}/messages).
 
 Se utilizan clases de Pydantic (BaseModel) para:
 - Validar las solicitudes de entrada (ChatRequest).
@@ -11,10 +12,13 @@ En resumen:
 - MessageTurn: representa cada mensaje en la conversación, indicando si viene del usuario o del asistente.
 - ChatResponse: lo que devuelve el servidor, incluyendo el ID de conversación,
   el historial completo de mensajes y metadatos como el motor de IA utilizado.
+- StoredMessage / MessagePage: mensajes guardados y una página del historial.
+- ChatBatchItem: cada mensaje de un lote (POST /chat/batch).
 """
 
+from datetime import datetime
 from typing import Optional, Literal, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class ChatRequest(BaseModel):
     """
@@ -30,6 +34,19 @@ class ChatRequest(BaseModel):
     message: str
 
 
+class ChatBatchItem(ChatRequest):
+    """
+    Mensaje de un lote de POST /chat/batch (mismo contrato que `ChatRequest`).
+
+    Atributos:
+        ref (Optional[str]): Clave del cliente para encadenar, dentro del lote,
+            los turnos de una conversación nueva (sin `conversation_id`).
+            - El primer mensaje con una `ref` crea la conversación.
+            - Los siguientes con la misma `ref` continúan esa conversación, en orden.
+    """
+    ref: Optional[str] = None
+
+
 class MessageTurn(BaseModel):
     """
     Representa un turno dentro de la conversación.
@@ -39,9 +56,13 @@ class MessageTurn(BaseModel):
             - "user" → mensaje escrito por el usuario.
             - "bot" → mensaje generado por el chatbot.
         message (str): Contenido textual del mensaje.
+        tokens (Optional[int]): Conteo de tokens del mensaje (uso interno).
+            - Se calcula una sola vez al persistir (`messages.token_count`).
+            - No forma parte del JSON de respuesta.
     """
     role: Literal["user", "assistant"]
     message: str
+    tokens: Optional[int] = Field(default=None, exclude=True)
 
 
 class ChatResponse(BaseModel):
@@ -56,3 +77,33 @@ class ChatResponse(BaseModel):
     conversation_id: str
     message: List[MessageTurn]
     engine: str
+
+
+class StoredMessage(BaseModel):
+    """
+    Mensaje guardado de una conversación (lectura del historial completo).
+
+    Atributos:
+        id (int): ID del mensaje.
+        role (Literal["user", "assistant"]): Quién envió el mensaje.
+        message (str): Contenido textual del mensaje.
+        created_at (datetime): Momento en que se guardó.
+    """
+    id: int
+    role: Literal["user", "assistant"]
+    message: str
+    created_at: datetime
+
+
+class MessagePage(BaseModel):
+    """
+    Página del historial de una conversación (GET /conversations/{id}/messages).
+
+    Atributos:
+        conversation_id (str): Identificador de la conversación.
+        messages (List[StoredMessage]): Mensajes de la página en orden cronológico.
+        next_cursor (Optional[str]): Cursor de la página siguiente (`None` si no hay más).
+    """
+    conversation_id: str
+    messages: List[StoredMessage]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,159 @@
+"""
+Módulo: summarizer.py
+---------------------
+Compactación en segundo plano de debates largos (resúmenes acumulados).
+
+Propósito:
+----------
+Los turnos que salen de la ventana reciente (10x10) dejan de enviarse al LLM.
+En debates largos eso hace perder contexto. Este módulo resume esos turnos en
+`conversations.summary`, y `chat()` lo antepone al system prompt: el prompt
+queda de tamaño constante sin importar la duración del debate.
+
+Flujo:
+------
+1. Tras persistir un turno, `chat()` (o el escritor diferido, tras escribir
+   el lote) llama a `maybe_schedule_summary()`.
+2. Si la conversación superó `SUMMARY_MIN_TURNS` (y toca según
+   `SUMMARY_EVERY_TURNS`), se lanza una tarea asyncio independiente.
+3. La tarea abre su propia sesión de DB, lee los mensajes aún no resumidos
+   que quedaron fuera de la ventana, pide al LLM un resumen actualizado y lo
+   guarda junto con `summary_message_id` (último mensaje incorporado).
+
+Notas:
+------
+- La tarea nunca se espera desde la request: no agrega latencia al turno.
+- El UPDATE es condicional sobre el `summary_message_id` leído, así dos
+  corridas concurrentes (otro worker) no se pisan.
+- Si la conversación está en la caché del proceso, se actualiza su resumen.
+"""
+
+import asyncio
+from typing import Optional, Set
+from uuid import UUID
+
+from sqlalchemy import select, update
+
+from app.cache import conversation_cache
+from app.config import (
+    HISTORY_WINDOW_PER_ROLE,
+    SUMMARY_ENABLED,
+    SUMMARY_EVERY_TURNS,
+    SUMMARY_MAX_BATCH,
+    SUMMARY_MIN_TURNS,
+)
+from app.db import AsyncSessionLocal
+from app.llm import summarize_turns
+from app.models import Conversation, Message
+from app.schemas import MessageTurn
+
+# Conversaciones con una compactación en curso en este proceso
+_in_progress: Set[UUID] = set()
+
+# Referencias a las tareas vivas (evita que el GC las cancele)
+_tasks: Set[asyncio.Task] = set()
+
+
+def should_summarize(user_turns: int) -> bool:
+    """
+    Indica si, tras alcanzar `user_turns` turnos de usuario, toca compactar.
+    """
+    if not SUMMARY_ENABLED or user_turns < SUMMARY_MIN_TURNS:
+        return False
+    return (user_turns - SUMMARY_MIN_TURNS) % max(SUMMARY_EVERY_TURNS, 1) == 0
+
+
+def maybe_schedule_summary(conv_id: UUID, user_turns: int, added: int = 1) -> Optional[asyncio.Task]:
+    """
+    Lanza la compactación en segundo plano si corresponde.
+
+    Args:
+        conv_id (UUID): Conversación recién actualizada.
+        user_turns (int): Total de turnos de usuario tras el turno actual.
+        added (int): Turnos de usuario agregados desde el último chequeo (más de
+            uno con mensajes agrupados o escritura diferida): basta con que
+            cualquiera de esos totales toque compactar.
+
+    Returns:
+        Optional[asyncio.Task]: La tarea lanzada, o `None` si no aplica.
+    """
+    if conv_id in _in_progress:
+        return None
+    if not any(should_summarize(total) for total in range(user_turns - max(added, 1) + 1, user_turns + 1)):
+        return None
+
+    _in_progress.add(conv_id)
+    task = asyncio.create_task(_run(conv_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def _run(conv_id: UUID) -> None:
+    try:
+        await summarize_conversation(conv_id)
+    except Exception as e:
+        print(f"[Summary Task Error] {str(e)}")
+    finally:
+        _in_progress.discard(conv_id)
+
+
+async def summarize_conversation(conv_id: UUID, per_role: int = HISTORY_WINDOW_PER_ROLE) -> Optional[str]:
+    """
+    Incorpora al resumen de la conversación los mensajes que ya salieron de
+    la ventana reciente y aún no estaban resumidos.
+
+    Args:
+        conv_id (UUID): Conversación a compactar.
+        per_role (int): Tamaño de la ventana reciente por rol (no se resume).
+
+    Returns:
+        Optional[str]: El resumen guardado, o `None` si no hubo nada que hacer.
+    """
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(Conversation.summary, Conversation.summary_message_id)
+            .where(Conversation.id == conv_id)
+        )).one_or_none()
+        if row is None:
+            return None
+        previous_summary, last_id = row
+
+        query = (
+            select(Message.id, Message.role, Message.content)
+            .where(Message.conversation_id == conv_id)
+            .order_by(Message.seq)
+        )
+        if last_id is not None:
+            query = query.where(Message.id > last_id)
+        pending = (await db.execute(query)).all()
+
+        # Liberar la conexión mientras responde el LLM
+        await db.commit()
+
+        # Excluir la ventana reciente (ya viaja completa en el prompt)
+        pending = pending[:-2 * per_role][:SUMMARY_MAX_BATCH]
+        if not pending:
+            return None
+
+        turns = [MessageTurn.model_construct(role=role.value, message=content) for _, role, content in pending]
+        summary = await summarize_turns(previous_summary, turns)
+        if not summary:
+            return None
+
+        condition = (
+            Conversation.summary_message_id.is_(None)
+            if last_id is None
+            else Conversation.summary_message_id == last_id
+        )
+        result = await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conv_id, condition)
+            .values(summary=summary, summary_message_id=pending[-1][0])
+        )
+        await db.commit()
+
+    if result.rowcount:
+        conversation_cache.update_summary(conv_id, summary)
+        return summary
+    return None
@@ -0,0 +1,254 @@
+"""
+Módulo: topic_index.py
+----------------------
+Índice local de mensajes de apertura para reutilizar tema y postura.
+
+Propósito:
+----------
+Muchos usuarios abren el debate con casi la misma frase ("la Tierra es plana",
+"los perros son mejores que los gatos"). En lugar de pagar una llamada al LLM
+para detectar tema y postura en cada caso, se busca la apertura más parecida
+ya vista y, si la similitud supera un umbral, se reutilizan su tema y postura.
+
+Cómo funciona:
+--------------
+- Cada mensaje se normaliza (minúsculas, sin acentos ni puntuación) y se
+  vectoriza con n-gramas de caracteres (3) y bi/trigramas de palabras (con peso
+  mayor), proyectados por hashing a un vector denso de dimensión fija
+  (`TOPIC_INDEX_DIM`). Los n-gramas de palabras hacen que el orden importe:
+  "los perros son mejores que los gatos" y "los gatos son mejores que los
+  perros" quedan lejos, aunque compartan casi todos los caracteres.
+- Una negación cambia la postura del usuario con una sola palabra; por eso solo
+  se reutiliza una apertura con la misma paridad de negaciones ("no", "nunca"...).
+- Los vectores se normalizan (L2) y se guardan en una matriz NumPy; la búsqueda
+  es un único producto matriz-vector (similitud coseno).
+- Se precarga al iniciar la app desde la tabla `conversations` y se actualiza
+  con cada conversación nueva. Al llegar al tope se reemplazan las entradas
+  más antiguas (buffer circular).
+
+Notas:
+------
+- El índice es local a cada proceso y vive solo en memoria.
+- Se exponen hit rate y latencia de búsqueda en `stats()`.
+"""
+
+import re
+import time
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    TOPIC_INDEX_ENABLED,
+    TOPIC_INDEX_THRESHOLD,
+    TOPIC_INDEX_MAX_ENTRIES,
+    TOPIC_INDEX_DIM,
+)
+
+# Temas que corresponden al fallback de detección: no se indexan
+_FALLBACK_TOPICS = {"general"}
+
+_NON_WORD = re.compile(r"[^a-z0-9ñ ]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """
+    Normaliza un mensaje: minúsculas, sin acentos (salvo ñ) ni puntuación.
+    """
+    text = text.lower().replace("ñ", "\0")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).replace("\0", "ñ")
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+# Peso de los n-gramas de palabras frente a los de caracteres
+_WORD_GRAM_WEIGHT = 2.0
+
+# Palabras que invierten el sentido de la afirmación
+_NEGATIONS = {"no", "nunca", "jamas", "tampoco", "ni", "sin", "not", "never"}
+
+
+def _features(text: str) -> List[Tuple[str, float]]:
+    padded = f" {text} "
+    grams = [(padded[i:i + 3], 1.0) for i in range(len(padded) - 2)]
+    words = ["^"] + text.split() + ["$"]
+    grams += [(f"{a}_{b}", _WORD_GRAM_WEIGHT) for a, b in zip(words, words[1:])]
+    grams += [(f"{a}_{b}_{c}", _WORD_GRAM_WEIGHT) for a, b, c in zip(words, words[1:], words[2:])]
+    return grams
+
+
+def is_negated(text: str) -> bool:
+    """
+    Indica si el mensaje contiene una cantidad impar de negaciones.
+    """
+    return sum(word in _NEGATIONS for word in normalize(text).split()) % 2 == 1
+
+
+def vectorize(text: str, dim: int = TOPIC_INDEX_DIM) -> np.ndarray:
+    """
+    Vector L2-normalizado (float32) de n-gramas de caracteres y de palabras.
+
+    Args:
+        text (str): Mensaje original (se normaliza internamente).
+        dim (int): Dimensión del vector (buckets de hashing).
+
+    Returns:
+        np.ndarray: Vector de dimensión `dim` (todo ceros si el texto queda vacío).
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    normalized = normalize(text)
+    if not normalized:
+        return vector
+
+    features = _features(normalized)
+    buckets = np.fromiter((zlib.crc32(f.encode()) % dim for f, _ in features), dtype=np.int64, count=len(features))
+    weights = np.fromiter((w for _, w in features), dtype=np.float32, count=len(features))
+    counts = np.bincount(buckets, weights=weights, minlength=dim)
+    # tf sublineal: reduce el peso de n-gramas repetidos
+    vector[:] = np.log1p(counts)
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+class TopicIndex:
+    """
+    Índice de similitud coseno entre mensajes de apertura y su (topic, stance).
+
+    Args:
+        threshold (float): Similitud mínima para reutilizar tema y postura.
+        max_entries (int): Tope de aperturas indexadas (0 desactiva el índice).
+        dim (int): Dimensión de los vectores.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, dim: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dim = dim
+
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._negated = np.zeros(0, dtype=bool)
+        self._labels: List[Tuple[str, str]] = []
+        self._size = 0
+        self._next = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self._lookup_seconds = 0.0
+        self._last_lookup_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, message: str, topic: Optional[str], stance: Optional[str]) -> None:
+        """
+        Indexa una apertura con su tema y postura detectados.
+        Ignora las detecciones de fallback (`general`) y los mensajes vacíos.
+        """
+        if not self.enabled or not topic or not stance or topic in _FALLBACK_TOPICS:
+            return
+
+        vector = vectorize(message, self.dim)
+        if not vector.any():
+            return
+
+        if self._size < self.max_entries:
+            if self._size == len(self._matrix):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._labels.append((topic, stance))
+        else:
+            # Índice lleno: se reemplaza la entrada más antigua
+            row = self._next
+            self._next = (self._next + 1) % self.max_entries
+            self._labels[row] = (topic, stance)
+
+        self._matrix[row] = vector
+        self._negated[row] = is_negated(message)
+
+    def add_many(self, rows: Iterable[Tuple[str, Optional[str], Optional[str]]]) -> int:
+        """
+        Indexa varias aperturas `(message, topic, stance)`. Devuelve cuántas quedaron.
+        """
+        before = self._size
+        for message, topic, stance in rows:
+            if message:
+                self.add(message, topic, stance)
+        return self._size - before
+
+    def lookup(self, message: str) -> Optional[Tuple[str, str, float]]:
+        """
+        Busca la apertura más parecida a `message`.
+
+        Returns:
+            Optional[Tuple[str, str, float]]: (topic, stance, similitud) si supera
+            el umbral; `None` en caso contrario.
+        """
+        if not self.enabled:
+            return None
+
+        start = time.perf_counter()
+        result = None
+        if self._size:
+            scores = self._matrix[:self._size] @ vectorize(message, self.dim)
+            # Descartar aperturas con distinta polaridad (ej. "no son mejores")
+            scores[self._negated[:self._size] != is_negated(message)] = -1.0
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score >= self.threshold:
+                topic, stance = self._labels[best]
+                result = (topic, stance, score)
+
+        elapsed = time.perf_counter() - start
+        self.lookups += 1
+        self.hits += result is not None
+        self._lookup_seconds += elapsed
+        self._last_lookup_seconds = elapsed
+        return result
+
+    def clear(self) -> None:
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._negated = np.zeros(0, dtype=bool)
+        self._labels = []
+        self._size = 0
+        self._next = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Métricas del índice para monitoreo (hit rate y latencia de búsqueda).
+        """
+        return {
+            "entries": self._size,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "avg_lookup_ms": round(1000 * self._lookup_seconds / self.lookups, 4) if self.lookups else 0.0,
+            "last_lookup_ms": round(1000 * self._last_lookup_seconds, 4),
+        }
+
+    def _grow(self) -> None:
+        capacity = min(max(2 * len(self._matrix), 64), self.max_entries)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        negated = np.zeros(capacity, dtype=bool)
+        negated[:self._size] = self._negated[:self._size]
+        self._matrix = matrix
+        self._negated = negated
+
+
+# Instancia compartida por el proceso
+topic_index = TopicIndex(
+    threshold=TOPIC_INDEX_THRESHOLD,
+    max_entries=TOPIC_INDEX_MAX_ENTRIES if TOPIC_INDEX_ENABLED else 0,
+    dim=TOPIC_INDEX_DIM,
+)
@@ -0,0 +1,108 @@
+"""
+Módulo de utilidades para conteo de tokens y presupuesto de contexto (app/utils/tokens.py).
+
+Propósito:
+----------
+Limitar el contexto enviado al LLM por **tokens** y no solo por cantidad de turnos,
+de modo que el tamaño del prompt (y por lo tanto la latencia y el costo) sea
+predecible en cada request.
+
+Funciones principales:
+----------------------
+- count_tokens():
+    Estimador offline de tokens para un texto (sin red ni dependencias externas).
+    Cada mensaje se cuenta una sola vez al persistirse (columna `messages.token_count`).
+
+- fit_to_budget():
+    Empaqueta los turnos más recientes dentro de un presupuesto de tokens.
+
+- context_budget():
+    Calcula el presupuesto disponible para el historial tras reservar espacio
+    para el system prompt y la respuesta (`max_tokens`).
+
+Notas:
+------
+- El estimador aproxima a los tokenizadores BPE de OpenAI: palabras cortas valen
+  1 token, las largas ~1 token cada 4 caracteres y cada signo de puntuación 1 token.
+  Es deliberadamente conservador (tiende a sobreestimar).
+"""
+
+import re
+from typing import List
+
+from app.schemas import MessageTurn
+
+# Tokens fijos que agrega el formato de chat por cada mensaje (rol, separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estima la cantidad de tokens de un texto.
+
+    Args:
+        text (str): Texto a medir.
+
+    Returns:
+        int: Tokens estimados (sin el overhead por mensaje).
+    """
+    return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
+
+
+def turn_tokens(turn: MessageTurn) -> int:
+    """
+    Tokens de un turno incluyendo el overhead del formato de chat.
+
+    Usa el conteo guardado en el turno (`turn.tokens`) si existe; solo lo
+    estima al vuelo para filas antiguas sin `token_count`.
+    """
+    tokens = turn.tokens if turn.tokens is not None else count_tokens(turn.message)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(system_prompt: str, context_tokens: int, max_tokens: int) -> int:
+    """
+    Presupuesto de tokens disponible para el historial.
+
+    Args:
+        system_prompt (str): Instrucción de sistema que se enviará.
+        context_tokens (int): Tamaño total de contexto permitido por request.
+        max_tokens (int): Tokens reservados para la respuesta del modelo.
+
+    Returns:
+        int: Tokens disponibles para los turnos del historial (>= 0).
+    """
+    reserved = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS + max_tokens
+    return max(context_tokens - reserved, 0)
+
+
+def fit_to_budget(history: List[MessageTurn], budget: int) -> List[MessageTurn]:
+    """
+    Conserva los turnos más recientes cuya suma de tokens cabe en `budget`.
+
+    Recorre el historial del más nuevo al más antiguo y se detiene en el primer
+    turno que ya no cabe (el contexto queda contiguo). El último turno siempre
+    se conserva, aunque por sí solo exceda el presupuesto, para que el modelo
+    vea el mensaje al que responde.
+
+    Args:
+        history (List[MessageTurn]): Historial en orden cronológico.
+        budget (int): Tokens disponibles para el historial.
+
+    Returns:
+        List[MessageTurn]: Turnos seleccionados en orden cronológico.
+    """
+    selected: List[MessageTurn] = []
+    used = 0
+
+    for turn in reversed(history):
+        cost = turn_tokens(turn)
+        if selected and used + cost > budget:
+            break
+        selected.append(turn)
+        used += cost
+
+    selected.reverse()
+    return selected
@@ -8,6 +8,10 @@ recursos al momento de generar respuestas con el LLM.
 
 Funciones principales:
 ----------------------
+- select_recent() / trim_window():
+    Motor común de trimming. Una sola pasada (del turno más reciente hacia atrás)
+    con cuotas por rol; O(n) en tiempo y O(k) en memoria extra.
+
 - trim_history():
     Recorta el historial completo conservando únicamente los últimos `N` mensajes 
     del usuario y del asistente (por defecto 10 y 10).
@@ -26,9 +30,73 @@ Notas:
 """
 
 import os
-from typing import List
+from operator import attrgetter
+from typing import Callable, Dict, Iterable, List, Sequence, TypeVar
 from app.schemas import MessageTurn
 
+T = TypeVar("T")
+
+
+def select_recent(
+    newest_first: Iterable[T],
+    quotas: Dict[str, int],
+    key: Callable[[T], str] = attrgetter("role"),
+) -> List[T]:
+    """
+    Motor de trimming: selecciona los turnos más recientes respetando una cuota por rol.
+
+    Recorre la secuencia una sola vez, del turno más nuevo al más antiguo, y se
+    detiene en cuanto todas las cuotas están cubiertas. Por eso acepta cualquier
+    iterable en orden inverso (un `reversed()` sobre una lista, un cursor de DB
+    con `ORDER BY ... DESC`, etc.) sin materializar la conversación completa.
+
+    Complejidad: O(n) en el peor caso y O(k) de memoria extra, con k = suma de cuotas.
+    La selección es por posición, no por igualdad: mensajes repetidos con el mismo
+    texto se cuentan cada uno una vez.
+
+    Args:
+        newest_first (Iterable[T]): Turnos del más reciente al más antiguo.
+        quotas (Dict[str, int]): Máximo de turnos a conservar por rol.
+        key (Callable[[T], str]): Extrae el rol de cada turno (por defecto `turn.role`).
+
+    Returns:
+        List[T]: Turnos seleccionados en orden cronológico.
+    """
+    remaining = {role: n for role, n in quotas.items() if n > 0}
+    pending = sum(remaining.values())
+    window: List[T] = []
+
+    if pending == 0:
+        return window
+
+    for turn in newest_first:
+        role = key(turn)
+        left = remaining.get(role, 0)
+        if left:
+            remaining[role] = left - 1
+            window.append(turn)
+            pending -= 1
+            if pending == 0:
+                break
+
+    window.reverse()
+    return window
+
+
+def trim_window(history: Sequence[T], quotas: Dict[str, int]) -> List[T]:
+    """
+    Aplica `select_recent` sobre un historial en orden cronológico.
+
+    Args:
+        history (Sequence[T]): Historial en orden cronológico.
+        quotas (Dict[str, int]): Máximo de turnos a conservar por rol.
+
+    Returns:
+        List[T]: Ventana recortada en orden cronológico.
+    """
+    return select_recent(reversed(history), quotas)
+
+
 def trim_history(history: List[MessageTurn], max_user: int = 10, max_assistant: int = 10) -> List[MessageTurn]:
     """
     Recorta el historial de la conversación a los últimos `max_user` turnos de usuario
@@ -42,17 +110,7 @@ def trim_history(history: List[MessageTurn], max_user: int = 10, max_assistant:
     Returns:
         List[MessageTurn]: Historial recortado.
     """
-    user_msgs = [turn for turn in history if turn.role == "user"]
-    assistant_msgs = [turn for turn in history if turn.role == "assistant"]
-
-    # Nos quedamos solo con los últimos N
-    trimmed_users = user_msgs[-max_user:]
-    trimmed_assistants = assistant_msgs[-max_assistant:]
-
-    # Fusionamos y ordenamos por el orden original
-    trimmed = [turn for turn in history if turn in trimmed_users or turn in trimmed_assistants]
-
-    return trimmed
+    return trim_window(history, {"user": max_user, "assistant": max_assistant})
 
 
 def trim_for_response(history: List[MessageTurn], max_user: int = 5, max_assistant: int = 5) -> List[MessageTurn]:
@@ -72,23 +130,15 @@ def trim_for_response(history: List[MessageTurn], max_user: int = 5, max_assista
     Returns:
         List[MessageTurn]: Lista de mensajes recortada en orden cronológico.
     """
-    # Encontrar índices de los últimos N mensajes por rol
-    user_indices = [i for i, m in enumerate(history) if m.role == "user"][-max_user:]
-    assistant_indices = [i for i, m in enumerate(history) if m.role == "assistant"][-max_assistant:]
-
-    allowed_indices = set(user_indices + assistant_indices)
-
-    # Reconstruir historial filtrado en orden cronológico
-    trimmed_history = [m for i, m in enumerate(history) if i in allowed_indices]
+    trimmed_history = trim_window(history, {"user": max_user, "assistant": max_assistant})
 
     # Debug opcional activado con variable de entorno
     if os.getenv("DEBUG_TRIM") == "1":
         print(">>> DEBUG trim_for_response")
         print("Total mensajes:", len(history))
-        print("User indices:", user_indices)
-        print("Assistant indices:", assistant_indices)
+        print("User conservados:", sum(1 for m in trimmed_history if m.role == "user"))
+        print("Assistant conservados:", sum(1 for m in trimmed_history if m.role == "assistant"))
         print("Final trimmed:", [f"{m.role}: {m.message}" for m in trimmed_history])
         print("---------------")
 
     return trimmed_history
-
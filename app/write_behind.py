@@ -0,0 +1,476 @@
+"""
+Módulo: write_behind.py
+-----------------------
+Escritura diferida (write-behind) de los turnos del chat.
+
+Propósito:
+----------
+Cada turno hacía su INSERT + COMMIT antes de responder: con mucho tráfico la
+tabla `messages` recibe miles de transacciones diminutas y se vuelve el cuello
+de botella. Con `WRITE_BEHIND_ENABLED=1`:
+
+- El turno se agrega a un buffer en memoria por conversación y la request
+  responde sin esperar a la DB.
+- Una tarea en segundo plano escribe los turnos en lotes con
+  `persist_turn_batch`: un INSERT multi-fila de mensajes y un solo UPDATE de
+  contadores por lote, en una transacción.
+- Un lote se escribe cuando junta `WRITE_BEHIND_MAX_BATCH` turnos o cuando el
+  más antiguo lleva `WRITE_BEHIND_MAX_DELAY` segundos esperando. Esa es la
+  perilla de durabilidad: lo que se pierde si el proceso muere sin apagarse.
+- Mientras una conversación tiene turnos sin escribir, su buffer (metadatos y
+  ventana reciente) sirve las lecturas: el turno siguiente no va a la DB
+  aunque la conversación haya salido de `conversation_cache`.
+- Backpressure: con `WRITE_BEHIND_MAX_PENDING` turnos pendientes, los nuevos
+  esperan lugar (y esa espera se refleja en el control de admisión).
+- `flush()` escribe todos los pendientes sin detener la tarea. Al apagar la
+  app (`lifespan`), `close()` los escribe y detiene la tarea.
+- Con `CONVERSATION_LOCK_ADVISORY`, los turnos de la conversación se escriben
+  (`drain()`) antes de liberar su advisory lock: el buffer es de este proceso y
+  otro worker solo ve la DB.
+
+Notas:
+------
+- Si un lote falla por un error transitorio (conexión, timeout, deadlock), sus
+  turnos vuelven al frente de la cola y se reintenta con backoff: no se
+  descartan (salvo en `close()`, al apagar, tras varios intentos).
+- Si falla por un error que no se resuelve reintentando (una restricción
+  violada, un dato inválido), el lote se divide en mitades hasta aislar los
+  turnos que no se pueden escribir: esos se descartan (`lost_turns`) y el
+  resto se escribe. Un turno así no bloquea la cola.
+- Los turnos de una conversación borrada mientras esperaban (retención) se
+  descartan al escribir el lote.
+- Al descartar turnos se invalida la conversación en `conversation_cache`: su
+  entrada incluía turnos que nunca llegaron a la DB.
+- La compactación (`maybe_schedule_summary`) se agenda después de escribir el
+  lote, cuando la DB ya tiene los mensajes.
+- Desactivado, `save()` escribe el turno en línea con `persist_turn`, salvo los
+  turnos de `/chat/batch` (`defer=True`), que siempre van en lote por este
+  mismo buffer: así el resto de la app los ve mientras esperan.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import conversation_cache
+from app.config import (
+    HISTORY_WINDOW_PER_ROLE,
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_MAX_BATCH,
+    WRITE_BEHIND_MAX_DELAY,
+    WRITE_BEHIND_MAX_PENDING,
+)
+from app.db import AsyncSessionLocal
+from app.models import Conversation, MessageRole
+from app.repository import persist_turn, persist_turn_batch
+from app.schemas import MessageTurn
+from app.summarizer import maybe_schedule_summary
+from app.utils.trimming import trim_history
+
+# Reintentos de un lote fallido (backoff exponencial, segundos)
+_RETRY_BACKOFF = 0.1
+_RETRY_BACKOFF_MAX = 5.0
+
+# Intentos por lote al apagar la app antes de darlo por perdido
+_SHUTDOWN_ATTEMPTS = 3
+
+# Errores de la DB que se resuelven reintentando el lote
+_TRANSIENT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError, OperationalError, InterfaceError)
+
+# Clases de SQLSTATE transitorias: conexión, rollback (deadlock/serialización),
+# recursos insuficientes, intervención del operador
+_TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57")
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Indica si un error al escribir un lote se resuelve reintentándolo.
+    """
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        sqlstate = getattr(error.orig, "sqlstate", None)
+        if sqlstate:
+            return sqlstate[:2] in _TRANSIENT_SQLSTATE_CLASSES
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+
+@dataclass(eq=False)
+class _PendingTurn:
+    conv_id: UUID
+    user_turns: List[MessageTurn]
+    user_created_at: datetime
+    bot_turn: MessageTurn
+    bot_created_at: datetime
+    enqueued_at: float
+
+
+@dataclass
+class _Buffer:
+    """
+    Estado en memoria de una conversación con turnos sin escribir.
+    """
+    topic: str
+    stance: str
+    engine: str
+    summary: Optional[str]
+    history: List[MessageTurn]
+    inserted: bool
+    pending: int = 0
+
+
+class TurnWriter:
+    """
+    Escritor de turnos en línea o diferido (ver docstring del módulo).
+
+    Args:
+        enabled (bool): Escritura diferida activa.
+        max_delay (float): Espera máxima (segundos) de un turno antes de escribirse.
+        max_batch (int): Turnos por lote.
+        max_pending (int): Turnos pendientes antes de aplicar backpressure.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = WRITE_BEHIND_ENABLED,
+        max_delay: float = WRITE_BEHIND_MAX_DELAY,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+    ):
+        self.enabled = enabled
+        self.max_delay = max(max_delay, 0.0)
+        self.max_batch = max(max_batch, 1)
+        self.max_pending = max(max_pending, 1)
+
+        self._queue: Deque[_PendingTurn] = deque()
+        self._buffers: Dict[UUID, _Buffer] = {}
+        self.pending = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._closing = False
+
+        self.flushes = 0
+        self.flushed_turns = 0
+        self.failures = 0
+        self.lost_turns = 0
+        self.backpressure_waits = 0
+
+    def _ensure_started(self) -> None:
+        # La tarea y los eventos quedan atados al loop en uso (en tests cambia entre casos)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._ready, self._flush_now, self._space = asyncio.Event(), asyncio.Event(), asyncio.Event()
+            self._loop, self._task = loop, None
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = loop.create_task(self._run())
+
+    async def save(
+        self,
+        db: AsyncSession,
+        conv: Conversation,
+        is_new: bool,
+        user_turns: Sequence[MessageTurn],
+        user_created_at: datetime,
+        bot_turn: MessageTurn,
+        history: Sequence[MessageTurn],
+        defer: bool = False,
+    ) -> None:
+        """
+        Persiste un turno: en línea (`persist_turn`) o, si la escritura diferida
+        está activa (o `defer`), encolándolo para el próximo lote.
+
+        Un turno en línea de una conversación con turnos aún en el buffer
+        (encolados con `defer`) espera a que esos se escriban: la conversación
+        puede no existir todavía en la DB y el orden de `seq` se respeta.
+
+        Args:
+            db (AsyncSession): Sesión de la request (solo para la escritura en línea).
+            conv (Conversation): Conversación del turno (transitoria si `is_new`).
+            is_new (bool): Si la conversación aún no existe en DB.
+            user_turns (Sequence[MessageTurn]): Mensajes del usuario del turno.
+            user_created_at (datetime): Momento en que comenzó el turno.
+            bot_turn (MessageTurn): Respuesta del bot.
+            history (Sequence[MessageTurn]): Historial reciente tras el turno
+                (sirve las lecturas mientras el turno no se escribe).
+            defer (bool): Encolar el turno aunque la escritura diferida esté
+                desactivada (lotes de `/chat/batch`).
+        """
+        if not (self.enabled or defer):
+            await self.drain(conv.id)
+            rows = await persist_turn(db, conv, is_new, user_turns, user_created_at, bot_turn)
+            maybe_schedule_summary(conv.id, rows[0].user_turns, added=len(user_turns))
+            return
+
+        self._ensure_started()
+        while self.pending >= self.max_pending:
+            # Buffer lleno: esperar a que el próximo lote libere lugar
+            self.backpressure_waits += 1
+            self._space.clear()
+            self._flush_now.set()
+            await self._space.wait()
+
+        buffer = self._buffers.get(conv.id)
+        if buffer is None:
+            buffer = self._buffers[conv.id] = _Buffer(
+                topic=conv.topic,
+                stance=conv.stance,
+                engine=conv.engine,
+                summary=conv.summary,
+                history=[],
+                inserted=not is_new,
+            )
+        buffer.summary = conv.summary
+        buffer.history = trim_history(list(history), HISTORY_WINDOW_PER_ROLE, HISTORY_WINDOW_PER_ROLE)
+        buffer.pending += 1
+
+        self._queue.append(_PendingTurn(
+            conv_id=conv.id,
+            user_turns=list(user_turns),
+            user_created_at=user_created_at,
+            bot_turn=bot_turn,
+            bot_created_at=datetime.now(timezone.utc),
+            enqueued_at=time.monotonic(),
+        ))
+        self.pending += 1
+        self._ready.set()
+        if len(self._queue) >= self.max_batch:
+            self._flush_now.set()
+
+    def lookup(self, conv_id: UUID) -> Optional[Tuple[Conversation, List[MessageTurn]]]:
+        """
+        Conversación y ventana reciente servidas desde el buffer, si la conversación
+        tiene turnos sin escribir (si no, `None`: la DB está al día).
+        """
+        buffer = self._buffers.get(conv_id)
+        if buffer is None:
+            return None
+        conv = Conversation(
+            id=conv_id,
+            topic=buffer.topic,
+            stance=buffer.stance,
+            engine=buffer.engine,
+            summary=buffer.summary,
+        )
+        return conv, list(buffer.history)
+
+    def contains(self, conv_id: UUID) -> bool:
+        """
+        Indica si la conversación tiene turnos sin escribir.
+        """
+        return conv_id in self._buffers
+
+    async def drain(self, conv_id: UUID) -> None:
+        """
+        Espera a que se escriban los turnos pendientes de una conversación (se
+        adelanta el próximo lote). Con el advisory lock, se llama antes de
+        liberarlo: el worker que lo tome después lee el turno desde la DB.
+        """
+        while conv_id in self._buffers:
+            self._ensure_started()
+            self._space.clear()
+            self._flush_now.set()
+            await self._space.wait()
+
+    async def flush(self) -> None:
+        """
+        Espera a que se escriban todos los turnos pendientes (se adelantan los
+        lotes). La tarea sigue corriendo y un lote con errores transitorios se
+        reintenta sin descartar turnos.
+        """
+        while self._buffers:
+            self._ensure_started()
+            self._space.clear()
+            self._flush_now.set()
+            await self._space.wait()
+
+    async def close(self) -> None:
+        """
+        Escribe todos los turnos pendientes y detiene la tarea de escritura
+        (vuelve a arrancar con el próximo turno). Se llama al apagar la app:
+        tras `_SHUTDOWN_ATTEMPTS` intentos fallidos, los turnos se descartan.
+        """
+        if not self._queue and (self._task is None or self._task.done()):
+            return
+        self._ensure_started()
+        self._closing = True
+        self._ready.set()
+        self._flush_now.set()
+        await asyncio.shield(self._task)
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            if not self._queue:
+                if self._closing:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            # Un lote que falló ya estaba listo: el reintento no vuelve a esperar
+            wait = self._queue[0].enqueued_at + self.max_delay - time.monotonic()
+            if wait > 0 and len(self._queue) < self.max_batch and not (self._closing or failures):
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_now.clear()
+
+            if await self._flush_batch():
+                failures = 0
+                continue
+
+            failures += 1
+            if self._closing and failures >= _SHUTDOWN_ATTEMPTS:
+                self.lost_turns += len(self._queue)
+                print(f"[Write-Behind Error] {len(self._queue)} turnos sin escribir al apagar")
+                self._forget({turn.conv_id for turn in self._queue})
+                self._queue.clear()
+                self._buffers.clear()
+                self.pending = 0
+                return
+            await asyncio.sleep(min(_RETRY_BACKOFF * 2 ** (failures - 1), _RETRY_BACKOFF_MAX))
+
+    async def _flush_batch(self) -> bool:
+        """
+        Escribe el próximo lote. Devuelve `False` si falló por un error transitorio
+        (los turnos sin escribir vuelven a la cola).
+
+        Ante un error no transitorio, el lote se divide en mitades (en orden)
+        hasta aislar los turnos que no se pueden escribir, que se descartan.
+        """
+        parts: Deque[List[_PendingTurn]] = deque()
+        parts.append([self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch))])
+        while parts:
+            part = parts.popleft()
+            try:
+                totals = await self._write(part)
+            except Exception as e:
+                self.failures += 1
+                print(f"[Write-Behind Error] {str(e)}")
+                if is_transient(e):
+                    unwritten = part + [turn for rest in parts for turn in rest]
+                    self._queue.extendleft(reversed(unwritten))
+                    return False
+                if len(part) == 1:
+                    self._discard(part)
+                else:
+                    middle = len(part) // 2
+                    parts.extendleft([part[middle:], part[:middle]])
+                continue
+            self._written(part, totals)
+        return True
+
+    def _written(self, batch: List[_PendingTurn], totals: Dict[UUID, int]) -> None:
+        added: Dict[UUID, int] = {}
+        for turn in batch:
+            added[turn.conv_id] = added.get(turn.conv_id, 0) + len(turn.user_turns)
+            self._buffers[turn.conv_id].inserted = True
+
+        # Conversación borrada mientras el turno esperaba: sus mensajes no se escribieron
+        orphans = [turn for turn in batch if turn.conv_id not in totals]
+        if orphans:
+            print(f"[Write-Behind Error] {len(orphans)} turnos de conversaciones ya borradas")
+            self._forget({turn.conv_id for turn in orphans})
+
+        self._release(batch)
+        self.lost_turns += len(orphans)
+        self.flushes += 1
+        self.flushed_turns += len(batch) - len(orphans)
+
+        for conv_id, user_turns in totals.items():
+            maybe_schedule_summary(conv_id, user_turns, added=added.get(conv_id, 1))
+
+    def _discard(self, batch: List[_PendingTurn]) -> None:
+        # Turnos que no se pueden escribir: se descartan para no bloquear la cola
+        print(f"[Write-Behind Error] {len(batch)} turnos descartados")
+        self._forget({turn.conv_id for turn in batch})
+        self._release(batch)
+        self.lost_turns += len(batch)
+
+    def _forget(self, conv_ids: Set[UUID]) -> None:
+        # La caché tiene los turnos descartados: el próximo turno relee la DB
+        for conv_id in conv_ids:
+            conversation_cache.invalidate(conv_id)
+
+    def _release(self, batch: List[_PendingTurn]) -> None:
+        for turn in batch:
+            buffer = self._buffers[turn.conv_id]
+            buffer.pending -= 1
+            if buffer.pending == 0:
+                del self._buffers[turn.conv_id]
+        self.pending -= len(batch)
+        self._space.set()
+
+    async def _write(self, batch: List[_PendingTurn]) -> Dict[UUID, int]:
+        counts: Dict[UUID, List[int]] = {}
+        messages = []
+        for turn in batch:
+            user, bot = counts.setdefault(turn.conv_id, [0, 0])
+            counts[turn.conv_id] = [user + len(turn.user_turns), bot + 1]
+            messages += [
+                {
+                    "conversation_id": turn.conv_id,
+                    "role": MessageRole.user,
+                    "content": user_turn.message,
+                    "token_count": user_turn.tokens,
+                    "created_at": turn.user_created_at + timedelta(microseconds=i),
+                }
+                for i, user_turn in enumerate(turn.user_turns)
+            ]
+            messages.append({
+                "conversation_id": turn.conv_id,
+                "role": MessageRole.assistant,
+                "content": turn.bot_turn.message,
+                "token_count": turn.bot_turn.tokens,
+                "created_at": turn.bot_created_at,
+            })
+
+        new_conversations = []
+        counter_deltas: Dict[UUID, Tuple[int, int]] = {}
+        for conv_id, (user, bot) in counts.items():
+            buffer = self._buffers[conv_id]
+            if buffer.inserted:
+                counter_deltas[conv_id] = (user, bot)
+            else:
+                new_conversations.append({
+                    "id": conv_id,
+                    "topic": buffer.topic,
+                    "stance": buffer.stance,
+                    "engine": buffer.engine,
+                    "message_count_user": user,
+                    "message_count_bot": bot,
+                    "message_seq": user + bot,
+                })
+
+        async with AsyncSessionLocal() as db:
+            return await persist_turn_batch(db, new_conversations, counter_deltas, messages)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending_turns": self.pending,
+            "buffered_conversations": len(self._buffers),
+            "flushes": self.flushes,
+            "flushed_turns": self.flushed_turns,
+            "avg_batch": round(self.flushed_turns / self.flushes, 2) if self.flushes else 0.0,
+            "failures": self.failures,
+            "lost_turns": self.lost_turns,
+            "backpressure_waits": self.backpressure_waits,
+        }
+
+
+# Instancia única por proceso
+turn_writer = TurnWriter()
@@ -35,7 +35,10 @@ CREATE TABLE IF NOT EXISTS conversations (
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(), -- Fecha de creación
   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(), -- Última modificación
   message_count_user INT NOT NULL DEFAULT 0,     -- Cantidad acumulada de mensajes de usuario
-  message_count_bot INT NOT NULL DEFAULT 0       -- Cantidad acumulada de mensajes del bot
+  message_count_bot INT NOT NULL DEFAULT 0,      -- Cantidad acumulada de mensajes del bot
+  summary TEXT,                                  -- Resumen de turnos fuera de la ventana reciente
+  summary_message_id BIGINT,                     -- Último mensaje incorporado al resumen
+  message_seq BIGINT NOT NULL DEFAULT 0          -- Último seq asignado a un mensaje de la conversación
 );
 
 -- Trigger para actualizar updated_at automáticamente
@@ -61,20 +64,99 @@ CREATE TABLE IF NOT EXISTS messages (
   conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
   role message_role NOT NULL,                 -- Rol: user | assistant
   content TEXT NOT NULL,                      -- Contenido textual del mensaje
+  token_count INT,                            -- Tokens estimados (se calcula una vez al guardar)
+  seq BIGINT NOT NULL,                        -- Posición en la conversación (1, 2, 3...)
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW() -- Timestamp de creación
 );
 
+-- =================================================
+-- Tabla: llm_reply_cache
+-- =================================================
+-- Nivel persistente de la caché de respuestas del LLM
+-- (prompts idénticos se sirven sin llamar al modelo).
+CREATE TABLE IF NOT EXISTS llm_reply_cache (
+  key TEXT PRIMARY KEY,                          -- SHA-256 de (modelo, mensajes, temperature, max_tokens)
+  model TEXT NOT NULL,                           -- Modelo que generó la respuesta
+  reply TEXT NOT NULL,                           -- Respuesta cacheada
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(), -- Momento de escritura
+  expires_at TIMESTAMPTZ NOT NULL                -- Expiración (TTL)
+);
+
+-- =================================================
+-- Tabla: message_archives
+-- =================================================
+-- Mensajes de conversaciones inactivas empaquetados en un solo blob
+-- (JSON comprimido con zlib, ver app/archive.py). La API los restaura en
+-- `messages` en el próximo acceso a la conversación.
+CREATE TABLE IF NOT EXISTS message_archives (
+  conversation_id UUID PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+  payload BYTEA NOT NULL,                        -- JSON comprimido (zlib) con los mensajes
+  message_count INT NOT NULL,                    -- Mensajes archivados
+  raw_bytes INT NOT NULL,                        -- Tamaño del JSON sin comprimir
+  archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW() -- Momento del archivado
+);
+
+-- Ya viene comprimido: guardarlo en línea (sin tabla TOAST aparte) mientras entre en la página
+ALTER TABLE message_archives ALTER COLUMN payload SET STORAGE MAIN;
+
+-- Columnas agregadas después de la versión inicial (idempotente)
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS token_count INT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary_message_id BIGINT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_seq BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+
+-- Numerar una sola vez los mensajes previos a `seq` (por created_at, id) y fijar NOT NULL
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'messages' AND column_name = 'seq' AND is_nullable = 'YES'
+  ) THEN
+    UPDATE messages m SET seq = numbered.seq
+    FROM (
+      SELECT id, row_number() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq
+      FROM messages
+    ) AS numbered
+    WHERE m.id = numbered.id AND m.seq IS NULL;
+
+    UPDATE conversations c SET message_seq = last.seq
+    FROM (SELECT conversation_id, max(seq) AS seq FROM messages GROUP BY conversation_id) AS last
+    WHERE c.id = last.conversation_id;
+
+    ALTER TABLE messages ALTER COLUMN seq SET NOT NULL;
+  END IF;
+END$$;
+
 -- =================================================
 -- Índices recomendados
 -- =================================================
 -- Aceleran consultas comunes:
--- - Por conversación y orden temporal
--- - Por fecha de creación global
-CREATE INDEX IF NOT EXISTS idx_messages_conversation_created_at
-  ON messages (conversation_id, created_at);
+-- - Historial por conversación en orden de `seq` (ventana reciente y paginación).
+--   Único: garantiza que dos mensajes no compartan posición. `role` va incluido
+--   para elegir la ventana por rol con un index-only scan; `content` no se
+--   incluye porque un TEXT largo excedería el tamaño máximo de una tupla de
+--   btree (~2.7 KB) y haría fallar el INSERT. Si la API ya particionó
+--   `messages` (`MESSAGES_PARTITIONING=1`, ver app/retention.py) el índice
+--   existe y no es único.
+-- - Conversaciones por fecha de creación (precarga de aperturas y retención)
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass) THEN
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_conversation_seq
+      ON messages (conversation_id, seq) INCLUDE (role);
+  END IF;
+END$$;
 
-CREATE INDEX IF NOT EXISTS idx_messages_created_at
-  ON messages (created_at);
+-- Reemplazado por idx_messages_conversation_seq
+DROP INDEX IF EXISTS idx_messages_conversation_created_at;
+
+CREATE INDEX IF NOT EXISTS idx_conversations_created_at
+  ON conversations (created_at);
+
+-- Purga de respuestas expiradas de la caché del LLM
+CREATE INDEX IF NOT EXISTS ix_llm_reply_cache_expires_at
+  ON llm_reply_cache (expires_at);
 
 -- =================================================
 -- Comentarios (documentación embebida en la BD)
@@ -82,6 +164,12 @@ CREATE INDEX IF NOT EXISTS idx_messages_created_at
 COMMENT ON TABLE conversations IS 'Metadatos por conversación';
 COMMENT ON COLUMN conversations.stance IS 'Postura asignada al bot (ej. a favor / en contra)';
 COMMENT ON COLUMN conversations.engine IS 'Modelo LLM usado (gpt-3.5-turbo, gpt-4-turbo, etc.)';
+COMMENT ON COLUMN conversations.summary IS 'Resumen acumulado de turnos antiguos (compactación en segundo plano)';
+
+COMMENT ON TABLE message_archives IS 'Mensajes comprimidos de conversaciones inactivas (se restauran al acceder)';
+COMMENT ON TABLE llm_reply_cache IS 'Caché persistente de respuestas del LLM por hash de prompt';
 
 COMMENT ON TABLE messages IS 'Mensajes (user/assistant) por conversación';
 COMMENT ON COLUMN messages.role IS 'Rol del mensaje (user | assistant)';
+COMMENT ON COLUMN messages.token_count IS 'Tokens estimados del mensaje (presupuesto de contexto del LLM)';
+COMMENT ON COLUMN messages.seq IS 'Posición del mensaje en su conversación (orden del historial)';
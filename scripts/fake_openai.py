@@ -0,0 +1,123 @@
+"""
+Servidor falso compatible con OpenAI para benchmarks offline.
+
+⚠️ Nota:
+--------
+No es parte de la API. Se usa solo para medir la latencia propia del servicio
+(DB, trimming, serialización, concurrencia) sin red ni costo de OpenAI.
+
+Qué implementa:
+---------------
+- `POST /v1/chat/completions` con el subconjunto que usa `app/llm.py`:
+    • respuestas normales y en streaming (`stream=True`, SSE con `[DONE]`),
+    • `response_format={"type": "json_object"}` y prompts que piden JSON
+      con `topic`/`stance` (devuelve un JSON válido para `open_debate` y
+      `detect_topic_and_stance`).
+- `GET /health` para el healthcheck de docker-compose.
+
+Latencia simulada (variables de entorno):
+-----------------------------------------
+- FAKE_LLM_LATENCY        → segundos hasta el primer token (default 0.3).
+- FAKE_LLM_TOKENS_PER_SEC → velocidad de generación (default 50).
+- FAKE_LLM_REPLY_TOKENS   → tokens (palabras) por respuesta (default 60).
+
+Uso:
+----
+    uvicorn scripts.fake_openai:app --host 0.0.0.0 --port 9000
+    OPENAI_BASE_URL=http://localhost:9000/v1 uvicorn app.main:app
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.3"))
+TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "50"))
+REPLY_TOKENS = int(os.getenv("FAKE_LLM_REPLY_TOKENS", "60"))
+
+_WORDS = (
+    "Entiendo tu punto, pero la evidencia muestra lo contrario y mi postura se mantiene firme "
+    "porque los datos disponibles, la experiencia histórica y el sentido común respaldan "
+    "claramente esta posición frente a la tuya."
+).split()
+
+app = FastAPI(title="Fake OpenAI")
+
+
+def reply_words(max_tokens: int) -> list:
+    count = max(1, min(REPLY_TOKENS, max_tokens))
+    return [_WORDS[i % len(_WORDS)] for i in range(count)]
+
+
+def wants_json(body: dict) -> bool:
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return True
+    prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []) if m.get("role") == "system")
+    return '"topic"' in prompt and '"stance"' in prompt
+
+
+def completion_text(body: dict) -> str:
+    words = reply_words(body.get("max_tokens") or REPLY_TOKENS)
+    if wants_json(body):
+        return json.dumps({
+            "topic": "tema de benchmark",
+            "stance": "postura contraria de benchmark",
+            "reply": " ".join(words),
+        }, ensure_ascii=False)
+    return " ".join(words)
+
+
+def chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.get("/health")
+def health():
+    return {"status": "healthy"}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    text = completion_text(body)
+    tokens = len(text.split())
+
+    if body.get("stream"):
+        async def events():
+            await asyncio.sleep(LATENCY)
+            yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for i, word in enumerate(text.split()):
+                await asyncio.sleep(1 / TOKENS_PER_SEC)
+                yield chunk(completion_id, model, {"content": word if i == 0 else f" {word}"})
+            yield chunk(completion_id, model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(LATENCY + tokens / TOKENS_PER_SEC)
+    return JSONResponse({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens},
+    })
@@ -0,0 +1,251 @@
+"""
+Benchmark de carga del endpoint /chat (offline, con un LLM falso).
+
+⚠️ Nota:
+--------
+Este archivo NO es un test de pytest. Se ejecuta contra una API levantada con
+`OPENAI_BASE_URL` apuntando a `scripts/fake_openai.py` (ver `make loadtest`).
+
+Qué mide:
+---------
+Para cada combinación de concurrencia × largo de conversación:
+- Se lanzan conversaciones en paralelo (hasta `concurrency` a la vez); cada una
+  envía `turns` mensajes secuenciales a `/chat`.
+- Se reporta throughput (requests/s), latencia p50/p95/p99 y errores.
+- Cada escenario envía al menos `--min-requests` requests (100 por defecto):
+  con menos, el p95/p99 es una sola muestra y el baseline no es estable.
+
+Baseline:
+---------
+- `--output` escribe los resultados en JSON.
+- `--baseline` compara contra un JSON previo y termina con código 1 si algún
+  escenario empeora más de `--tolerance` (p95 más alto o throughput más bajo).
+- `--write-baseline` sobrescribe el baseline con los resultados actuales. Se
+  niega si algún escenario quedó con menos de `--min-requests` requests.
+- Si `--baseline` no existe (y no se pasó `--write-baseline`) se avisa que
+  no hubo comparación; con `--ci` (o `CI=true`, como en la mayoría de los
+  runners) termina con código 1: sin baseline no hay gate de regresiones.
+- Si el baseline se midió contra otra URL, se avisa: los números no son
+  comparables (el baseline oficial se graba con `make loadtest-baseline`,
+  contra `api-bench` dentro del perfil de docker-compose).
+
+Uso:
+----
+    python scripts/loadtest.py --url http://localhost:8000 \\
+        --concurrency 1,8,32 --turns 1,5 --baseline scripts/loadtest_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Percentil por rango más cercano sobre una lista ya ordenada.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+async def run_conversation(client: httpx.AsyncClient, turns: int, latencies: List[float], errors: List[str]) -> None:
+    conversation_id: Optional[str] = None
+    tag = uuid.uuid4().hex[:8]
+
+    for turn in range(turns):
+        # Mensajes únicos: evita que la caché de respuestas o el índice de
+        # aperturas conviertan el benchmark en una medición de hits
+        message = f"[{tag}] Argumento {turn + 1}: los perros son mejores que los gatos"
+        start = time.perf_counter()
+        try:
+            response = await client.post("/chat", json={"conversation_id": conversation_id, "message": message})
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            return
+        latencies.append(time.perf_counter() - start)
+
+        if response.status_code != 200:
+            errors.append(str(response.status_code))
+            return
+        conversation_id = response.json()["conversation_id"]
+
+
+async def run_scenario(url: str, concurrency: int, turns: int, conversations: int, timeout: float) -> Dict:
+    """
+    Ejecuta un escenario y devuelve sus métricas.
+    """
+    latencies: List[float] = []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            async with semaphore:
+                await run_conversation(client, turns, latencies, errors)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(conversations)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "turns": turns,
+        "conversations": conversations,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "max_ms": round(1000 * latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Compara los escenarios con el baseline y devuelve las regresiones encontradas.
+    """
+    previous = {(s["concurrency"], s["turns"]): s for s in baseline.get("scenarios", [])}
+    regressions = []
+    for scenario in results:
+        base = previous.get((scenario["concurrency"], scenario["turns"]))
+        if base is None:
+            continue
+        name = f"c={scenario['concurrency']} turns={scenario['turns']}"
+        if scenario["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms → {scenario['p95_ms']}ms")
+        if scenario["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} → {scenario['throughput_rps']} req/s")
+        if scenario["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: errores {base.get('errors', 0)} → {scenario['errors']}")
+    return regressions
+
+
+async def wait_until_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url, timeout=5) as client:
+        while True:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"La API en {url} no respondió a /health")
+            await asyncio.sleep(1)
+
+
+def parse_levels(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def scenario_conversations(concurrency: int, turns: int, conversations: int, min_requests: int) -> int:
+    """
+    Conversaciones de un escenario: las pedidas (o 4 × concurrencia) y, como
+    mínimo, las necesarias para llegar a `min_requests` requests.
+    """
+    return max(conversations or 4 * concurrency, math.ceil(min_requests / turns))
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de carga de /chat")
+    parser.add_argument("--url", default=os.getenv("API_URL", "http://localhost:8000"))
+    parser.add_argument("--concurrency", default=os.getenv("LOADTEST_CONCURRENCY", "1,8,32"))
+    parser.add_argument("--turns", default=os.getenv("LOADTEST_TURNS", "1,5"))
+    parser.add_argument("--conversations", type=int, default=int(os.getenv("LOADTEST_CONVERSATIONS", "0")),
+                        help="Conversaciones por escenario (default: 4 × concurrencia)")
+    parser.add_argument("--min-requests", type=int, default=int(os.getenv("LOADTEST_MIN_REQUESTS", "100")),
+                        help="Requests mínimos por escenario (agrega conversaciones si hace falta)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", default=os.getenv("LOADTEST_OUTPUT"))
+    parser.add_argument("--baseline", default=os.getenv("LOADTEST_BASELINE"))
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("LOADTEST_TOLERANCE", "0.2")))
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--ci", action="store_true", default=os.getenv("CI", "").lower() in ("1", "true"),
+                        help="Falla si no hay baseline contra el cual comparar")
+    args = parser.parse_args()
+
+    missing_baseline = bool(args.baseline) and not args.write_baseline and not os.path.exists(args.baseline)
+    if missing_baseline and args.ci:
+        # En CI no tiene sentido correr la carga si no hay contra qué compararla
+        print(f"Sin baseline en {args.baseline}. Grabarlo con `make loadtest-baseline`.")
+        return 1
+
+    await wait_until_ready(args.url)
+
+    results = []
+    print(f"{'conc':>5} {'turns':>5} {'reqs':>6} {'err':>4} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for turns in parse_levels(args.turns):
+        for concurrency in parse_levels(args.concurrency):
+            conversations = scenario_conversations(concurrency, turns, args.conversations, args.min_requests)
+            scenario = await run_scenario(args.url, concurrency, turns, conversations, args.timeout)
+            results.append(scenario)
+            print(
+                f"{concurrency:>5} {turns:>5} {scenario['requests']:>6} {scenario['errors']:>4} "
+                f"{scenario['throughput_rps']:>8} {scenario['p50_ms']:>7}ms {scenario['p95_ms']:>7}ms "
+                f"{scenario['p99_ms']:>7}ms"
+            )
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "url": args.url,
+        "python": platform.python_version(),
+        "fake_llm": {
+            "latency_s": os.getenv("FAKE_LLM_LATENCY"),
+            "tokens_per_sec": os.getenv("FAKE_LLM_TOKENS_PER_SEC"),
+            "reply_tokens": os.getenv("FAKE_LLM_REPLY_TOKENS"),
+        },
+        "scenarios": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {args.output}")
+
+    status = 0
+    if missing_baseline:
+        print(f"Sin baseline en {args.baseline}: no se comparó. Grabarlo con `make loadtest-baseline`.")
+    elif args.baseline and not args.write_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("url") != args.url:
+            print(f"Aviso: el baseline se midió contra {baseline.get('url')}, no contra {args.url}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regresiones respecto del baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            status = 1
+        else:
+            print(f"Sin regresiones respecto de {args.baseline} (tolerancia {args.tolerance:.0%})")
+
+    if args.baseline and args.write_baseline:
+        short = [s for s in results if s["requests"] < args.min_requests]
+        if short:
+            print(f"Baseline NO actualizado: {len(short)} escenario(s) con menos de {args.min_requests} requests")
+            return 1
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Baseline actualizado: {args.baseline}")
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -5,20 +5,21 @@
 
 -- Insertar conversación de prueba y guardar el UUID
 WITH new_conv AS (
-  INSERT INTO conversations (id, topic, stance, engine)
+  INSERT INTO conversations (id, topic, stance, engine, message_count_user, message_count_bot, message_seq)
   VALUES (
     gen_random_uuid(),
     'La Tierra es plana',
     'a favor',
-    'gpt-3.5-turbo'
+    'gpt-3.5-turbo',
+    2, 2, 4
   )
   RETURNING id
 )
-INSERT INTO messages (conversation_id, role, content)
-SELECT id, 'user'::message_role, 'Creo que la Tierra es redonda.' FROM new_conv
+INSERT INTO messages (conversation_id, role, content, seq)
+SELECT id, 'user'::message_role, 'Creo que la Tierra es redonda.', 1 FROM new_conv
 UNION ALL
-SELECT id, 'assistant'::message_role, '¡No! Es plana y lo puedo demostrar.' FROM new_conv
+SELECT id, 'assistant'::message_role, '¡No! Es plana y lo puedo demostrar.', 2 FROM new_conv
 UNION ALL
-SELECT id, 'user'::message_role, '¿Y qué pasa con las fotos desde el espacio?' FROM new_conv
+SELECT id, 'user'::message_role, '¿Y qué pasa con las fotos desde el espacio?', 3 FROM new_conv
 UNION ALL
-SELECT id, 'assistant'::message_role, 'Son montajes de agencias espaciales. 😉' FROM new_conv;
+SELECT id, 'assistant'::message_role, 'Son montajes de agencias espaciales. 😉', 4 FROM new_conv;
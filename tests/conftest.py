@@ -9,6 +9,7 @@ from app.main import app, get_db
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.models import Base
+from app.db import engine as app_engine
 import sys, os
 from app.main import app, get_db
 
@@ -45,6 +46,10 @@ async def db_engine():
     # Liberar recursos del engine
     await engine.dispose()
 
+    # Cerrar también las conexiones que la app abrió por su cuenta (ej. caché de
+    # respuestas del LLM): quedan atadas al event loop de este test
+    await app_engine.dispose()
+
 
 @pytest_asyncio.fixture(scope="function")
 async def db_session(db_engine):
@@ -0,0 +1,110 @@
+# tests/test_admission.py
+"""
+Tests del control de admisión de /chat (app/admission.py).
+
+Objetivo:
+---------
+- Verificar la cola acotada y el rechazo temprano por cola llena o espera estimada.
+- Confirmar que el middleware responde 503 con `Retry-After` bajo sobrecarga.
+- Confirmar que una desconexión del cliente cancela la request en curso y libera su lugar.
+"""
+
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.admission import AdmissionController, AdmissionMiddleware, Overloaded
+
+
+async def echo_app(scope, receive, send):
+    body = (await receive())["body"]
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+@pytest.mark.asyncio
+async def test_bounded_queue_rejects_when_full():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=1, enabled=True)
+    await controller.acquire()
+
+    waiting = asyncio.ensure_future(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.queued == 1
+
+    with pytest.raises(Overloaded) as error:
+        await controller.acquire()
+    assert error.value.reason == "queue_full"
+    assert error.value.retry_after >= 1
+
+    controller.release(0.01)
+    await waiting
+    assert (controller.in_flight, controller.queued) == (1, 0)
+    controller.release(0.01)
+    assert controller.stats()["admitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_rejects_early_when_estimated_wait_exceeds_deadline():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=2, enabled=True)
+    await controller.acquire()
+    controller.service_time = 5.0  # cada request tarda ~5s: esperar excedería el plazo
+
+    with pytest.raises(Overloaded) as error:
+        await controller.acquire()
+    assert error.value.reason == "deadline"
+    assert error.value.retry_after == 5
+    assert controller.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_middleware_sheds_load_with_503():
+    controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=1, enabled=True)
+    app = AdmissionMiddleware(echo_app, controller)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        r = await client.post("/chat", content=b"hola")
+        assert r.status_code == 200
+        assert r.content == b"hola"
+
+        await controller.acquire()  # ocupar el único lugar
+        r = await client.post("/chat", content=b"hola")
+        assert r.status_code == 503
+        assert int(r.headers["retry-after"]) >= 1
+
+        # Las demás rutas no pasan por el control de admisión
+        assert (await client.post("/otra", content=b"x")).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_client_disconnect_cancels_request():
+    controller = AdmissionController(max_concurrency=2, max_queue=2, queue_timeout=1, enabled=True)
+    cancelled = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)  # ej. llamada al LLM
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    inbox = asyncio.Queue()
+    await inbox.put({"type": "http.request", "body": b"{}", "more_body": False})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/chat", "headers": []}
+    request = asyncio.ensure_future(AdmissionMiddleware(slow_app, controller)(scope, inbox.get, send))
+    await asyncio.sleep(0.05)
+    assert controller.in_flight == 1
+
+    await inbox.put({"type": "http.disconnect"})
+    await asyncio.wait_for(request, 1)
+
+    assert cancelled.is_set()
+    assert sent == []
+    assert controller.in_flight == 0
+    assert controller.stats()["client_disconnects"] == 1
@@ -0,0 +1,148 @@
+# tests/test_archive.py
+"""
+Tests del archivo comprimido de conversaciones inactivas (app/archive.py).
+
+Objetivo:
+---------
+- Verificar que el blob conserva los mensajes y ocupa mucho menos que el texto.
+- Confirmar el archivado por lotes (solo conversaciones inactivas).
+- Confirmar que /chat y el historial restauran la conversación archivada en el
+  próximo acceso, y que dos accesos simultáneos no la restauran dos veces.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import main
+from app.archive import ConversationArchiver, pack_messages, unpack_messages
+from app.models import Conversation, Message, MessageArchive, MessageRole
+from app.repository import get_conversation
+
+DEBATE_LINE = (
+    "No estoy de acuerdo: la evidencia disponible muestra que la medida reduce "
+    "los costos a largo plazo y mejora la calidad del servicio para todos."
+)
+
+
+async def seed_conversation(db_session, created_at: datetime, count: int = 4) -> Conversation:
+    conv = Conversation(
+        id=uuid4(), topic="t", stance="s", engine="local",
+        created_at=created_at, updated_at=created_at,
+        message_count_user=count // 2, message_count_bot=count // 2, message_seq=count,
+    )
+    db_session.add(conv)
+    for i in range(count):
+        db_session.add(Message(
+            conversation_id=conv.id,
+            role=MessageRole.user if i % 2 == 0 else MessageRole.assistant,
+            content=f"m{i}",
+            token_count=i,
+            seq=i + 1,
+            created_at=created_at + timedelta(seconds=i),
+        ))
+    await db_session.commit()
+    return conv
+
+
+async def stored(db_engine, model, conv_id) -> int:
+    column = model.conversation_id
+    async with db_engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(model).where(column == conv_id))).scalar()
+
+
+async def archive_all(db_engine, batch_size: int = 100) -> ConversationArchiver:
+    archiver = ConversationArchiver(batch_size=batch_size, pause=0)
+    async with db_engine.connect() as conn:
+        await archiver.archive_idle(conn, datetime.now(timezone.utc) - timedelta(days=1))
+    return archiver
+
+
+def test_pack_roundtrip_and_size():
+    conv_id = uuid4()
+    created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = [
+        Message(
+            id=i + 1, seq=i + 1, role=MessageRole.user if i % 2 == 0 else MessageRole.assistant,
+            content=f"{DEBATE_LINE} ({i})", token_count=30, created_at=created_at + timedelta(seconds=i),
+        )
+        for i in range(40)
+    ]
+    payload, raw_bytes = pack_messages(rows)
+
+    restored = unpack_messages(conv_id, payload)
+    assert [(r["id"], r["seq"], r["role"], r["content"]) for r in restored] == [
+        (row.id, row.seq, row.role, row.content) for row in rows
+    ]
+    assert restored[3]["created_at"] == created_at + timedelta(seconds=3)
+    assert len(payload) * 10 < raw_bytes
+
+
+@pytest.mark.asyncio
+async def test_idle_conversations_are_archived_in_batches(db_engine, db_session):
+    old = datetime.now(timezone.utc) - timedelta(days=5)
+    idle = [await seed_conversation(db_session, old) for _ in range(3)]
+    active = await seed_conversation(db_session, datetime.now(timezone.utc))
+
+    archiver = await archive_all(db_engine, batch_size=2)
+
+    assert archiver.stats()["archived_conversations"] == 3
+    assert archiver.stats()["archived_messages"] == 12
+    for conv in idle:
+        assert await stored(db_engine, Message, conv.id) == 0
+        assert await stored(db_engine, MessageArchive, conv.id) == 1
+    assert await stored(db_engine, Message, active.id) == 4
+    assert await stored(db_engine, MessageArchive, active.id) == 0
+
+    # Una segunda corrida no vuelve a tocar lo archivado
+    assert (await archive_all(db_engine)).stats()["archived_conversations"] == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_and_history_rehydrate_archived_conversation(client, db_engine, db_session, monkeypatch):
+    first = await seed_conversation(db_session, datetime.now(timezone.utc) - timedelta(days=5))
+    second = await seed_conversation(db_session, datetime.now(timezone.utc) - timedelta(days=5))
+    await archive_all(db_engine)
+
+    async def fake_llm(history, **_kwargs):
+        return f"respuesta {len(history)}"
+
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    r = await client.post("/chat", json={"conversation_id": str(first.id), "message": "Vuelvo"})
+    assert r.status_code == 200
+    assert [m["message"] for m in r.json()["message"]] == ["m0", "m1", "m2", "m3", "Vuelvo", "respuesta 5"]
+    async with db_engine.connect() as conn:
+        seqs = (await conn.execute(
+            select(Message.seq).where(Message.conversation_id == first.id).order_by(Message.seq)
+        )).scalars().all()
+    assert seqs == [1, 2, 3, 4, 5, 6]
+    assert await stored(db_engine, MessageArchive, first.id) == 0
+
+    r = await client.get(f"/conversations/{second.id}/messages")
+    assert [m["message"] for m in r.json()["messages"]] == ["m0", "m1", "m2", "m3"]
+    assert await stored(db_engine, MessageArchive, second.id) == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_access_rehydrates_once(db_engine, db_session):
+    conv = await seed_conversation(db_session, datetime.now(timezone.utc) - timedelta(days=5))
+    await archive_all(db_engine)
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def access(delay: float):
+        async with TestingSessionLocal() as db:
+            found = await get_conversation(db, conv.id)
+            await asyncio.sleep(delay)
+            await db.commit()
+            return found
+
+    results = await asyncio.gather(access(0.2), access(0))
+    assert all(found is not None and found.id == conv.id for found in results)
+    assert await stored(db_engine, Message, conv.id) == 4
+    assert await stored(db_engine, MessageArchive, conv.id) == 0
@@ -0,0 +1,181 @@
+# tests/test_chat_batch.py
+"""
+Tests del endpoint de lotes POST /chat/batch.
+
+Objetivo:
+---------
+- Verificar que cada mensaje del lote recibe su línea NDJSON (con `index` y
+  `status`) y que los errores de un mensaje no cortan el lote.
+- Confirmar el orden dentro de cada conversación (por `conversation_id` y por
+  `ref`) y que la concurrencia del lote queda acotada.
+- Confirmar que al terminar el stream los turnos ya están guardados y que,
+  mientras esperan en el buffer, el resto de la app ya ve la conversación.
+"""
+
+import asyncio
+import json
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import main, write_behind
+from app.cache import conversation_cache
+from app.models import Message
+from app.schemas import ChatBatchItem
+from app.write_behind import TurnWriter
+
+
+@pytest_asyncio.fixture
+async def batch_env(db_engine, monkeypatch):
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(main, "AsyncSessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(write_behind, "AsyncSessionLocal", TestingSessionLocal)
+    # Escritor propio: su tarea se detiene al terminar el test
+    writer = TurnWriter()
+    monkeypatch.setattr(main, "turn_writer", writer)
+
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    yield TestingSessionLocal
+    await main.turn_writer.close()
+
+
+async def post_batch(client, items) -> list:
+    r = await client.post("/chat/batch", json=items)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+async def stored_contents(db_engine, conv_id: str) -> list:
+    async with db_engine.connect() as conn:
+        rows = await conn.execute(
+            select(Message.content).where(Message.conversation_id == conv_id).order_by(Message.seq)
+        )
+        return rows.scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_batch_streams_one_line_per_message(client, db_engine, batch_env, monkeypatch):
+    async def fake_llm(history, **_kwargs):
+        await asyncio.sleep(0.01)
+        return f"re: {history[-1].message}"
+
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Existente"})
+    existing = r.json()["conversation_id"]
+
+    lines = await post_batch(client, [
+        {"conversation_id": None, "message": "a1", "ref": "a"},
+        {"conversation_id": existing, "message": "e1"},
+        {"conversation_id": None, "message": "a2", "ref": "a"},
+        {"conversation_id": "no-es-un-uuid", "message": "x"},
+        {"conversation_id": None, "message": "suelto"},
+        {"conversation_id": existing, "message": "e2"},
+        {"conversation_id": None, "message": "a3", "ref": "a"},
+    ])
+
+    assert sorted(line["index"] for line in lines) == list(range(7))
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[3] == {"index": 3, "status": 404, "detail": "conversation_id no encontrado o inválido"}
+    assert all(by_index[i]["status"] == 200 for i in (0, 1, 2, 4, 5, 6))
+
+    # Los turnos de una `ref` continúan la misma conversación, en orden
+    ref_conv = by_index[0]["conversation_id"]
+    assert by_index[2]["conversation_id"] == ref_conv == by_index[6]["conversation_id"]
+    assert by_index[4]["conversation_id"] not in (ref_conv, existing)
+    assert [m["message"] for m in by_index[6]["message"]] == ["a1", "re: a1", "a2", "re: a2", "a3", "re: a3"]
+
+    # Al terminar el stream los turnos ya están en la DB
+    assert await stored_contents(db_engine, ref_conv) == ["a1", "re: a1", "a2", "re: a2", "a3", "re: a3"]
+    assert await stored_contents(db_engine, existing) == ["Existente", "re: Existente", "e1", "re: e1", "e2", "re: e2"]
+
+
+@pytest.mark.asyncio
+async def test_batch_concurrency_is_bounded(client, batch_env, monkeypatch):
+    monkeypatch.setattr(main, "CHAT_BATCH_CONCURRENCY", 3)
+    running, peak = 0, 0
+
+    async def slow_llm(history, **_kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return "ok"
+
+    monkeypatch.setattr(main, "ask_llm", slow_llm)
+
+    lines = await post_batch(client, [{"conversation_id": None, "message": f"m{i}"} for i in range(12)])
+
+    assert len(lines) == 12 and all(line["status"] == 200 for line in lines)
+    assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_opening_skips_rest_of_ref_chain(client, batch_env, monkeypatch):
+    async def fail_detect(_message):
+        raise RuntimeError("sin LLM")
+
+    async def fake_llm(history, **_kwargs):
+        return "ok"
+
+    monkeypatch.setattr(main, "detect_topic_and_stance", fail_detect)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    lines = await post_batch(client, [
+        {"conversation_id": None, "message": "Un tema nuevo que nadie vio", "ref": "r"},
+        {"conversation_id": None, "message": "sigo", "ref": "r"},
+    ])
+
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[0]["status"] == 500
+    assert by_index[1]["status"] == 424
+
+
+@pytest.mark.asyncio
+async def test_batch_size_limit(client, monkeypatch):
+    monkeypatch.setattr(main, "CHAT_BATCH_MAX_ITEMS", 2)
+
+    r = await client.post("/chat/batch", json=[{"message": "a"}, {"message": "b"}, {"message": "c"}])
+    assert r.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_batch_conversation_is_visible_before_it_is_written(client, db_engine, batch_env, monkeypatch):
+    # Escritura diferida desactivada y lotes que esperan 10 s: los turnos del lote siguen en el buffer
+    writer = TurnWriter(enabled=False, max_delay=10, max_batch=100, max_pending=100)
+    monkeypatch.setattr(main, "turn_writer", writer)
+
+    async def fake_llm(history, **_kwargs):
+        return f"re: {history[-1].message}"
+
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    async with batch_env() as db:
+        first = (await main.run_batch_turn(ChatBatchItem(message="uno"), db))["conversation_id"]
+        second = (await main.run_batch_turn(ChatBatchItem(message="otro"), db))["conversation_id"]
+    assert writer.contains(UUID(first)) and await stored_contents(db_engine, first) == []
+
+    # Hit de caché: el turno en línea espera a que se escriba el del lote
+    r = await client.post("/chat", json={"conversation_id": first, "message": "dos"})
+    assert r.status_code == 200
+    assert await stored_contents(db_engine, first) == ["uno", "re: uno", "dos", "re: dos"]
+
+    # Sin caché: la conversación se sirve desde el buffer y el historial la escribe antes de leer
+    conversation_cache.invalidate(UUID(second))
+    r = await client.post("/chat", json={"conversation_id": second, "message": "sigo"})
+    assert [m["message"] for m in r.json()["message"]] == ["otro", "re: otro", "sigo", "re: sigo"]
+    r = await client.get(f"/conversations/{second}/messages")
+    assert [m["message"] for m in r.json()["messages"]] == ["otro", "re: otro", "sigo", "re: sigo"]
@@ -52,8 +52,14 @@ async def test_chat_fallback_on_llm_failure(client, db_engine, monkeypatch):
     def fake_llm(_history):
         raise RuntimeError("Simulación de error en LLM")
 
+    # El primer turno intenta resolverse en una sola llamada (`open_debate`);
+    # se simula que su JSON no se pudo parsear para forzar el flujo con `ask_llm`.
+    async def fake_open_debate(_message):
+        return None
+
     # monkeypatch → sustituye dinámicamente `ask_llm` por `fake_llm` dentro del módulo main.
     monkeypatch.setattr(main, "ask_llm", fake_llm)
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
 
     # --- Paso 2: Hacer request a /chat ---
     r = await client.post("/chat", json={"conversation_id": None, "message": "Probando error"})
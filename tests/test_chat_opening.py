@@ -0,0 +1,132 @@
+# tests/test_chat_opening.py
+"""
+Tests del primer turno en una sola llamada al LLM (`open_debate`).
+
+Objetivo:
+---------
+- Verificar que el parseo del JSON del modelo es tolerante (bloques de código, texto extra).
+- Confirmar que, si `open_debate` responde, no se llama a `ask_llm` y se persisten
+  topic, stance y la réplica.
+- Confirmar que, si el parseo falla, se usa el flujo de dos llamadas.
+- Confirmar que, si la llamada falla (LLM caído o circuito abierto), se responde
+  el fallback sin más llamadas al LLM.
+"""
+
+import asyncio
+from uuid import UUID
+
+import pytest
+from sqlalchemy import select
+
+from app import llm, main
+from app.engines import LLMEngine
+from app.llm import DebateOpening, parse_json_object
+from app.models import Conversation
+from app.resilience import CircuitBreaker, LLMGuard
+from app.topic_index import topic_index
+
+
+def test_parse_json_object_is_tolerant():
+    assert parse_json_object('{"topic": "a"}') == {"topic": "a"}
+    assert parse_json_object('```json\n{"topic": "a"}\n```') == {"topic": "a"}
+    assert parse_json_object('Claro: {"topic": "a"} ¡Suerte!') == {"topic": "a"}
+    assert parse_json_object("sin json") is None
+    assert parse_json_object('{"topic": ') is None
+    assert parse_json_object(None) is None
+
+
+@pytest.mark.asyncio
+async def test_first_turn_uses_single_llm_call(client, db_session, monkeypatch):
+    async def fake_open_debate(_message):
+        return DebateOpening(topic="gatos vs perros", stance="los perros son mejores", reply="Los perros son más leales.")
+
+    async def fail_llm(*_args, **_kwargs):
+        raise AssertionError("ask_llm no debe llamarse en el primer turno")
+
+    async def fail_detect(_message):
+        raise AssertionError("detect_topic_and_stance no debe llamarse en el primer turno")
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "ask_llm", fail_llm)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fail_detect)
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Los gatos son mejores"})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["message"][-1] == {"role": "assistant", "message": "Los perros son más leales."}
+
+    conv = (await db_session.execute(
+        select(Conversation).where(Conversation.id == UUID(data["conversation_id"]))
+    )).scalar_one()
+    assert conv.topic == "gatos vs perros"
+    assert conv.stance == "los perros son mejores"
+
+
+@pytest.mark.asyncio
+async def test_first_turn_falls_back_to_two_calls(client, monkeypatch):
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    async def fake_llm(history, system_prompt=None):
+        assert "tema" in system_prompt
+        return "réplica por dos llamadas"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Hola"})
+    assert r.status_code == 200
+    assert r.json()["message"][-1]["message"] == "réplica por dos llamadas"
+
+
+class DownEngine(LLMEngine):
+    name = "down"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, messages, **_kwargs):
+        self.calls += 1
+        raise asyncio.TimeoutError()
+
+    async def stream(self, messages, **_kwargs):
+        self.calls += 1
+        raise asyncio.TimeoutError()
+        yield ""
+
+
+@pytest.mark.asyncio
+async def test_first_turn_makes_one_call_when_llm_is_down(client, db_session, monkeypatch):
+    engine = DownEngine()
+    guard = LLMGuard(
+        "test", max_timeout=5.0, min_timeout=0.05, multiplier=2.0, adaptive=True,
+        hedge=False, retries=0, backoff=0.0, backoff_max=0.0,
+        breaker=CircuitBreaker(window=1, min_calls=1, error_rate=0.5, cooldown=60, enabled=True),
+    )
+    monkeypatch.setattr(llm, "get_engine", lambda: engine)
+    monkeypatch.setattr(llm, "get_guard", lambda _name: guard)
+    monkeypatch.setattr(main, "get_engine", lambda: engine)
+
+    # LLM caído: una sola llamada (la de `open_debate`) y respuesta de fallback
+    message = "Un enunciado que el índice de aperturas no conoce"
+    r = await client.post("/chat", json={"conversation_id": None, "message": message})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["message"][-1] == {"role": "assistant", "message": llm.LLM_FALLBACK_REPLY}
+    assert engine.calls == 1
+
+    conv = (await db_session.execute(
+        select(Conversation).where(Conversation.id == UUID(data["conversation_id"]))
+    )).scalar_one()
+    assert (conv.topic, conv.stance) == (llm.DEFAULT_TOPIC, llm.DEFAULT_STANCE)
+    assert topic_index.lookup(message) is None
+
+    # Circuito abierto: se responde sin llamar al motor
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Otro enunciado distinto"})
+    assert r.status_code == 200
+    assert r.json()["message"][-1]["message"] == llm.LLM_FALLBACK_REPLY
+    assert engine.calls == 1
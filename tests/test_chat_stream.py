@@ -0,0 +1,68 @@
+# tests/test_chat_stream.py
+"""
+Tests del endpoint de streaming `/chat/stream` (Server-Sent Events).
+
+Objetivo:
+---------
+- Verificar que la respuesta se emite como eventos SSE (`meta`, `token`, `history`).
+- Confirmar que el último evento trae el historial recortado (5x5) ya persistido.
+"""
+
+import json
+import pytest
+
+
+def parse_sse(body: str) -> list[tuple[str, dict]]:
+    """
+    Convierte el cuerpo de un stream SSE en una lista de (evento, payload).
+    """
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_emits_tokens_and_history(client, db_engine):
+    """
+    Flujo:
+    -------
+    1. Se inicia una conversación por `/chat/stream`.
+    2. El primer evento debe ser `meta` con el `conversation_id`.
+    3. Debe haber al menos un evento `token`.
+    4. El último evento debe ser `history` con el mensaje del usuario y la respuesta del bot.
+    5. Un segundo turno por `/chat` debe continuar la misma conversación.
+    """
+    r = await client.post("/chat/stream", json={"conversation_id": None, "message": "El café es mejor que el té"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_sse(r.text)
+    names = [name for name, _ in events]
+
+    assert names[0] == "meta"
+    assert "token" in names
+    assert names[-1] == "history"
+
+    conv_id = events[0][1]["conversation_id"]
+    history = events[-1][1]
+    streamed = "".join(data["delta"] for name, data in events if name == "token").strip()
+
+    assert history["conversation_id"] == conv_id
+    assert history["message"][-2] == {"role": "user", "message": "El café es mejor que el té"}
+    assert history["message"][-1]["role"] == "assistant"
+    assert history["message"][-1]["message"] == streamed
+
+    # El turno siguiente por /chat ve lo persistido por el stream
+    r2 = await client.post("/chat", json={"conversation_id": conv_id, "message": "¿Seguro?"})
+    assert r2.status_code == 200
+    assert len(r2.json()["message"]) == 4
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_invalid_conversation_id_returns_404(client):
+    """Con `conversation_id` inválido se responde 404 antes de abrir el stream."""
+    r = await client.post("/chat/stream", json={"conversation_id": "no-es-uuid", "message": "Hola"})
+    assert r.status_code == 404
+    assert r.json()["detail"] == "conversation_id no encontrado o inválido"
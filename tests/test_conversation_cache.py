@@ -0,0 +1,122 @@
+# tests/test_conversation_cache.py
+"""
+Tests de la caché en memoria de conversaciones (app/cache.py).
+
+Objetivo:
+---------
+- Verificar eviction LRU, expiración por TTL y tope de memoria.
+- Confirmar que un segundo turno en `/chat` se sirve desde la caché.
+- Confirmar que, con varios workers (advisory lock), un hit desactualizado se
+  descarta y el turno ve el historial de la DB.
+"""
+
+import uuid
+
+import pytest
+
+from app import main
+from app.cache import ConversationCache, conversation_cache
+from app.conversation_lock import ConversationTurns
+from app.schemas import MessageTurn
+
+
+def turns(n: int) -> list[MessageTurn]:
+    return [MessageTurn(role="user" if i % 2 == 0 else "assistant", message=f"m{i}") for i in range(n)]
+
+
+def test_cache_evicts_least_recently_used():
+    """Con tope de 2 entradas, se desaloja la menos usada."""
+    cache = ConversationCache(max_entries=2, ttl=60, max_bytes=10**6, per_role=2)
+    a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    cache.store(a, "t", "s", "e", turns(2))
+    cache.store(b, "t", "s", "e", turns(2))
+    assert cache.get(a) is not None  # `a` pasa a ser la más reciente
+    cache.store(c, "t", "s", "e", turns(2))
+
+    assert cache.get(b) is None
+    assert cache.get(a) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_keeps_only_recent_turns_and_expires():
+    """Se conservan los últimos `per_role` turnos de cada rol; TTL 0 expira al instante."""
+    cache = ConversationCache(max_entries=10, ttl=60, max_bytes=10**6, per_role=2)
+    conv = uuid.uuid4()
+    cache.store(conv, "t", "s", "e", turns(10))
+    assert [t.message for t in cache.get(conv).turns] == ["m6", "m7", "m8", "m9"]
+
+    # Rachas de un mismo rol (mensajes agrupados): misma ventana que `load_recent_history`
+    runs = [MessageTurn(role=role, message=message) for role, message in [
+        ("user", "u0"), ("assistant", "a1"), ("user", "u2"), ("user", "u3"), ("user", "u4"), ("assistant", "a5"),
+    ]]
+    cache.store(conv, "t", "s", "e", runs)
+    assert [t.message for t in cache.get(conv).turns] == ["a1", "u3", "u4", "a5"]
+
+    expired = ConversationCache(max_entries=10, ttl=0, max_bytes=10**6, per_role=2)
+    expired.store(conv, "t", "s", "e", turns(2))
+    assert expired.get(conv) is None
+    assert expired.stats()["expirations"] == 1
+
+
+def test_cache_respects_memory_cap():
+    """Si una entrada supera el tope de memoria, no permanece en caché."""
+    cache = ConversationCache(max_entries=10, ttl=60, max_bytes=100, per_role=2)
+    cache.store(uuid.uuid4(), "t", "s", "e", turns(4))
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_second_turn_hits_cache(client, db_engine):
+    """El segundo turno de una conversación se resuelve desde la caché del proceso."""
+    r1 = await client.post("/chat", json={"conversation_id": None, "message": "Hola"})
+    conv_id = r1.json()["conversation_id"]
+    hits_before = conversation_cache.hits
+
+    r2 = await client.post("/chat", json={"conversation_id": conv_id, "message": "¿Sigues ahí?"})
+    assert r2.status_code == 200
+    assert [m["message"] for m in r2.json()["message"] if m["role"] == "user"] == ["Hola", "¿Sigues ahí?"]
+    assert conversation_cache.hits == hits_before + 1
+
+    stats = (await client.get("/stats")).json()
+    assert stats["conversation_cache"]["hits"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_from_another_worker_is_discarded(client, monkeypatch):
+    """Worker A atiende los turnos 1 y 3, worker B el 2: el turno 3 debe ver el 2."""
+    seen = []
+
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    async def fake_llm(history, **_kwargs):
+        seen.append([turn.message for turn in history])
+        return f"re: {history[-1].message}"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+    monkeypatch.setattr(main, "conversation_turns", ConversationTurns(advisory=True, coalesce=False))
+    worker_a = ConversationCache(max_entries=10, ttl=60, max_bytes=10**6, per_role=10)
+    worker_b = ConversationCache(max_entries=10, ttl=60, max_bytes=10**6, per_role=10)
+
+    monkeypatch.setattr(main, "conversation_cache", worker_a)
+    r = await client.post("/chat", json={"conversation_id": None, "message": "uno"})
+    conv_id = r.json()["conversation_id"]
+
+    monkeypatch.setattr(main, "conversation_cache", worker_b)
+    await client.post("/chat", json={"conversation_id": conv_id, "message": "dos"})
+
+    monkeypatch.setattr(main, "conversation_cache", worker_a)
+    await client.post("/chat", json={"conversation_id": conv_id, "message": "tres"})
+    assert seen[-1] == ["uno", "re: uno", "dos", "re: dos", "tres"]
+    assert worker_a.stats()["stale"] == 1
+
+    # Sin turnos de otro worker, el hit se valida y se usa
+    await client.post("/chat", json={"conversation_id": conv_id, "message": "cuatro"})
+    assert seen[-1][-3:] == ["tres", "re: tres", "cuatro"]
+    assert (worker_a.stats()["hits"], worker_a.stats()["stale"]) == (2, 1)
@@ -0,0 +1,185 @@
+# tests/test_conversation_lock.py
+"""
+Tests de la serialización de turnos por conversación (app/conversation_lock.py).
+
+Objetivo:
+---------
+- Verificar que dos `/chat` concurrentes sobre la misma conversación se procesan
+  de a uno: cada turno ve el anterior y los mensajes no quedan intercalados.
+- Confirmar el agrupamiento (coalescing): los mensajes en espera se procesan en
+  un solo turno y todas las requests reciben la misma respuesta.
+- Confirmar que si el turno agrupado falla, los mensajes vuelven a la cola.
+- Confirmar el advisory lock de Postgres entre "procesos" (instancias distintas),
+  también con la escritura diferida activa.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from uuid import UUID, uuid4
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import main, write_behind
+from app.conversation_lock import ConversationTurns, advisory_key
+from app.models import Conversation, Message
+from app.repository import load_recent_history
+from app.schemas import MessageTurn
+from app.write_behind import TurnWriter
+
+
+def test_advisory_key_is_a_signed_bigint():
+    conv_id = UUID("ffffffff-ffff-ffff-0000-000000000000")
+    assert advisory_key(conv_id) == -1
+    assert -2**63 <= advisory_key(uuid4()) < 2**63
+
+
+@pytest.mark.asyncio
+async def test_concurrent_turns_are_serialized(client, db_engine, monkeypatch):
+    seen = []
+
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    async def slow_llm(history, **_kwargs):
+        seen.append(len(history))
+        await asyncio.sleep(0.05)
+        return f"respuesta {len(seen)}"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    monkeypatch.setattr(main, "ask_llm", slow_llm)
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Hola"})
+    conv_id = r.json()["conversation_id"]
+
+    responses = await asyncio.gather(*(
+        client.post("/chat", json={"conversation_id": conv_id, "message": f"m{i}"}) for i in range(3)
+    ))
+    assert all(r.status_code == 200 for r in responses)
+
+    # Cada turno vio el historial completo de los anteriores
+    assert seen == [1, 3, 5, 7]
+
+    async with db_engine.connect() as conn:
+        roles = (await conn.execute(
+            select(Message.role)
+            .where(Message.conversation_id == UUID(conv_id))
+            .order_by(Message.created_at)
+        )).scalars().all()
+    assert [role.value for role in roles] == ["user", "assistant"] * 4
+
+
+@pytest.mark.asyncio
+async def test_waiting_messages_are_coalesced():
+    turns = ConversationTurns(advisory=False, coalesce=True, coalesce_max=5)
+    conv_id = uuid4()
+    processed = []
+    leader_started = asyncio.Event()
+    release_leader = asyncio.Event()
+
+    async def send(message):
+        async with turns.turn(conv_id, message) as turn:
+            if turn.coalesced:
+                return turn.result
+            if message == "a":
+                leader_started.set()
+                await release_leader.wait()
+            processed.append(list(turn.messages))
+            response = "+".join(turn.messages)
+            turn.resolve(response)
+        return response
+
+    first = asyncio.ensure_future(send("a"))
+    await leader_started.wait()
+    rest = [asyncio.ensure_future(send(m)) for m in ("b", "c", "d")]
+    await asyncio.sleep(0)
+    release_leader.set()
+
+    assert await first == "a"
+    assert await asyncio.gather(*rest) == ["b+c+d"] * 3
+    assert processed == [["a"], ["b", "c", "d"]]
+    assert turns.stats()["coalesced_messages"] == 2
+    assert turns.stats()["active_conversations"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_coalesced_turn_requeues_followers():
+    turns = ConversationTurns(advisory=False, coalesce=True, coalesce_max=5)
+    conv_id = uuid4()
+    processed = []
+    release_leader = asyncio.Event()
+
+    async def send(message):
+        async with turns.turn(conv_id, message) as turn:
+            if turn.coalesced:
+                return turn.result
+            if message == "a":
+                await release_leader.wait()
+            processed.append(list(turn.messages))
+            if message == "b":
+                raise RuntimeError("falla del turno agrupado")
+            turn.resolve("+".join(turn.messages))
+        return "+".join(turn.messages)
+
+    first = asyncio.ensure_future(send("a"))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(send("b"))
+    third = asyncio.ensure_future(send("c"))
+    await asyncio.sleep(0)
+    release_leader.set()
+
+    assert await first == "a"
+    with pytest.raises(RuntimeError):
+        await second
+    # El mensaje agrupado con el turno fallido lo procesa su propia request
+    assert await third == "c"
+    assert processed == [["a"], ["b", "c"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_advisory_lock_orders_across_instances(db_engine):
+    # Dos instancias simulan dos workers: no comparten locks en memoria
+    worker_a = ConversationTurns(advisory=True, coalesce=False)
+    worker_b = ConversationTurns(advisory=True, coalesce=False)
+    conv_id = uuid4()
+    events = []
+
+    async def run(turns, name):
+        async with turns.turn(conv_id, name):
+            events.append(f"{name}:start")
+            await asyncio.sleep(0.05)
+            events.append(f"{name}:end")
+
+    await asyncio.gather(run(worker_a, "a"), run(worker_b, "b"))
+    assert events in (
+        ["a:start", "a:end", "b:start", "b:end"],
+        ["b:start", "b:end", "a:start", "a:end"],
+    )
+
+
+@pytest.mark.asyncio
+async def test_advisory_lock_waits_for_buffered_turns(db_engine, monkeypatch):
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(write_behind, "AsyncSessionLocal", TestingSessionLocal)
+
+    # Worker A con escritura diferida (el turno espera 10 s en su buffer); worker B lee la DB
+    writer_a = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=100)
+    worker_a = ConversationTurns(advisory=True, coalesce=False, writer=writer_a)
+    worker_b = ConversationTurns(advisory=True, coalesce=False)
+    conv = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+
+    async with worker_a.turn(conv.id, "a"):
+        user, bot = MessageTurn(role="user", message="a"), MessageTurn(role="assistant", message="re: a")
+        await writer_a.save(None, conv, True, [user], datetime.now(timezone.utc), bot, [user, bot])
+
+    async with worker_b.turn(conv.id, "b"):
+        async with TestingSessionLocal() as db:
+            history = await load_recent_history(db, conv.id)
+    assert [turn.message for turn in history] == ["a", "re: a"]
+    await writer_a.close()
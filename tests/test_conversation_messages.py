@@ -0,0 +1,84 @@
+# tests/test_conversation_messages.py
+"""
+Tests de la lectura paginada del historial (GET /conversations/{id}/messages).
+
+Objetivo:
+---------
+- Verificar la paginación por keyset: páginas sin huecos ni repetidos, también
+  con mensajes que comparten `created_at` (el orden lo da `seq`).
+- Confirmar el filtro por rol, la exportación NDJSON y los errores 400/404.
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from app.models import Conversation, Message, MessageRole
+
+
+async def seed_conversation(db_session, count: int) -> str:
+    conv = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+    db_session.add(conv)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        role = MessageRole.user if i % 2 == 0 else MessageRole.assistant
+        # De a pares con el mismo created_at: el orden lo da seq
+        db_session.add(Message(
+            conversation_id=conv.id,
+            role=role,
+            content=f"m{i}",
+            seq=i + 1,
+            created_at=start + timedelta(seconds=i // 2),
+        ))
+    await db_session.commit()
+    return str(conv.id)
+
+
+@pytest.mark.asyncio
+async def test_pages_cover_history_in_order(client, db_session):
+    conv_id = await seed_conversation(db_session, 7)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        r = await client.get(f"/conversations/{conv_id}/messages", params=params)
+        assert r.status_code == 200
+        data = r.json()
+        seen += [m["message"] for m in data["messages"]]
+        pages += 1
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert seen == [f"m{i}" for i in range(7)]
+
+
+@pytest.mark.asyncio
+async def test_role_filter_and_ndjson_export(client, db_session):
+    conv_id = await seed_conversation(db_session, 6)
+
+    r = await client.get(f"/conversations/{conv_id}/messages", params={"role": "assistant"})
+    assert [m["message"] for m in r.json()["messages"]] == ["m1", "m3", "m5"]
+    assert all(m["role"] == "assistant" for m in r.json()["messages"])
+
+    r = await client.get(f"/conversations/{conv_id}/messages", params={"format": "ndjson"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [line["message"] for line in lines] == [f"m{i}" for i in range(6)]
+    assert set(lines[0]) == {"id", "role", "message", "created_at"}
+
+
+@pytest.mark.asyncio
+async def test_invalid_requests(client, db_session):
+    conv_id = await seed_conversation(db_session, 1)
+
+    assert (await client.get(f"/conversations/{uuid4()}/messages")).status_code == 404
+    assert (await client.get("/conversations/no-es-uuid/messages")).status_code == 404
+    r = await client.get(f"/conversations/{conv_id}/messages", params={"cursor": "basura"})
+    assert r.status_code == 400
+    r = await client.get(f"/conversations/{conv_id}/messages", params={"limit": 0})
+    assert r.status_code == 422
@@ -0,0 +1,40 @@
+# tests/test_db_pool.py
+"""
+Tests de la configuración del engine y las métricas del pool (app/db.py).
+
+Objetivo:
+---------
+- Verificar que el engine toma pool, pre-ping y echo de la configuración.
+- Confirmar que la caché de prepared statements solo se pasa a asyncpg.
+- Confirmar que las conexiones en uso y la espera de checkout se exponen en /stats.
+"""
+
+import pytest
+from sqlalchemy import text
+
+from app import db
+from app.config import DB_POOL_SIZE, DB_STATEMENT_CACHE_SIZE
+
+
+def test_engine_options_follow_config():
+    options = db.engine_options("postgresql+asyncpg://u:p@h:5432/d")
+    assert options["echo"] is False
+    assert options["pool_size"] == DB_POOL_SIZE
+    assert options["poolclass"] is db.MeteredPool
+    assert options["connect_args"] == {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+
+    assert "connect_args" not in db.engine_options("postgresql+psycopg://u:p@h:5432/d")
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_track_checkouts(client):
+    before = db.pool_stats()["checkouts"]
+
+    async with db.engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        assert db.pool_stats()["in_use"] == 1
+
+    stats = (await client.get("/stats")).json()["db_pool"]
+    assert stats["in_use"] == 0
+    assert stats["checkouts"] > before
+    assert stats["max_wait_ms"] >= stats["avg_wait_ms"] >= 0
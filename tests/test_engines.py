@@ -0,0 +1,111 @@
+# tests/test_engines.py
+"""
+Tests de los motores de LLM intercambiables (app/engines/).
+
+Objetivo:
+---------
+- Verificar que el motor local es determinista y respeta tema y postura del system prompt.
+- Confirmar la salida estructurada (JSON) que usan `open_debate` y `detect_topic_and_stance`.
+- Confirmar que el streaming reproduce la misma respuesta.
+- Validar el registro de motores (alta, default, nombre desconocido).
+- Confirmar que `/chat` funciona de punta a punta con el motor local y guarda su nombre.
+"""
+
+from uuid import UUID
+
+import pytest
+from sqlalchemy import select
+
+from app import engines, llm, main
+from app.engines import LLMEngine, get_engine, register_engine, available_engines
+from app.engines.local import LocalEngine
+from app.models import Conversation
+from app.reply_cache import ReplyCache
+
+
+SYSTEM = (
+    "Eres un chatbot de debate. El ÚNICO tema permitido en esta conversación es: 'gatos vs perros'. "
+    "Tu postura fija e inmutable es: 'los perros son mejores'. "
+)
+
+
+@pytest.mark.asyncio
+async def test_local_engine_is_deterministic():
+    engine = LocalEngine()
+    messages = [{"role": "system", "content": SYSTEM}, {"role": "user", "content": "Los gatos son mejores"}]
+
+    first = await engine.complete(messages, temperature=0.7, max_tokens=300, timeout=5)
+    second = await engine.complete(messages, temperature=0.7, max_tokens=300, timeout=5)
+    assert first == second
+    assert "los perros son mejores" in first
+
+    short = await engine.complete(messages, temperature=0.7, max_tokens=3, timeout=5)
+    assert len(short.split()) == 3
+
+
+@pytest.mark.asyncio
+async def test_local_engine_structured_opening():
+    engine = LocalEngine()
+    prompt = 'Responde SOLO un JSON con "topic", "stance" y "reply".\nEnunciado: "La Tierra es plana"'
+
+    data = await engine.complete_json([{"role": "system", "content": prompt}], temperature=0.7, max_tokens=300, timeout=5)
+    assert data["topic"] == "La Tierra es plana"
+    assert data["stance"] == "No es cierto que la Tierra es plana"
+    assert data["stance"] in data["reply"]
+
+
+@pytest.mark.asyncio
+async def test_local_engine_stream_matches_completion():
+    engine = LocalEngine()
+    messages = [{"role": "system", "content": SYSTEM}, {"role": "user", "content": "Los gatos son mejores"}]
+
+    chunks = [c async for c in engine.stream(messages, temperature=0.7, max_tokens=300, timeout=5)]
+    assert len(chunks) > 1
+    assert "".join(chunks) == await engine.complete(messages, temperature=0.7, max_tokens=300, timeout=5)
+
+
+def test_registry(monkeypatch):
+    monkeypatch.setattr(engines, "_factories", dict(engines._factories))
+    monkeypatch.setattr(engines, "_instances", {})
+
+    assert {"openai", "local"} <= set(available_engines())
+    assert get_engine("local") is get_engine("local")
+
+    class EchoEngine(LLMEngine):
+        name = "echo"
+
+        async def complete(self, messages, **_kwargs):
+            return messages[-1]["content"]
+
+        async def stream(self, messages, **_kwargs):
+            yield messages[-1]["content"]
+
+    register_engine("echo", EchoEngine)
+    assert get_engine("echo").label == "echo"
+
+    with pytest.raises(ValueError):
+        get_engine("no-existe")
+
+
+@pytest.mark.asyncio
+async def test_chat_with_local_engine(client, db_session, monkeypatch):
+    local = LocalEngine()
+    monkeypatch.setattr(llm, "get_engine", lambda: local)
+    monkeypatch.setattr(main, "get_engine", lambda: local)
+    monkeypatch.setattr(llm, "reply_cache", ReplyCache(max_entries=10, ttl=60, use_db=False))
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Los dinosaurios siguen vivos en Marte"})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["engine"] == "local"
+
+    r = await client.post("/chat", json={"conversation_id": data["conversation_id"], "message": "Tengo pruebas"})
+    assert r.status_code == 200
+    reply = r.json()["message"][-1]["message"]
+    assert reply != llm.LLM_FALLBACK_REPLY
+
+    conv = (await db_session.execute(
+        select(Conversation).where(Conversation.id == UUID(data["conversation_id"]))
+    )).scalar_one()
+    assert conv.engine == "local"
+    assert conv.stance in reply
@@ -0,0 +1,147 @@
+# tests/test_history_window.py
+"""
+Tests de la lectura por ventana del historial (`load_recent_history`).
+
+Objetivo:
+---------
+Verificar que la consulta a la DB devuelve solo los últimos N turnos por rol,
+en orden cronológico, sin importar la longitud de la conversación.
+Verificar que el orden lo define `seq` (asignado al guardar) y no el reloj.
+Verificar que el upgrade del esquema deja solo el índice por `seq`.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, text
+
+from app.db import apply_schema_upgrades
+from app.models import Conversation, Message, MessageRole
+from app.repository import load_recent_history, persist_turn
+from app.schemas import MessageTurn
+
+
+@pytest.mark.asyncio
+async def test_recent_history_returns_last_turns_per_role(db_session):
+    """
+    Flujo:
+    -------
+    1. Se inserta una conversación con 40 turnos (20 de usuario, 20 del bot).
+    2. Se pide la ventana 10x10.
+    3. Deben volver exactamente 10 turnos por rol, los más recientes y en orden.
+    """
+    conv = Conversation(id=uuid.uuid4(), topic="t", stance="s", engine="test")
+    db_session.add(conv)
+
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(40):
+        role = MessageRole.user if i % 2 == 0 else MessageRole.assistant
+        db_session.add(Message(
+            conversation_id=conv.id,
+            role=role,
+            content=f"{role.value} {i // 2 + 1}",
+            seq=i + 1,
+            created_at=start + timedelta(seconds=i),
+        ))
+    await db_session.commit()
+
+    window = await load_recent_history(db_session, conv.id, per_role=10)
+
+    assert len(window) == 20
+    assert [t.message for t in window if t.role == "user"] == [f"user {n}" for n in range(11, 21)]
+    assert [t.message for t in window if t.role == "assistant"] == [f"assistant {n}" for n in range(11, 21)]
+    # Orden cronológico intercalado
+    assert window[0].message == "user 11"
+    assert window[-1].message == "assistant 20"
+
+
+@pytest.mark.asyncio
+async def test_recent_history_unknown_conversation_is_empty(db_session):
+    """Una conversación sin mensajes devuelve una ventana vacía."""
+    assert await load_recent_history(db_session, uuid.uuid4()) == []
+
+
+@pytest.mark.asyncio
+async def test_turn_order_follows_seq_not_clock(db_session):
+    """
+    Un turno guardado con un `created_at` anterior (reloj atrasado de otro worker)
+    igual queda después: `seq` se asigna del contador de la conversación.
+    """
+    conv = Conversation(id=uuid.uuid4(), topic="t", stance="s", engine="test")
+    now = datetime.now(timezone.utc)
+
+    def turn(role, text):
+        return MessageTurn(role=role, message=text)
+
+    await persist_turn(db_session, conv, True, [turn("user", "u1")], now, turn("assistant", "a1"))
+    rows = await persist_turn(
+        db_session, conv, False,
+        [turn("user", "u2"), turn("user", "u3")], now - timedelta(minutes=5), turn("assistant", "a2"),
+    )
+    assert [row.seq for row in rows] == [3, 4, 5]
+
+    window = await load_recent_history(db_session, conv.id)
+    assert [t.message for t in window] == ["u1", "a1", "u2", "u3", "a2"]
+    assert (await db_session.execute(
+        select(Conversation.message_seq).where(Conversation.id == conv.id)
+    )).scalar_one() == 5
+
+
+@pytest.mark.asyncio
+async def test_schema_upgrade_backfills_seq(db_session):
+    """
+    En una base previa a `seq` (columna nula), el upgrade numera los mensajes
+    por `created_at` y deja la columna NOT NULL.
+    """
+    conv = Conversation(id=uuid.uuid4(), topic="t", stance="s", engine="test")
+    db_session.add(conv)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(4):
+        db_session.add(Message(
+            conversation_id=conv.id, role=MessageRole.user, content=f"m{i}",
+            seq=10 - i, created_at=start + timedelta(seconds=i),
+        ))
+    await db_session.commit()
+
+    await db_session.execute(text("ALTER TABLE messages ALTER COLUMN seq DROP NOT NULL"))
+    await db_session.execute(text("UPDATE messages SET seq = NULL"))
+    await db_session.commit()
+
+    connection = await db_session.connection()
+    await apply_schema_upgrades(connection)
+    await db_session.commit()
+
+    seqs = (await db_session.execute(
+        select(Message.content, Message.seq).where(Message.conversation_id == conv.id).order_by(Message.seq)
+    )).all()
+    assert [tuple(row) for row in seqs] == [("m0", 1), ("m1", 2), ("m2", 3), ("m3", 4)]
+    assert (await db_session.execute(
+        select(Conversation.message_seq).where(Conversation.id == conv.id)
+    )).scalar_one() == 4
+    nullable = (await db_session.execute(text(
+        "SELECT is_nullable FROM information_schema.columns WHERE table_name = 'messages' AND column_name = 'seq'"
+    ))).scalar_one()
+    assert nullable == "NO"
+
+
+@pytest.mark.asyncio
+async def test_schema_upgrade_replaces_created_at_index(db_session):
+    """
+    En una base que tenía el índice por (conversation_id, created_at), el
+    upgrade crea el índice por `seq` y borra el anterior.
+    """
+    await db_session.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_created_at ON messages (conversation_id, created_at)"
+    ))
+    await db_session.commit()
+
+    connection = await db_session.connection()
+    await apply_schema_upgrades(connection)
+    await db_session.commit()
+
+    indexes = (await db_session.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'messages'"
+    ))).scalars().all()
+    assert "idx_messages_conversation_seq" in indexes
+    assert "idx_messages_conversation_created_at" not in indexes
@@ -0,0 +1,85 @@
+# tests/test_metrics.py
+"""
+Tests de la instrumentación por etapa y del endpoint /metrics (app/metrics.py).
+
+Objetivo:
+---------
+- Verificar histogramas y contadores en formato de texto de Prometheus.
+- Confirmar que `/chat` expone sus etapas en el header `Server-Timing`.
+- Confirmar que fallbacks y timeouts del LLM se cuentan por tipo de llamada.
+"""
+
+import asyncio
+
+import pytest
+
+from app import main
+from app.llm import record_llm_error
+from app.metrics import Counter, Histogram, LLM_FALLBACKS, LLM_TIMEOUTS, render, server_timing
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("t_seconds", "ayuda", buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5.0, stage="a")
+
+    lines = histogram.lines()
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{stage="a",le="1.0"} 2' in lines
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 't_seconds_count{stage="a"} 3' in lines
+    assert histogram.count(stage="a") == 3
+
+
+def test_counter_and_extra_samples_render():
+    counter = Counter("t_total", "ayuda")
+    counter.inc(call="x")
+    counter.inc(call="x")
+    assert counter.lines()[-1] == 't_total{call="x"} 2'
+
+    body = render([("t_gauge", "gauge", "ayuda", {"state": 'en "uso"'}, 3)])
+    assert "# TYPE t_gauge gauge" in body
+    assert 't_gauge{state="en \\"uso\\""} 3' in body
+
+
+def test_server_timing_header_format():
+    assert server_timing({"history": 0.0021, "llm": 1.5}, total=1.51) == (
+        "history;dur=2.10, llm;dur=1500.00, total;dur=1510.00"
+    )
+
+
+def test_llm_errors_are_counted_by_call():
+    fallbacks, timeouts = LLM_FALLBACKS.value(call="t"), LLM_TIMEOUTS.value(call="t")
+    record_llm_error("t", asyncio.TimeoutError())
+    record_llm_error("t", ValueError("json"))
+    assert LLM_FALLBACKS.value(call="t") == fallbacks + 2
+    assert LLM_TIMEOUTS.value(call="t") == timeouts + 1
+
+
+@pytest.mark.asyncio
+async def test_chat_reports_stage_timings(client, monkeypatch):
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    async def fake_llm(history, system_prompt=None):
+        return "réplica"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Hola, ¿debatimos?"})
+    assert r.status_code == 200
+    timing = r.headers["server-timing"]
+    for name in ("opening", "history", "persist", "trim", "total"):
+        assert f"{name};dur=" in timing
+
+    body = (await client.get("/metrics")).text
+    assert 'kopi_stage_duration_seconds_count{stage="persist"}' in body
+    assert 'kopi_request_duration_seconds_count{route="/chat",status="200"}' in body
+    assert 'kopi_cache_hits_total{cache="conversation"}' in body
+    assert 'kopi_db_pool_connections{state="in_use"}' in body
@@ -0,0 +1,117 @@
+# tests/test_reply_cache.py
+"""
+Tests de la caché de respuestas del LLM (app/reply_cache.py).
+
+Objetivo:
+---------
+- Verificar que la clave depende del prompt completo y los parámetros del modelo.
+- Confirmar eviction LRU, opt-out por clave (acotado) y por llamada.
+- Confirmar que `ask_llm` no llama al modelo ante un prompt repetido.
+- Confirmar el nivel persistente en Postgres (compartido entre procesos) y su TTL.
+"""
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import llm, reply_cache as reply_cache_module
+from app.engines import LLMEngine
+from app.reply_cache import ReplyCache, make_key
+from app.schemas import MessageTurn
+
+
+MESSAGES = [{"role": "system", "content": "s"}, {"role": "user", "content": "hola"}]
+
+
+class FakeEngine(LLMEngine):
+    name = "fake"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, messages, **_kwargs):
+        self.calls += 1
+        return f" respuesta {self.calls} "
+
+    async def stream(self, messages, **_kwargs):
+        yield await self.complete(messages)
+
+
+def test_key_depends_on_prompt_and_parameters():
+    key = make_key("m", MESSAGES, 0.7, 300)
+    assert key == make_key("m", [dict(m) for m in MESSAGES], 0.7, 300)
+    assert key != make_key("otro", MESSAGES, 0.7, 300)
+    assert key != make_key("m", MESSAGES, 0.2, 300)
+    assert key != make_key("m", MESSAGES, 0.7, 100)
+    assert key != make_key("m", MESSAGES[:1], 0.7, 300)
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_evicts_and_respects_opt_out():
+    cache = ReplyCache(max_entries=2, ttl=60, use_db=False)
+    await cache.put("a", "m", "ra")
+    await cache.put("b", "m", "rb")
+    assert await cache.get("a") == "ra"  # `a` pasa a ser la más reciente
+    await cache.put("c", "m", "rc")
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == "ra"
+
+    cache.exclude("a")
+    assert await cache.get("a") is None
+    await cache.put("a", "m", "ra")
+    assert await cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 2
+    assert stats["excluded_keys"] == 1
+
+    # Las claves excluidas se acotan como el nivel en memoria: la más vieja sale
+    for key in ("x", "y"):
+        cache.exclude(key)
+    assert cache.stats()["excluded_keys"] == 2
+    assert cache.is_cacheable("a")
+    assert not cache.is_cacheable("y")
+
+
+@pytest.mark.asyncio
+async def test_ask_llm_serves_repeated_prompt_from_cache(monkeypatch):
+    fake_engine = FakeEngine()
+    monkeypatch.setattr(llm, "get_engine", lambda: fake_engine)
+    monkeypatch.setattr(llm, "reply_cache", ReplyCache(max_entries=10, ttl=60, use_db=False))
+
+    history = [MessageTurn(role="user", message="La Tierra es plana")]
+    first = await llm.ask_llm(history, system_prompt="debate")
+    second = await llm.ask_llm(history, system_prompt="debate")
+    assert first == second == "respuesta 1"
+    assert fake_engine.calls == 1
+
+    # Otro system prompt u opt-out por llamada: se vuelve a llamar al modelo
+    assert await llm.ask_llm(history, system_prompt="otro debate") == "respuesta 2"
+    assert await llm.ask_llm(history, system_prompt="debate", use_cache=False) == "respuesta 3"
+    assert fake_engine.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_db_tier_is_shared_and_expires(db_engine, monkeypatch):
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(reply_cache_module, "AsyncSessionLocal", TestingSessionLocal)
+
+    writer = ReplyCache(max_entries=10, ttl=60, use_db=True)
+    await writer.put("k", "m", "respuesta persistida")
+    await writer.flush()  # la escritura en Postgres va en segundo plano
+
+    # Otro proceso (caché en memoria vacía) la encuentra en Postgres
+    reader = ReplyCache(max_entries=10, ttl=60, use_db=True)
+    assert await reader.get("k") == "respuesta persistida"
+    assert await reader.get("k") == "respuesta persistida"
+    assert reader.stats()["db_hits"] == 1
+    assert reader.stats()["memory_hits"] == 1
+
+    # TTL vencido: no se sirve y la purga la elimina
+    expired = ReplyCache(max_entries=10, ttl=-1, use_db=True)
+    await expired.put("viejo", "m", "respuesta vencida")
+    await expired.flush()
+    assert await ReplyCache(max_entries=10, ttl=60, use_db=True).get("viejo") is None
+    assert await expired.purge_expired() == 1
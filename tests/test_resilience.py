@@ -0,0 +1,250 @@
+# tests/test_resilience.py
+"""
+Tests de la capa de resiliencia del LLM (app/resilience.py).
+
+Objetivo:
+---------
+- Verificar que el timeout adaptativo sigue al p99 observado dentro de sus límites,
+  y que crece (y el circuito se recupera) si la latencia sube por encima de él.
+- Confirmar que el circuit breaker se abre con errores transitorios, rechaza al
+  instante y se cierra tras una prueba exitosa.
+- Confirmar reintentos solo ante errores transitorios.
+- Confirmar que el hedging usa la llamada duplicada si la primera se demora.
+- Confirmar que `ask_llm` responde el fallback sin esperar con el circuito abierto.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app import llm
+from app.engines import LLMEngine
+from app.reply_cache import ReplyCache
+from app.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, LLMGuard
+from app.schemas import MessageTurn
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_guard(**kwargs) -> LLMGuard:
+    options = dict(max_timeout=5.0, min_timeout=0.05, multiplier=2.0, adaptive=True,
+                   hedge=False, retries=0, backoff=0.0, backoff_max=0.0)
+    options.update(kwargs)
+    return LLMGuard("test", **options)
+
+
+def test_latency_tracker_percentiles():
+    tracker = LatencyTracker(window=100, min_samples=5)
+    for value in range(1, 5):
+        tracker.observe(value)
+    assert tracker.percentile(99) is None
+
+    for value in range(5, 101):
+        tracker.observe(value)
+    assert tracker.percentile(50) == 50
+    assert tracker.percentile(95) == 95
+    assert tracker.percentile(99) == 99
+
+
+def test_adaptive_timeout_is_clamped():
+    guard = make_guard()
+    assert guard.timeout_for("reply") == 5.0  # sin muestras: LLM_TIMEOUT
+
+    tracker = guard._tracker("reply")
+    tracker.min_samples = 3
+    for _ in range(3):
+        tracker.observe(0.5)
+    assert guard.timeout_for("reply") == 1.0  # p99 × 2
+
+    tracker._samples.clear()
+    for _ in range(3):
+        tracker.observe(0.001)
+    assert guard.timeout_for("reply") == 0.05  # piso
+
+    for _ in range(3):
+        tracker.observe(10.0)
+    assert guard.timeout_for("reply") == 5.0  # techo
+
+
+def test_circuit_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5, cooldown=10, enabled=True, clock=clock)
+
+    for healthy in (True, True, False):
+        breaker.record(healthy)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow()          # prueba en half_open
+    assert not breaker.allow()      # una sola prueba a la vez
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["opened"] == 2
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_rejects_without_calling():
+    breaker = CircuitBreaker(window=2, min_calls=2, error_rate=0.5, cooldown=60, enabled=True)
+    guard = make_guard(breaker=breaker)
+    calls = 0
+
+    async def failing(_timeout):
+        nonlocal calls
+        calls += 1
+        raise asyncio.TimeoutError()
+
+    for _ in range(2):
+        with pytest.raises(asyncio.TimeoutError):
+            await guard.run("reply", failing)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        await guard.run("reply", failing)
+    assert calls == 2
+    assert guard.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_retries_only_transient_errors():
+    guard = make_guard(retries=2)
+    attempts = 0
+
+    async def flaky(_timeout):
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise asyncio.TimeoutError()
+        return "ok"
+
+    assert await guard.run("reply", flaky) == "ok"
+    assert attempts == 3
+    assert guard.retried == 2
+
+    async def bad_request(_timeout):
+        nonlocal attempts
+        attempts += 1
+        raise ValueError("400")
+
+    guard, attempts = make_guard(retries=2), 0
+    with pytest.raises(ValueError):
+        await guard.run("reply", bad_request)
+    assert attempts == 1
+    assert guard.breaker.stats()["error_rate"] == 0.0  # no cuenta como falla del proveedor
+
+
+@pytest.mark.asyncio
+async def test_adaptive_timeout_cuts_slow_calls():
+    guard = make_guard()
+    tracker = guard._tracker("reply")
+    tracker.min_samples = 1
+    tracker.observe(0.05)  # timeout = 0.1s
+
+    async def hanging(timeout):
+        await asyncio.sleep(10)
+
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        await guard.run("reply", hanging)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.asyncio
+async def test_adaptive_timeout_grows_when_latency_steps_up():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=2, min_calls=2, error_rate=0.5, cooldown=10, enabled=True, clock=clock)
+    guard = make_guard(breaker=breaker)
+    tracker = guard._tracker("reply")
+    tracker.min_samples = 1
+    for _ in range(10):
+        tracker.observe(0.05)  # timeout = 0.1s
+
+    # El proveedor pasa a tardar 0.3s: más que el timeout adaptativo actual
+    async def provider(_timeout):
+        await asyncio.sleep(0.3)
+        return "ok"
+
+    for expected in (0.1, 0.2):
+        assert guard.timeout_for("reply") == pytest.approx(expected)
+        with pytest.raises(asyncio.TimeoutError):
+            await guard.run("reply", provider)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # La prueba del circuito ya usa el timeout crecido y lo cierra
+    clock.now = 10
+    assert guard.timeout_for("reply") == pytest.approx(0.4)
+    assert await guard.run("reply", provider) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert await guard.run("reply", provider) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_when_primary_is_slow():
+    guard = make_guard(hedge=True, hedge_min_delay=0.02)
+    tracker = guard._tracker("reply")
+    tracker.min_samples = 1
+    tracker.observe(0.02)
+    calls = 0
+
+    async def attempt(_timeout):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(5)
+            return "lenta"
+        return "rápida"
+
+    start = time.perf_counter()
+    assert await guard.run("reply", attempt) == "rápida"
+    assert time.perf_counter() - start < 1
+    assert (guard.hedged, guard.hedge_wins) == (1, 1)
+
+
+class DownEngine(LLMEngine):
+    name = "down"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, messages, **_kwargs):
+        self.calls += 1
+        raise asyncio.TimeoutError()
+
+    async def stream(self, messages, **_kwargs):
+        self.calls += 1
+        raise asyncio.TimeoutError()
+        yield ""
+
+
+@pytest.mark.asyncio
+async def test_ask_llm_falls_back_immediately_when_circuit_is_open(monkeypatch):
+    engine = DownEngine()
+    guard = make_guard(breaker=CircuitBreaker(window=2, min_calls=2, error_rate=0.5, cooldown=60, enabled=True))
+    monkeypatch.setattr(llm, "get_engine", lambda: engine)
+    monkeypatch.setattr(llm, "get_guard", lambda _name: guard)
+    monkeypatch.setattr(llm, "reply_cache", ReplyCache(max_entries=10, ttl=60, use_db=False))
+    history = [MessageTurn(role="user", message="hola")]
+
+    for _ in range(2):
+        assert await llm.ask_llm(history) == llm.LLM_FALLBACK_REPLY
+    assert engine.calls == 2
+
+    start = time.perf_counter()
+    assert await llm.ask_llm(history) == llm.LLM_FALLBACK_REPLY
+    assert [chunk async for chunk in llm.stream_llm(history)] == [llm.LLM_FALLBACK_REPLY]
+    assert time.perf_counter() - start < 0.1
+    assert engine.calls == 2
@@ -0,0 +1,83 @@
+# tests/test_responses.py
+"""
+Tests del camino rápido de serialización (app/responses.py).
+
+Objetivo:
+---------
+- Verificar que el JSON de `/chat` y de la página del historial es idéntico
+  byte a byte al que producía Pydantic + `json` (mismo formato en el cable).
+- Confirmar que /chat responde con el cuerpo esperado sin `response_model` de por medio.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.responses import JSONResponse
+
+from app import main
+from app.models import MessageRole
+from app.responses import FastJSONResponse, chat_payload, stored_message_payload
+from app.schemas import ChatResponse, MessagePage, MessageTurn, StoredMessage
+
+Row = namedtuple("Row", "id seq role content created_at")
+
+
+def reference_body(model) -> bytes:
+    # Camino anterior: validación de `response_model` + JSONResponse de Starlette
+    return JSONResponse(model.model_dump(mode="json")).body
+
+
+def test_chat_payload_matches_pydantic():
+    turns = [
+        MessageTurn(role="user", message="¿Por qué \"sí\"?\n</script>  ", tokens=7),
+        MessageTurn.model_construct(role="assistant", message="Porque 😀", tokens=3),
+    ]
+    expected = reference_body(ChatResponse(conversation_id="c-1", message=turns, engine="local"))
+
+    assert FastJSONResponse(chat_payload("c-1", turns, "local")).body == expected
+
+
+def test_history_page_matches_pydantic():
+    rows = [
+        Row(1, 1, MessageRole.user, "hola", datetime(2024, 1, 1, tzinfo=timezone.utc)),
+        Row(2, 2, MessageRole.assistant, "chau", datetime(2024, 1, 1, 0, 0, 1, 250, tzinfo=timezone.utc)),
+        Row(3, 3, MessageRole.user, "ñ", datetime(2024, 1, 1, tzinfo=timezone(timedelta(hours=-3)))),
+    ]
+    page = MessagePage(
+        conversation_id="c-1",
+        messages=[
+            StoredMessage(id=r.id, role=r.role.value, message=r.content, created_at=r.created_at) for r in rows
+        ],
+        next_cursor=None,
+    )
+    body = FastJSONResponse({
+        "conversation_id": "c-1",
+        "messages": [stored_message_payload(row) for row in rows],
+        "next_cursor": None,
+    }).body
+
+    assert body == reference_body(page)
+
+
+@pytest.mark.asyncio
+async def test_chat_response_body(client, monkeypatch):
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    async def fake_llm(history, **_kwargs):
+        return "réplica"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Hola"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/json"
+    data = r.json()
+    assert list(data) == ["conversation_id", "message", "engine"]
+    assert data["message"] == [{"role": "user", "message": "Hola"}, {"role": "assistant", "message": "réplica"}]
@@ -0,0 +1,199 @@
+# tests/test_retention.py
+"""
+Tests del particionado de `messages` y la tarea de retención (app/retention.py).
+
+Objetivo:
+---------
+- Verificar que la conversión a tabla particionada es idempotente, conserva
+  los mensajes previos y que los turnos nuevos caen en la partición del día.
+- Confirmar la creación anticipada de particiones y el retiro de las viejas
+  (borradas o separadas para archivar).
+- Confirmar que las filas que cayeron en `messages_default` (tarea atrasada)
+  pasan a su partición al crearla.
+- Confirmar el borrado por lotes de conversaciones vencidas y la corrida
+  completa de `RetentionJob`.
+"""
+
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import retention
+from app.metrics import PARTITION_ERRORS, PARTITION_ROWS_MOVED
+from app.db import apply_schema_upgrades
+from app.models import Conversation, Message, MessageRole
+from app.repository import load_recent_history, persist_turn
+from app.retention import (
+    RetentionJob,
+    delete_expired_conversations,
+    drop_expired_partitions,
+    ensure_partitions,
+    is_partitioned,
+    list_partitions,
+    partition_messages,
+    partition_name,
+)
+from app.schemas import MessageTurn
+
+
+async def seed_conversation(db_session, created_at: datetime, count: int = 2) -> Conversation:
+    conv = Conversation(
+        id=uuid4(), topic="t", stance="s", engine="local",
+        created_at=created_at, updated_at=created_at, message_seq=count,
+    )
+    db_session.add(conv)
+    for i in range(count):
+        db_session.add(Message(
+            conversation_id=conv.id,
+            role=MessageRole.user if i % 2 == 0 else MessageRole.assistant,
+            content=f"m{i}",
+            seq=i + 1,
+            created_at=created_at + timedelta(seconds=i),
+        ))
+    await db_session.commit()
+    return conv
+
+
+async def count_messages(db_engine) -> int:
+    async with db_engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(Message))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_partitioning_keeps_history_and_routes_new_turns(db_engine, db_session):
+    now = datetime.now(timezone.utc)
+    conv = await seed_conversation(db_session, now - timedelta(days=3))
+
+    async with db_engine.begin() as conn:
+        await partition_messages(conn)
+        await partition_messages(conn)
+        await apply_schema_upgrades(conn)
+        assert await is_partitioned(conn)
+        names = [name for name, _ in await list_partitions(conn)]
+    assert names == ["messages_legacy", partition_name(now.date()), "messages_default"]
+
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with TestingSessionLocal() as db:
+        await persist_turn(
+            db, conv, False,
+            [MessageTurn(role="user", message="m2")], datetime.now(timezone.utc),
+            MessageTurn(role="assistant", message="m3"),
+        )
+        history = await load_recent_history(db, conv.id)
+    assert [turn.message for turn in history] == ["m0", "m1", "m2", "m3"]
+
+    async with db_engine.connect() as conn:
+        rows = await conn.execute(text("SELECT tableoid::regclass::text, seq FROM messages ORDER BY seq"))
+        placement = [tuple(row) for row in rows]
+    assert placement == [
+        ("messages_legacy", 1), ("messages_legacy", 2),
+        (partition_name(now.date()), 3), (partition_name(now.date()), 4),
+    ]
+
+    async with db_engine.connect() as conn:
+        created = await ensure_partitions(conn, days_ahead=2, now=now)
+        assert await ensure_partitions(conn, days_ahead=2, now=now) == []
+    assert created == [partition_name((now + timedelta(days=d)).date()) for d in (1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_rows_in_default_partition_move_to_new_partition(db_engine, db_session):
+    now = datetime.now(timezone.utc)
+    async with db_engine.begin() as conn:
+        await partition_messages(conn)
+
+    # Sin particiones creadas por adelantado: los mensajes de pasado mañana caen en la DEFAULT
+    ahead = await seed_conversation(db_session, now + timedelta(days=2))
+    moved_before = PARTITION_ROWS_MOVED.value()
+    errors_before = PARTITION_ERRORS.value(action="create")
+
+    async with db_engine.connect() as conn:
+        created = await ensure_partitions(conn, days_ahead=3, now=now)
+        rows = await conn.execute(text("SELECT tableoid::regclass::text FROM messages ORDER BY seq"))
+        placement = [row[0] for row in rows]
+        default_rows = (await conn.execute(text("SELECT count(*) FROM messages_default"))).scalar()
+    assert created == [partition_name((now + timedelta(days=d)).date()) for d in (1, 2, 3)]
+    assert placement == [partition_name((now + timedelta(days=2)).date())] * 2
+    assert default_rows == 0
+    assert PARTITION_ROWS_MOVED.value() - moved_before == 2
+    assert PARTITION_ERRORS.value(action="create") == errors_before
+
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    async with TestingSessionLocal() as db:
+        history = await load_recent_history(db, ahead.id)
+    assert [turn.message for turn in history] == ["m0", "m1"]
+
+
+@pytest.mark.asyncio
+async def test_expired_partitions_are_dropped_or_kept_detached(db_engine, db_session):
+    now = datetime.now(timezone.utc)
+    await seed_conversation(db_session, now - timedelta(days=3))
+
+    async with db_engine.connect() as conn:
+        await partition_messages(conn)
+        await conn.commit()
+        await ensure_partitions(conn, days_ahead=1, now=now)
+
+        # Sin nada vencido no se toca ninguna partición
+        assert await drop_expired_partitions(conn, now - timedelta(days=1)) == []
+
+        removed = await drop_expired_partitions(conn, now + timedelta(seconds=1), keep_detached=True)
+        assert removed == ["messages_legacy"]
+        detached = (await conn.execute(text("SELECT count(*) FROM messages_legacy"))).scalar()
+        assert detached == 2
+        await conn.execute(text("DROP TABLE messages_legacy"))
+        await conn.commit()
+
+        tomorrow = now + timedelta(days=1)
+        cutoff = datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=timezone.utc)
+        assert await drop_expired_partitions(conn, cutoff) == [partition_name(now.date())]
+        names = [name for name, _ in await list_partitions(conn)]
+    assert names == [partition_name(tomorrow.date()), "messages_default"]
+    assert await count_messages(db_engine) == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_conversations_are_deleted_in_batches(db_engine, db_session):
+    now = datetime.now(timezone.utc)
+    for _ in range(5):
+        await seed_conversation(db_session, now - timedelta(days=10))
+    recent = await seed_conversation(db_session, now - timedelta(hours=1))
+
+    async with db_engine.connect() as conn:
+        deleted = await delete_expired_conversations(conn, now - timedelta(days=7), batch_size=2, pause=0)
+    assert deleted == 5
+
+    async with db_engine.connect() as conn:
+        remaining = (await conn.execute(select(Conversation.id))).scalars().all()
+    assert remaining == [recent.id]
+    assert await count_messages(db_engine) == 2
+
+
+@pytest.mark.asyncio
+async def test_retention_job_run(db_engine, db_session, monkeypatch):
+    monkeypatch.setattr(retention, "engine", db_engine)
+    now = datetime.now(timezone.utc)
+    await seed_conversation(db_session, now - timedelta(days=40))
+    await seed_conversation(db_session, now)
+
+    async with db_engine.begin() as conn:
+        await partition_messages(conn)
+
+    job = RetentionJob(enabled=True, premake_days=1, retention_days=30, ttl_days=30)
+    summary = await job.run_once(now + timedelta(days=31))
+
+    assert summary["created"] == [partition_name((now + timedelta(days=d)).date()) for d in (31, 32)]
+    assert summary["removed"] == ["messages_legacy", partition_name(now.date())]
+    assert summary["deleted"] == 2
+    assert job.stats()["runs"] == 1
+
+    # Otro worker con la tarea en curso: la corrida se saltea
+    async with db_engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": retention._LOCK_KEY})
+        assert await job.run_once() == {"created": [], "archived": 0, "removed": [], "deleted": 0}
+        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": retention._LOCK_KEY})
+    assert job.stats()["skipped_runs"] == 1
@@ -0,0 +1,82 @@
+# tests/test_summarizer.py
+"""
+Tests de la compactación en segundo plano de debates largos (app/summarizer.py).
+
+Objetivo:
+---------
+- Verificar que solo se resumen los turnos que salieron de la ventana reciente.
+- Confirmar que el resumen se guarda en `conversations` y se usa en el system prompt.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app import summarizer
+from app.main import build_system_prompt
+from app.models import Conversation, Message, MessageRole
+
+
+def test_should_summarize_respects_threshold(monkeypatch):
+    monkeypatch.setattr(summarizer, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(summarizer, "SUMMARY_MIN_TURNS", 15)
+    monkeypatch.setattr(summarizer, "SUMMARY_EVERY_TURNS", 5)
+
+    assert not summarizer.should_summarize(10)
+    assert summarizer.should_summarize(15)
+    assert not summarizer.should_summarize(17)
+    assert summarizer.should_summarize(20)
+
+
+def test_system_prompt_includes_summary():
+    prompt = build_system_prompt("pizza con piña", "la piña no va en la pizza", "El usuario defendió el dulzor.")
+    assert prompt.endswith("El usuario defendió el dulzor.")
+    assert "Resumen" not in build_system_prompt("pizza con piña", "la piña no va en la pizza")
+
+
+@pytest.mark.asyncio
+async def test_summarize_conversation_compacts_old_turns(db_session, monkeypatch):
+    """
+    Flujo:
+    -------
+    1. Se crea una conversación con 20 turnos por rol (40 mensajes).
+    2. Se ejecuta la compactación con ventana 10x10.
+    3. Solo los 20 mensajes más antiguos deben llegar al resumen.
+    4. Una segunda corrida sin mensajes nuevos no hace nada.
+    """
+    seen = []
+
+    async def fake_summarize(previous, turns):
+        seen.append((previous, [t.message for t in turns]))
+        return f"resumen de {len(turns)} turnos"
+
+    monkeypatch.setattr(summarizer, "summarize_turns", fake_summarize)
+
+    conv = Conversation(id=uuid.uuid4(), topic="t", stance="s", engine="test")
+    db_session.add(conv)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(40):
+        role = MessageRole.user if i % 2 == 0 else MessageRole.assistant
+        db_session.add(Message(
+            conversation_id=conv.id, role=role, content=f"m{i}", seq=i + 1,
+            created_at=start + timedelta(seconds=i),
+        ))
+    await db_session.commit()
+
+    summary = await summarizer.summarize_conversation(conv.id, per_role=10)
+    assert summary == "resumen de 20 turnos"
+    assert seen == [(None, [f"m{i}" for i in range(20)])]
+
+    stored = (await db_session.execute(
+        select(Conversation.summary, Conversation.summary_message_id, Message.content)
+        .join(Message, Message.id == Conversation.summary_message_id)
+        .where(Conversation.id == conv.id)
+    )).one()
+    assert stored.summary == "resumen de 20 turnos"
+    assert stored.content == "m19"
+
+    # Sin turnos nuevos fuera de la ventana: nada que resumir
+    assert await summarizer.summarize_conversation(conv.id, per_role=10) is None
+    assert len(seen) == 1
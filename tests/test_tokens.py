@@ -0,0 +1,72 @@
+# tests/test_tokens.py
+"""
+Tests del presupuesto de contexto por tokens (app/utils/tokens.py).
+
+Objetivo:
+---------
+- Verificar que el historial enviado al LLM respeta el presupuesto de tokens.
+- Confirmar que el conteo de tokens se guarda una sola vez en `messages.token_count`.
+"""
+
+from uuid import UUID
+
+import pytest
+from sqlalchemy import select
+
+from app.llm import build_messages
+from app.models import Message
+from app.schemas import MessageTurn
+from app.utils.tokens import count_tokens, fit_to_budget, turn_tokens
+
+
+def test_count_tokens_grows_with_text():
+    assert count_tokens("") == 0
+    assert count_tokens("hola") == 1
+    assert count_tokens("hola, mundo") == 4
+    assert count_tokens("palabra " * 100) > count_tokens("palabra " * 10)
+
+
+def test_fit_to_budget_keeps_newest_turns():
+    history = [MessageTurn(role="user", message=f"turno {i}", tokens=10) for i in range(10)]
+    cost = turn_tokens(history[0])
+
+    selected = fit_to_budget(history, budget=cost * 3)
+    assert [t.message for t in selected] == ["turno 7", "turno 8", "turno 9"]
+
+
+def test_fit_to_budget_always_keeps_last_turn():
+    """Un muro de texto en el último turno no deja el prompt sin mensaje del usuario."""
+    history = [
+        MessageTurn(role="user", message="corto", tokens=1),
+        MessageTurn(role="assistant", message="corto", tokens=1),
+        MessageTurn(role="user", message="x" * 40000, tokens=10000),
+    ]
+    selected = fit_to_budget(history, budget=100)
+    assert len(selected) == 1
+    assert selected[0].tokens == 10000
+
+
+def test_build_messages_drops_old_turns_over_budget():
+    """Un turno antiguo enorme queda fuera del prompt; los recientes se conservan."""
+    history = [
+        MessageTurn(role="user", message="muro", tokens=50000),
+        MessageTurn(role="assistant", message="respuesta"),
+        MessageTurn(role="user", message="último mensaje"),
+    ]
+    messages = build_messages(history, system_prompt="Debate")
+    assert [m["content"] for m in messages] == ["Debate", "respuesta", "último mensaje"]
+
+
+@pytest.mark.asyncio
+async def test_chat_persists_token_count(client, db_session):
+    """Cada mensaje guardado por `/chat` lleva su `token_count`."""
+    r = await client.post("/chat", json={"conversation_id": None, "message": "Los gatos son mejores que los perros"})
+    assert r.status_code == 200
+    conv_id = UUID(r.json()["conversation_id"])
+
+    rows = (await db_session.execute(
+        select(Message.content, Message.token_count).where(Message.conversation_id == conv_id)
+    )).all()
+    assert len(rows) == 2
+    for content, token_count in rows:
+        assert token_count == count_tokens(content)
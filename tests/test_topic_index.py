@@ -0,0 +1,97 @@
+# tests/test_topic_index.py
+"""
+Tests del índice de aperturas (app/topic_index.py).
+
+Objetivo:
+---------
+- Verificar que aperturas casi idénticas reutilizan tema y postura, y que
+  invertir la afirmación o negarla no se confunde con la original.
+- Confirmar el reemplazo de las entradas más antiguas al llegar al tope.
+- Confirmar que `/chat` omite la detección por LLM cuando hay coincidencia.
+"""
+
+from uuid import UUID
+
+import pytest
+from sqlalchemy import select
+
+from app import main
+from app.models import Conversation
+from app.topic_index import TopicIndex, normalize, topic_index
+
+
+def test_normalize_strips_case_accents_and_punctuation():
+    assert normalize("  ¡La TIERRA es   plána!! ") == "la tierra es plana"
+    assert normalize("El niño") == "el niño"
+
+
+def test_lookup_reuses_near_duplicates_only():
+    index = TopicIndex(threshold=0.85, max_entries=10, dim=512)
+    index.add("Los perros son mejores que los gatos", "perros vs gatos", "los gatos son mejores")
+    index.add("La Tierra es plana", "forma de la Tierra", "la Tierra es redonda")
+
+    topic, stance, score = index.lookup("los perros son mejores que los gatos!")
+    assert (topic, stance) == ("perros vs gatos", "los gatos son mejores")
+    assert score == pytest.approx(1.0)
+    assert index.lookup("la tierra es plana")[0] == "forma de la Tierra"
+
+    assert index.lookup("los gatos son mejores que los perros") is None
+    assert index.lookup("los perros no son mejores que los gatos") is None
+    assert index.lookup("la tierra no es plana") is None
+
+    stats = index.stats()
+    assert stats["entries"] == 2
+    assert stats["lookups"] >= 5
+    assert 0 < stats["hit_rate"] < 1
+
+
+def test_index_skips_fallback_topic_and_replaces_oldest():
+    index = TopicIndex(threshold=0.85, max_entries=2, dim=512)
+    index.add("hola", "general", "postura neutral")
+    assert len(index) == 0
+
+    index.add("la tierra es plana", "tierra", "redonda")
+    index.add("el café es malo", "café", "el café es bueno")
+    index.add("los perros son mejores que los gatos", "mascotas", "gatos")
+
+    assert len(index) == 2
+    assert index.lookup("la tierra es plana") is None
+    assert index.lookup("los perros son mejores que los gatos")[0] == "mascotas"
+
+
+def test_disabled_index_never_matches():
+    index = TopicIndex(threshold=0.85, max_entries=0, dim=512)
+    index.add("la tierra es plana", "tierra", "redonda")
+    assert index.lookup("la tierra es plana") is None
+
+
+@pytest.mark.asyncio
+async def test_chat_reuses_indexed_topic_and_stance(client, db_session, monkeypatch):
+    topic_index.clear()
+    topic_index.add("La Tierra es plana", "forma de la Tierra", "la Tierra es redonda")
+
+    async def fail_open_debate(_message):
+        raise AssertionError("open_debate no debe llamarse si la apertura está indexada")
+
+    async def fake_llm(history, system_prompt=None):
+        assert "la Tierra es redonda" in system_prompt
+        return "La Tierra es un esferoide."
+
+    monkeypatch.setattr(main, "open_debate", fail_open_debate)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    try:
+        r = await client.post("/chat", json={"conversation_id": None, "message": "la tierra es plana!"})
+        assert r.status_code == 200
+        data = r.json()
+        assert data["message"][-1]["message"] == "La Tierra es un esferoide."
+
+        conv = (await db_session.execute(
+            select(Conversation).where(Conversation.id == UUID(data["conversation_id"]))
+        )).scalar_one()
+        assert (conv.topic, conv.stance) == ("forma de la Tierra", "la Tierra es redonda")
+
+        stats = (await client.get("/stats")).json()["topic_index"]
+        assert stats["hits"] >= 1
+    finally:
+        topic_index.clear()
@@ -0,0 +1,62 @@
+# tests/test_trimming.py
+"""
+Tests unitarios del motor de trimming (app/utils/trimming.py).
+
+Objetivo:
+---------
+- Confirmar la semántica 10x10 (LLM) y 5x5 (API) en orden cronológico.
+- Verificar que mensajes repetidos no generan copias extra.
+- Verificar que el motor funciona sobre un iterador inverso sin materializarlo.
+"""
+
+from app.schemas import MessageTurn
+from app.utils.trimming import select_recent, trim_for_response, trim_history
+
+
+def conversation(n_turns: int) -> list[MessageTurn]:
+    history = []
+    for i in range(1, n_turns + 1):
+        history.append(MessageTurn(role="user", message=f"Mensaje {i}"))
+        history.append(MessageTurn(role="assistant", message=f"Respuesta {i}"))
+    return history
+
+
+def test_trim_for_response_keeps_last_5_per_role():
+    trimmed = trim_for_response(conversation(12))
+    assert [m.message for m in trimmed if m.role == "user"] == [f"Mensaje {i}" for i in range(8, 13)]
+    assert [m.message for m in trimmed if m.role == "assistant"] == [f"Respuesta {i}" for i in range(8, 13)]
+    assert trimmed[0].message == "Mensaje 8"
+
+
+def test_trim_history_keeps_last_10_per_role():
+    trimmed = trim_history(conversation(30))
+    assert len(trimmed) == 20
+    assert trimmed[0].message == "Mensaje 21"
+    assert trimmed[-1].message == "Respuesta 30"
+
+
+def test_trim_history_with_repeated_messages():
+    """Un usuario que repite el mismo texto no debe generar turnos extra."""
+    history = []
+    for _ in range(15):
+        history.append(MessageTurn(role="user", message="Hola"))
+        history.append(MessageTurn(role="assistant", message="No"))
+
+    trimmed = trim_history(history)
+    assert len(trimmed) == 20
+
+
+def test_select_recent_stops_early_on_reverse_iterator():
+    """El motor deja de consumir el iterador en cuanto completa las cuotas."""
+    history = conversation(1000)
+    consumed = 0
+
+    def newest_first():
+        nonlocal consumed
+        for turn in reversed(history):
+            consumed += 1
+            yield turn
+
+    window = select_recent(newest_first(), {"user": 5, "assistant": 5})
+    assert len(window) == 10
+    assert consumed == 10
@@ -0,0 +1,248 @@
+# tests/test_write_behind.py
+"""
+Tests de la escritura diferida de turnos (app/write_behind.py).
+
+Objetivo:
+---------
+- Verificar que los turnos se escriben en lote (una transacción) y con el orden
+  y los contadores correctos.
+- Confirmar que el buffer sirve las lecturas mientras el turno no se escribió.
+- Confirmar el backpressure con el buffer lleno y el reintento de un lote fallido.
+- Confirmar que un turno que no se puede escribir se aísla y descarta sin
+  bloquear al resto del lote, y que su conversación sale de la caché.
+- Confirmar que `flush()` no descarta turnos ni detiene la tarea (solo `close()`).
+- Confirmar el flujo completo de /chat con la escritura diferida activa.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from uuid import UUID, uuid4
+
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import main, write_behind
+from app.cache import ConversationCache, conversation_cache
+from app.models import Conversation, Message
+from app.schemas import MessageTurn
+from app.write_behind import TurnWriter
+
+
+@pytest.fixture
+def test_sessions(db_engine, monkeypatch):
+    TestingSessionLocal = sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    monkeypatch.setattr(write_behind, "AsyncSessionLocal", TestingSessionLocal)
+    return TestingSessionLocal
+
+
+def make_turn(writer: TurnWriter, conv: Conversation, is_new: bool, text: str):
+    user, bot = MessageTurn(role="user", message=text), MessageTurn(role="assistant", message=f"re: {text}")
+    return writer.save(None, conv, is_new, [user], datetime.now(timezone.utc), bot, [user, bot])
+
+
+async def stored_messages(db_engine, conv_id: UUID):
+    async with db_engine.connect() as conn:
+        rows = await conn.execute(
+            select(Message.role, Message.content)
+            .where(Message.conversation_id == conv_id)
+            .order_by(Message.created_at, Message.id)
+        )
+        return [(role.value, content) for role, content in rows]
+
+
+@pytest.mark.asyncio
+async def test_turns_are_written_in_one_batch(db_engine, test_sessions):
+    writer = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=100)
+    first = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+    second = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+
+    await make_turn(writer, first, True, "a")
+    await make_turn(writer, first, False, "b")
+    await make_turn(writer, second, True, "c")
+
+    # Aún nada en la DB: el buffer sirve la conversación nueva
+    assert await stored_messages(db_engine, first.id) == []
+    conv, history = writer.lookup(first.id)
+    assert conv.topic == "t"
+    assert [turn.message for turn in history] == ["b", "re: b"]
+
+    await writer.flush()
+    assert writer.stats()["flushes"] == 1
+    assert writer.stats()["flushed_turns"] == 3
+    assert writer.lookup(first.id) is None
+
+    assert await stored_messages(db_engine, first.id) == [
+        ("user", "a"), ("assistant", "re: a"), ("user", "b"), ("assistant", "re: b"),
+    ]
+    async with test_sessions() as db:
+        counts = (await db.execute(
+            select(Conversation.message_count_user, Conversation.message_count_bot)
+            .where(Conversation.id == first.id)
+        )).one()
+    assert tuple(counts) == (2, 2)
+
+    # Turno de una conversación ya escrita: se actualizan sus contadores
+    await make_turn(writer, second, False, "d")
+    await writer.close()
+    async with test_sessions() as db:
+        counts = (await db.execute(
+            select(Conversation.message_count_user).where(Conversation.id == second.id)
+        )).scalar_one()
+    assert counts == 2
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_applies_backpressure(db_engine, test_sessions):
+    writer = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=2)
+    conv = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+
+    await make_turn(writer, conv, True, "a")
+    await make_turn(writer, conv, False, "b")
+    # Con 2 pendientes el tercer turno espera a que se escriba un lote
+    await asyncio.wait_for(make_turn(writer, conv, False, "c"), 5)
+
+    assert writer.stats()["backpressure_waits"] == 1
+    await writer.close()
+    assert len(await stored_messages(db_engine, conv.id)) == 6
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried(db_engine, test_sessions, monkeypatch):
+    writer = TurnWriter(enabled=True, max_delay=0, max_batch=100, max_pending=100)
+    conv = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+    calls = 0
+    original = write_behind.persist_turn_batch
+
+    async def flaky_batch(*args):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ConnectionError("DB caída")
+        return await original(*args)
+
+    monkeypatch.setattr(write_behind, "persist_turn_batch", flaky_batch)
+    await make_turn(writer, conv, True, "a")
+    await writer.close()
+
+    assert calls == 2
+    assert writer.stats()["failures"] == 1
+    assert await stored_messages(db_engine, conv.id) == [("user", "a"), ("assistant", "re: a")]
+
+
+@pytest.mark.asyncio
+async def test_flush_retries_without_dropping_turns(db_engine, test_sessions, monkeypatch):
+    writer = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=100)
+    convs = [Conversation(id=uuid4(), topic="t", stance="s", engine="local") for _ in range(2)]
+    calls = 0
+    original = write_behind.persist_turn_batch
+
+    async def flaky_batch(*args):
+        nonlocal calls
+        calls += 1
+        if calls <= 4:
+            raise ConnectionError("DB caída")
+        return await original(*args)
+
+    monkeypatch.setattr(write_behind, "persist_turn_batch", flaky_batch)
+
+    for i, conv in enumerate(convs):
+        await make_turn(writer, conv, True, f"m{i}")
+    # Más fallos seguidos que los intentos de `close()`: `flush()` sigue reintentando
+    await asyncio.wait_for(writer.flush(), 10)
+
+    assert writer.stats()["lost_turns"] == 0
+    assert all([len(await stored_messages(db_engine, conv.id)) == 2 for conv in convs])
+
+    # La tarea sigue corriendo y el próximo turno vuelve a esperar su lote
+    await make_turn(writer, convs[0], False, "otro")
+    await asyncio.sleep(0.1)
+    assert writer.contains(convs[0].id)
+    assert len(await stored_messages(db_engine, convs[0].id)) == 2
+    await writer.close()
+    assert len(await stored_messages(db_engine, convs[0].id)) == 4
+
+
+@pytest.mark.asyncio
+async def test_bad_turn_is_isolated_and_dropped(db_engine, test_sessions, monkeypatch):
+    writer = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=100)
+    convs = [Conversation(id=uuid4(), topic="t", stance="s", engine="local") for _ in range(4)]
+    cache = ConversationCache(max_entries=10, ttl=60, max_bytes=1 << 20, per_role=5)
+    monkeypatch.setattr(write_behind, "conversation_cache", cache)
+
+    for i, conv in enumerate(convs):
+        # El byte NUL no es válido en un texto de Postgres: el lote completo falla
+        text = "malo\x00" if i == 2 else f"m{i}"
+        await make_turn(writer, conv, True, text)
+        cache.store(conv.id, "t", "s", "local", writer.lookup(conv.id)[1], message_seq=2)
+    await make_turn(writer, convs[3], False, "otro")
+    await asyncio.wait_for(writer.close(), 5)
+
+    stats = writer.stats()
+    assert stats["lost_turns"] == 1
+    assert stats["flushed_turns"] == 4
+    assert stats["pending_turns"] == 0 and stats["buffered_conversations"] == 0
+    assert await stored_messages(db_engine, convs[0].id) == [("user", "m0"), ("assistant", "re: m0")]
+    assert await stored_messages(db_engine, convs[2].id) == []
+    # La entrada de la caché tenía el turno descartado; las demás siguen
+    assert not cache.contains(convs[2].id)
+    assert cache.contains(convs[0].id)
+    assert await stored_messages(db_engine, convs[3].id) == [
+        ("user", "m3"), ("assistant", "re: m3"), ("user", "otro"), ("assistant", "re: otro"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_turns_of_deleted_conversation_are_dropped(db_engine, test_sessions):
+    writer = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=100)
+    deleted = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+    kept = Conversation(id=uuid4(), topic="t", stance="s", engine="local")
+    await make_turn(writer, deleted, True, "a")
+    await make_turn(writer, kept, True, "b")
+    await writer.flush()
+
+    # La retención borra la conversación con un turno aún en el buffer
+    await make_turn(writer, deleted, False, "c")
+    await make_turn(writer, kept, False, "d")
+    async with test_sessions() as db:
+        await db.execute(delete(Conversation).where(Conversation.id == deleted.id))
+        await db.commit()
+    await asyncio.wait_for(writer.close(), 5)
+
+    assert writer.stats()["lost_turns"] == 1
+    assert writer.stats()["failures"] == 0
+    assert await stored_messages(db_engine, deleted.id) == []
+    assert len(await stored_messages(db_engine, kept.id)) == 4
+
+
+@pytest.mark.asyncio
+async def test_chat_with_write_behind(client, db_engine, test_sessions, monkeypatch):
+    writer = TurnWriter(enabled=True, max_delay=10, max_batch=100, max_pending=100)
+    monkeypatch.setattr(main, "turn_writer", writer)
+
+    async def fake_open_debate(_message):
+        return None
+
+    async def fake_detect(_message):
+        return "tema", "postura"
+
+    async def fake_llm(history, **_kwargs):
+        return f"respuesta {len(history)}"
+
+    monkeypatch.setattr(main, "open_debate", fake_open_debate)
+    monkeypatch.setattr(main, "detect_topic_and_stance", fake_detect)
+    monkeypatch.setattr(main, "ask_llm", fake_llm)
+
+    r1 = await client.post("/chat", json={"conversation_id": None, "message": "Hola"})
+    conv_id = r1.json()["conversation_id"]
+
+    # Sin caché de conversaciones, el segundo turno se sirve desde el buffer (aún no está en la DB)
+    conversation_cache.invalidate(UUID(conv_id))
+    r2 = await client.post("/chat", json={"conversation_id": conv_id, "message": "Sigo"})
+    assert r2.status_code == 200
+    assert [m["message"] for m in r2.json()["message"]] == ["Hola", "respuesta 1", "Sigo", "respuesta 3"]
+    assert await stored_messages(db_engine, UUID(conv_id)) == []
+
+    await writer.close()
+    assert len(await stored_messages(db_engine, UUID(conv_id))) == 4